@@ -10,12 +10,8 @@ Assumes input data are in 32616  (UTM 16N, WGS-84) and output data are in 4326 (
 
 """
 import os
-import numpy as np
-import rasterio as rio
-import pandas as pd
-import geopandas as gpd
-import fiona
-from geofeather import to_geofeather, from_geofeather
+from raster_points import raster_to_points, raster_to_points_file
+from point_store import write_partitioned, write_points, points_format
 import time
 import datetime
 
@@ -30,71 +26,15 @@ def time_elapsed(start_time):
     return str(datetime.timedelta(seconds=te))
 
 
-def get_valid_indices(msked_array):
-    # Return tuples of indices for valid (unmasked) values in a masked array
-    rows, cols = np.where(~msked_array.mask)
-    indices = list(zip(rows, cols))
-    return indices
-
-
-def raster_to_points(raster_source, cols, type):
-    # Create point data frame from masked raster and reproject to EPSG 4326
-
-    print("Processing {}".format(raster_source))
-
-    # Read raster into a masked numpy array
-    with rio.open(raster_source) as src:
-        raster_np = src.read(1, masked=True)  # as NumPy masked array
-        # Does not automatically mask nan values, so update the mask (in place)
-        raster_np = np.ma.masked_invalid(raster_np, copy=False)
-        raster_meta = src.meta
-        print(raster_meta)
-        # Cell indices for valid values (non-masked) in the raster
-        indices = get_valid_indices(raster_np)
-        # Initiate arrays to store x,y,z values from raster
-        x_coords = []
-        y_coords = []
-        vals = []
-        # Get x,y coords in projection and associated value
-        for row, col in indices:
-            x, y = src.xy(row, col)
-            val = raster_np[row][col]
-            x_coords.append(x)
-            y_coords.append(y)
-            vals.append(val)
-    print(x_coords[250], y_coords[250], vals[250])  # print an example
-
-    # Create Pandas Data Frame with x, y, z values -- set of parallel lists
-    # The data as a set of parallel lists
-    rasterpts_xyz = {
-        cols['z']: vals,
-        cols['x']: x_coords,
-        cols['y']: y_coords
-    }
-    pts_df = pd.DataFrame(rasterpts_xyz)
-    print(pts_df)
-
-    # Return a simple data frame or geodataframe depending on type requested
-    if type == 'df':
-        return pts_df
-
-    elif type == 'gdf':
-        pts_gdf = gpd.GeoDataFrame(pts_df, geometry=gpd.points_from_xy(pts_df[cols['x']], pts_df[cols['y']]))
-        print(pts_gdf)
-
-        # Get CRS from input raster and convert it to right format to assign to CRS of GeoData Frame
-        raster_epsg = raster_meta['crs'].to_epsg()
-        pts_gdf.crs = fiona.crs.from_epsg(raster_epsg)
-
-        # Reproject points to EPSG 4326
-        pts_latlon_gdf = pts_gdf.to_crs(epsg=4326)
-        print(pts_latlon_gdf)
-
-        return pts_latlon_gdf
-
-
-def main(in_dir, in_file, out_dir, out_layer):
+def main(in_dir, in_file, out_dir, out_layer, stream=False, partition=False, out_format='feather', geometry=True):
     # Main Script to convert raster to points and export to Geofeather
+    # stream=True reads the raster one block window at a time and writes points to the output as it goes,
+    # for rasters that don't fit in memory
+    # partition=True writes the points as a store partitioned by SRTM tile (<out_layer>_tiles directory),
+    # instead of (stream=True) or in addition to (stream=False) a single geofeather file
+    # out_format='parquet' writes the single file as GeoParquet instead of geofeather
+    # geometry=False (stream=False only) keeps the points as a compact point table with lon/lat columns
+    # and no geometry column (see point_table.py)
 
     # Define output columns
     out_columns = {
@@ -105,18 +45,33 @@ def main(in_dir, in_file, out_dir, out_layer):
     # Create point geodataframe from raster
     raster_file_path = os.path.join(in_dir, in_file)
     print("Processing {}".format(raster_file_path))
+    points_path = os.path.join(out_dir, "{}.{}".format(out_layer, out_format))
+    store_dir = os.path.join(out_dir, "{}_tiles".format(out_layer))
+
+    if stream:
+        start_time = time.time()
+        if partition:
+            pt_count = raster_to_points_file(raster_file_path, out_columns, store_dir, out_format='partitioned')
+        else:
+            pt_count = raster_to_points_file(raster_file_path, out_columns, points_path, out_format=out_format)
+        print("Streaming conversion and export time for {0} ({1} points): {2}".format(
+            store_dir if partition else points_path, pt_count, time_elapsed(start_time)))
+        return
 
     start_time = time.time()
-    out_gdf = raster_to_points(raster_file_path, out_columns, type='gdf')
+    # The whole raster is reprojected at once, spread over threads
+    out_gdf = raster_to_points(raster_file_path, out_columns, type='gdf' if geometry else 'xy',
+                               threads=os.cpu_count())
     print(out_gdf)
     print("Raster to points conversion time {0}: {1}".format(in_file, time_elapsed(start_time)))
 
-    #  Export final Geodataframe to Geofeather format
-    print("Exporting to Geofeather format")
-    geofeather_path = os.path.join(out_dir, "{}.feather".format(out_layer))
+    #  Export final points (geofeather, GeoParquet or point table file)
+    print("Exporting to {} format".format(points_format(out_gdf, points_path)))
     start_time = time.time()
-    to_geofeather(out_gdf, geofeather_path)
-    print("Export execution time for {0}: {1}".format(geofeather_path, time_elapsed(start_time)))
+    write_points(out_gdf, points_path)
+    print("Export execution time for {0}: {1}".format(points_path, time_elapsed(start_time)))
+    if partition:
+        write_partitioned(out_gdf, store_dir)
 
 
 
@@ -132,4 +87,4 @@ if __name__ == '__main__':
     dest_dir = '/Users/arbailey/natcap/idb/data/work/bathy'
     out_layer = 'conabio_batimv2uw_pts'
 
-    main(conabio_bathy_dir, conabio_bathy_file, dest_dir, out_layer)
+    main(conabio_bathy_dir, conabio_bathy_file, dest_dir, out_layer, stream=True, partition=True)
@@ -11,13 +11,13 @@ Assumes all data are in 4326 (lat/long WGS-84)
 """
 
 import os
-import numpy as np
-import rasterio as rio
 # import pandas as pd
-import geopandas as gpd
 # import fiona
 # from shapely.geometry import box
-from geofeather import to_geofeather, from_geofeather
+from point_store import read_points, write_points
+from point_sample import point_xy, sample_rasters
+from point_presence import (polygon_tree, presence_flags, presence_raster, raster_presence_flags,
+                            compare_presence)
 import time
 import datetime
 
@@ -33,114 +33,58 @@ def time_elapsed(start_time):
     return str(datetime.timedelta(seconds=te))
 
 
-def mangrove_poly_to_gdf(source_path, mangrove_attribute):
+def mangrove_presence(pt_gdf, source_path, mangrove_attribute, x, y, presence_grid=None, presence_dir=None,
+                      resolution=None, all_touched=False, compare=False):
     """
 
-    Creates a geodataframe with a single attribute column for mangrove presence/absence
+    Add a mangrove presence/absence flag column to the points for a mangrove polygon layer
     Assumes the source polygons are only mangrove presence
+    By default points are tested against the polygons (exact). If presence_grid is given, the polygons
+    are rasterized once to a cached presence raster on that grid and the flags are raster lookups instead
+    :param pt_gdf:  Points to get the mangrove attribute, modified in place
     :param source_path: Path to the source vector data
     :param mangrove_attribute:  column name for the mangrove presence attribute
-    :return:  Geodataframe with the single attribute for mangrove presence
-    """
-
-    gdf = gpd.read_file(source_path)
-    gdf[mangrove_attribute] = 1
-    gdf = gdf[[mangrove_attribute, 'geometry']]
-    return gdf
-
-
-def mangrove_join(pt_gdf, mangrove_gdf):
-    """
-
-    :param pt_gdf:  Points to get the mangrove attributes
-    :param mangrove_gdf:  Geodataframe with the mangrove polygons and presence/absence attribute
-    :return:  joined_gdf:  Point geodataframe with mangrove presence/absence attributes
-    """
-
-    # Join Attributes of mangrove polygons to master point layer
-    start_time = time.time()
-    print("Joining mangrove polys with points GDF")
-    joined_gdf = gpd.sjoin(pt_gdf, mangrove_gdf, how="left")
-    joined_gdf = joined_gdf.drop(columns='index_right')
-    print("Joining execution time: {}".format(time_elapsed(start_time)))
-    return joined_gdf
-
-def point_coords(geom):
-    """
-    Return a single tuple with the x/y point coordinate for a GeoDataFrame geometry
-    :param geom: input a geometry object (from GDF, for example
-    :return: The first tuple in the list, which is a point
-    """
-    # Return a tuple with the x/y point coordinate for a GeoDataFrame geometry
-    return list(geom.coords)[0] # Just get first tuple in list, since it's a point
-
-
-def sample_raster(pt_gdf, raster_path, att):
-
-    start_time = time.time()
-    print("Sampling raster {} with points GDF".format(raster_path))
-
-    # Get the point coordinate tuples from the Point Geodatafram
-    pt_coords = pt_gdf.apply(lambda row: point_coords(row.geometry), axis=1)
-
-    # Sample the raster with point coordinates
-    with rio.open(raster_path) as rast:
-        print(rast.meta)
-        sample_gen = rast.sample(xy=pt_coords)
-        # Convert generator to a list for appending to geodataframe
-        # Conversion of generator to list crashes if points are not completely covered by the raster
-        # So, incorporated previous step for clipping the points with the raster bounding box
-        sample = list(sample_gen)
-
-    # Append sampled values to copy of the Geodataframe
-    pt_gdf_sampled = pt_gdf.copy()
-    pt_gdf_sampled[att] = np.vstack(sample)
-    print(pt_gdf_sampled)
-
-    print("Sample execution time for {0}: {1}".format(raster_path, time_elapsed(start_time)))
-
-    return pt_gdf_sampled
-
-
-def make_unique_raster(in_raster_path, out_raster_path):
-    """
-
-    :param in_raster_path:
-    :param out_raster_path:
-    :return:
+    :param x: NumPy array of point x coordinates
+    :param y: NumPy array of point y coordinates
+    :param presence_grid: path to a raster defining the presence raster grid (e.g. SRTM or GMC), None for exact
+    :param presence_dir: directory for the cached presence rasters
+    :param resolution: presence raster cell size (default: cell size of presence_grid)
+    :param all_touched: True to flag all cells touched by a polygon, False for cells with their center in a polygon
+    :param compare: also compute the exact flags and report how many points differ from the raster flags
+    :return:  pt_gdf:  Point geodataframe with uint8 mangrove presence (1) / absence (0) attribute
     """
 
     start_time = time.time()
-    print("Creating a raster with unique cell IDS {}".format(out_raster_path))
-
-    # Create an array with unique ID for each pixel
-    with rio.open(in_raster_path) as src:
-        rows, cols = src.shape
-        raster_uniqueid_np = np.arange(rows * cols).reshape(rows, cols) + 1 # want to start at 1 and not zero for ids
-        raster_unique_meta = src.meta
-
-    # numpy datatype must match tiff output data type (?) - when I didn't do this I got errors
-    raster_uniqueid_np = raster_uniqueid_np.astype('uint32')
-    # Get metadata from source and apply to unique ID raster
-    raster_unique_meta['dtype'] = rio.uint32  # change data type to hold all values
-    raster_unique_meta['nodata'] = 0  # No data value
-    raster_unique_meta['driver'] = 'GTiff'
-
-    # Convert input raster to uniqueID raster
-    with rio.open(out_raster_path, 'w', **raster_unique_meta) as dst:
-        dst.write(raster_uniqueid_np, 1)
-
-    print("Create Unique ID execution time for {0}: {1}".format(out_raster_path, time_elapsed(start_time)))
-
-
-def main(tile, input_pt_feather):
+    print("Flagging points in mangrove polys {}".format(source_path))
+    if presence_grid is None:
+        pt_gdf[mangrove_attribute] = presence_flags(x, y, polygon_tree(source_path))
+    else:
+        presence_path = presence_raster(source_path, presence_grid, presence_dir, resolution, all_touched)
+        pt_gdf[mangrove_attribute] = raster_presence_flags(x, y, presence_path)
+        if compare:
+            exact_flags = presence_flags(x, y, polygon_tree(source_path))
+            print("Presence raster vs. polygon flags for {0}: {1}".format(
+                mangrove_attribute, compare_presence(exact_flags, pt_gdf[mangrove_attribute].values)))
+    print("{} points in mangroves".format(pt_gdf[mangrove_attribute].sum()))
+    print("Presence flag execution time: {}".format(time_elapsed(start_time)))
+    return pt_gdf
+
+
+def main(tile, input_pt_feather, presence_mode='polygon', resolution=None, all_touched=False, compare=False,
+         out_format='feather'):
+    # input_pt_feather is a geofeather or GeoParquet file from gliht_srtm_sample.py
+    # out_format is 'feather' (geofeather) or 'parquet' (GeoParquet)
+    # presence_mode 'polygon' flags points by exact point in polygon tests,
+    # 'raster' looks them up in presence rasters burned on the Canopy Height (GMC) grid and cached in work_dir
+    # resolution (raster mode) is the presence raster cell size, None for the GMC cell size
+    # Presence columns are uint8 1 (mangrove) / 0 (no mangrove), no longer 1 / NaN
 
     # Data Directories
     data_dir = '/Users/arbailey/natcap/idb/data/work/mangroves'
     work_dir = os.path.join(data_dir, 'yucatan')
     pt_data_source = os.path.join(work_dir, input_pt_feather)
 
-    out_feather_path = os.path.join(work_dir, "gliht_srtm_mangroves_{}.feather".format(tile))
+    out_feather_path = os.path.join(work_dir, "gliht_srtm_mangroves_{}.{}".format(tile, out_format))
 
     # --- Mangrove Max Height raster
     hmax_source = os.path.join(data_dir, 'gmc_hmax95_bahamas_MAR.tif')
@@ -149,31 +93,21 @@ def main(tile, input_pt_feather):
     #--- Load the G-LiHT/SRTM points
     print("Loading data from: {}".format(pt_data_source))
     start_time = time.time()
-    gliht_pts = from_geofeather(os.path.join(work_dir, pt_data_source))
+    gliht_pts = read_points(pt_data_source)
     print("Load time for {0}: {1}".format(pt_data_source, time_elapsed(start_time)))
     gliht_pts.drop(columns=['index'], inplace=True)
     print(gliht_pts.dtypes)
     print(gliht_pts)
 
-    # Sample the Canopy Height rasters
-    # Max Height - hmax95
-    # gliht_pts = sample_raster(gliht_pts[0:100], hmax_source, 'hmax95')
-    gliht_pts = sample_raster(gliht_pts, hmax_source, 'hmax95')
-    print(gliht_pts.dtypes)
-    print(gliht_pts)
-    # Weighted Average Height - hba95
-    gliht_pts = sample_raster(gliht_pts, hba_source, 'hba95')
-    print(gliht_pts.dtypes)
-    print(gliht_pts)
-
-    # # Create unique index value for Canopy raster
-    gmc_unique_source = os.path.join(work_dir, "gmc_uniqueid.tif")
-    # make_unique_raster(hmax_source, gmc_unique_source)  # Takes 1:55:14.79
-    #
-    # Sample Unique ID raster
-    gliht_pts = sample_raster(gliht_pts, gmc_unique_source, 'hmax_idx')
-    # gliht_pts.reset_index(inplace=True)
-    # gliht_pts.drop(columns=['index'], inplace=True)
+    # Sample the Canopy Height rasters in one pass, adding columns in place
+    # Max Height - hmax95, Weighted Average Height - hba95
+    # and the unique index value of the Canopy raster cell for each point
+    # (computed from the grid, used to be sampled from gmc_uniqueid.tif which took 1:55:14.79 to create)
+    start_time = time.time()
+    sample_rasters(gliht_pts,
+                   [(hmax_source, 'hmax95'), (hba_source, 'hba95')],
+                   index_columns=[(hmax_source, 'hmax_idx')])
+    print("Sample execution time: {}".format(time_elapsed(start_time)))
     print(gliht_pts.dtypes)
     print(gliht_pts)
 
@@ -183,37 +117,36 @@ def main(tile, input_pt_feather):
     print(gliht_pts.dtypes)
     print(gliht_pts)
 
-    # Mangrove Extent Vector shapefile paths to join to Points
+    # Mangrove Extent Vector shapefile paths to flag Points with presence/absence
+    pt_x, pt_y = point_xy(gliht_pts)
+    presence_options = {}
+    if presence_mode == 'raster':
+        presence_options = {
+            'presence_grid': hmax_source,
+            'presence_dir': os.path.join(work_dir, 'presence'),
+            'resolution': resolution,
+            'all_touched': all_touched,
+            'compare': compare,
+        }
     #-- World Atlas of Mangroves
     wam_path = os.path.join(data_dir, 'wam_Bahamas_MAR.shp')
     wam_att = 'wam'
-    wam = mangrove_poly_to_gdf(wam_path, wam_att)
-    print(wam)
-    gliht_pts = mangrove_join(gliht_pts, wam)
-    print(gliht_pts)
+    mangrove_presence(gliht_pts, wam_path, wam_att, pt_x, pt_y, **presence_options)
 
     #-- Global Mangrove Watch
     gmw2016_path = os.path.join(data_dir, 'gmw2016_Bahamas_MAR.shp')
     gmw2016_att = 'gmw2016'
-    gmw2016 = mangrove_poly_to_gdf(gmw2016_path, gmw2016_att)
-    print(gmw2016)
-    gliht_pts = mangrove_join(gliht_pts, gmw2016)
-    print(gliht_pts)
+    mangrove_presence(gliht_pts, gmw2016_path, gmw2016_att, pt_x, pt_y, **presence_options)
 
     # Global Mangrove Forests
     gmf_path = os.path.join(data_dir, 'gmf_bahamas_MAR.shp')
     gmf_att = 'gmf'
-    gmf = mangrove_poly_to_gdf(gmf_path, gmf_att)
-    print(gmf)
-    gliht_pts = mangrove_join(gliht_pts, gmf)
-    print(gliht_pts)
+    mangrove_presence(gliht_pts, gmf_path, gmf_att, pt_x, pt_y, **presence_options)
 
     # NAtCap Mangrove compilation for MAR region (Mex, Belize, Guatemala, Honduras)
     ncmar_path = os.path.join(data_dir, 'natcap_mangrovesV4_MAR.shp')
     ncmar_att = 'ncMAR'
-    ncmar = mangrove_poly_to_gdf(ncmar_path, ncmar_att)
-    print(ncmar)
-    gliht_pts = mangrove_join(gliht_pts, ncmar)
+    mangrove_presence(gliht_pts, ncmar_path, ncmar_att, pt_x, pt_y, **presence_options)
     print(gliht_pts)
 
     print(gliht_pts.dtypes)
@@ -223,9 +156,9 @@ def main(tile, input_pt_feather):
     gliht_pts.reset_index(inplace=True)  # get an error from feather export if don't do this
     # ValueError: feather does not support serializing a non-default index for the index; you can .reset_index() to make the index into column(s)
     print(gliht_pts.dtypes)
-    print("Exporting to Geofeather format")
+    print("Exporting to {} format".format(out_format))
     start_time = time.time()
-    to_geofeather(gliht_pts, out_feather_path)
+    write_points(gliht_pts, out_feather_path)
     print("Export execution time for {0}: {1}".format(out_feather_path, time_elapsed(start_time)))
 
 
@@ -6,22 +6,36 @@ Date: 2020-02-28
 Convert G-LiHT grids to merged point data set
 Output to geofeather file for subsequent processing
 
+DTM and CHM tiles on the same grid are read together into one point table. CHM heights for other tiles
+are joined to DTM points on a packed int64 cell key (gliht_cellkey) rather than float x/y coordinates
+
 Assumes input data are in 32616  (UTM 16N, WGS-84) and output data are in 4326 (lat/long WGS-84)
 
 """
 import os
+import time
+import shutil
+import datetime
+import multiprocessing
 import numpy as np
-import rasterio as rio
 import pandas as pd
-import geopandas as gpd
-import fiona
-from geofeather import to_geofeather, from_geofeather
+from geofeather import to_geofeather
+from raster_points import raster_to_points, raster_pair_to_points, grids_match, key_join
+from point_table import write_point_table
+from point_store import (read_points, append_points, append_partitioned, close_writers, write_partition_index,
+                         points_crs, raster_bounds, bounds_overlap)
+from tile_farm import physical_cores
+
+
+def time_elapsed(start_time):
+    """
+    Calculate a string representation of  elapsed time given an input start time
+    :param start_time: Start time
+    :return: current time - start time formatted as hours:minutes:seconds
+    """
+    te = time.time() - start_time
+    return str(datetime.timedelta(seconds=te))
 
-def get_valid_indices(msked_array):
-    # Return tuples of indices for valid (unmasked) values in a masked array
-    rows, cols = np.where(~msked_array.mask)
-    indices = list(zip(rows, cols))
-    return indices
 
 def getfilelist(in_file):
     # Get a list of files from an input text file
@@ -29,121 +43,226 @@ def getfilelist(in_file):
     print(files)
     return files
 
-def process_files(in_chmdir, in_chmfiles, in_dtmdir, in_dtmfiles, out_dir, out_layer):
 
-    ## -------- DTM ------------
-    # Create point geodataframes from DTM tif files in file list
+def make_ptid(pts_df, columns):
+    """
+    String point id made from the x and y coordinates, 'x_y'
+    The integer cell key column is the compact id for joins -- this is only for when a readable id is needed
+    :param pts_df: point data frame
+    :param columns: columns dictionary with the 'x' and 'y' column names
+    :return: Pandas Series of string ids
+    """
+    return pts_df[columns['x']].astype(str) + "_" + pts_df[columns['y']].astype(str)
+
+
+def tile_name(filename):
+    """
+    G-LiHT tile name shared by the CHM and DTM files of a tile, filename without the product suffix
+    e.g. AMIGACarb_Out_of_the_Yuc_GLAS_May2013_l1s447_CHM.tif -> AMIGACarb_Out_of_the_Yuc_GLAS_May2013_l1s447
+    :param filename: G-LiHT raster file name
+    :return: tile name
+    """
+    return os.path.splitext(os.path.basename(filename))[0].rsplit('_', 1)[0]
+
+
+def pair_tiles(in_chmdir, in_chmfiles, in_dtmdir, in_dtmfiles):
+    """
+    Find the DTM and CHM tiles that are on the same grid, so they can be read together without a join
+    :param in_chmdir: directory with the CHM rasters
+    :param in_chmfiles: list of CHM raster file names
+    :param in_dtmdir: directory with the DTM rasters
+    :param in_dtmfiles: list of DTM raster file names
+    :return: dictionary of DTM file name: CHM file name for co-registered pairs
+    """
+    chm_by_tile = {tile_name(file): file for file in in_chmfiles}
+    pairs = {}
+    for dtm_file in in_dtmfiles:
+        chm_file = chm_by_tile.get(tile_name(dtm_file))
+        if chm_file and grids_match(os.path.join(in_dtmdir, dtm_file), os.path.join(in_chmdir, chm_file)):
+            pairs[dtm_file] = chm_file
+    return pairs
+
+
+def convert_tile(task):
+    """
+    Convert one G-LiHT raster tile (or a co-registered DTM/CHM pair) to points and write it as a partition
+    of the output data set
+    Run in a worker process by process_files, so it takes a single tuple argument
+    :param task: tuple of (tuple of one or two raster paths, output columns dictionary, 'df', 'gdf' or 'xy',
+        partition path)
+    :return: partition path
+    """
+    raster_paths, columns, type, part_path = task
+    if len(raster_paths) == 2:
+        pts = raster_pair_to_points(raster_paths[0], raster_paths[1], columns, type=type)
+    else:
+        pts = raster_to_points(raster_paths[0], columns, type=type)
+    if type == 'gdf':
+        to_geofeather(pts, part_path)
+    elif type == 'xy':
+        write_point_table(pts, part_path)
+    else:
+        pts.to_feather(part_path)
+    return part_path
+
+
+def convert_tiles(tasks, workers):
+    """
+    Convert a list of raster tiles to point partitions, in parallel if more than one worker
+    :param tasks: list of convert_tile task tuples
+    :param workers: number of worker processes
+    :return: list of partition paths, in the same order as tasks
+    """
+    for task in tasks:
+        os.makedirs(os.path.dirname(task[3]), exist_ok=True)
+    if workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            part_paths = pool.map(convert_tile, tasks, chunksize=1)
+    else:
+        part_paths = [convert_tile(task) for task in tasks]
+    return part_paths
+
+
+def join_chm(dtm_pts, dtm_bounds, chm_parts, dtm_columns, chm_columns):
+    """
+    Join CHM heights to the points of a DTM tile without a co-registered CHM tile, on the integer cell key
+    Only the cell key and height of the CHM partitions that overlap the DTM tile are read
+    :param dtm_pts: DTM point GeoDataFrame or point table
+    :param dtm_bounds: (left, bottom, right, top) of the DTM tile
+    :param chm_parts: list of (CHM tile bounds, CHM partition path)
+    :param dtm_columns: DTM columns dictionary with the 'key' column name
+    :param chm_columns: CHM columns dictionary with the 'key' and 'z' column names
+    :return: NumPy float32 array of CHM heights, NaN for DTM points with no CHM cell
+    """
+    overlap_parts = [part for bounds, part in chm_parts if bounds_overlap(bounds, dtm_bounds)]
+    if not overlap_parts:
+        return np.full(len(dtm_pts), np.nan, dtype=np.float32)
+    chm_read_columns = [chm_columns['key'], chm_columns['z']]
+    chm_df = pd.concat([pd.read_feather(part, columns=chm_read_columns) for part in overlap_parts],
+                       axis=0, ignore_index=True)
+    return key_join(dtm_pts[dtm_columns['key']].values, chm_df[chm_columns['key']].values,
+                    chm_df[chm_columns['z']].values).astype(np.float32)
+
+
+def process_files(in_chmdir, in_chmfiles, in_dtmdir, in_dtmfiles, out_dir, out_layer, workers=1, ptid=True,
+                  partition=False, out_format='feather', geometry=True, keep_parts=False):
+    """
+    Convert G-LiHT DTM and CHM tiles to points, join CHM heights to the DTM points and export to geofeather
+    Each tile is converted (and reprojected) separately and written to a partition under
+    <out_dir>/<out_layer>_parts, then the partitions are appended to the merged data set one at a time
+    DTM and CHM tiles on the same grid are read together in one pass; only the remaining
+    tiles go through the cell key join, with the CHM tiles that overlap them
+    :param in_chmdir: directory with the CHM rasters
+    :param in_chmfiles: list of CHM raster file names
+    :param in_dtmdir: directory with the DTM rasters
+    :param in_dtmfiles: list of DTM raster file names
+    :param out_dir: output directory
+    :param out_layer: output layer name (feather file name without extension)
+    :param workers: number of worker processes used to convert tiles
+    :param ptid: also add the gliht_ptid string id column (x_y, used by gliht_srtm5.ipynb), which is slow and large
+        for big point sets; False to skip it
+    :param partition: also write the points as a store partitioned by SRTM tile, <out_dir>/<out_layer>_tiles
+    :param out_format: 'feather' for geofeather or 'parquet' for GeoParquet output (<out_dir>/<out_layer>.<out_format>)
+    :param geometry: False to keep the points as a compact point table with lon/lat columns and no geometry
+        column throughout (see point_table.py), which the samplers read directly
+    :param keep_parts: keep the <out_dir>/<out_layer>_parts tile partitions after the output is written
+    :return: number of points written
+    """
+    start_time = time.time()
+    part_dir = os.path.join(out_dir, "{}_parts".format(out_layer))
+
     dtm_columns = {
         'x': 'x_utm16n',
         'y': 'y_utm16n',
         'z': 'z_dtm_m',
+        'key': 'gliht_cellkey',
     }
-    out_dtm_gdfs = []
-    for file in in_dtmfiles:
-        print("Processing {}".format(file))
-        dtm_file_path = os.path.join(in_dtmdir, file)
-        dtm_gdf = raster_to_points(dtm_file_path, dtm_columns, type='gdf')
-        out_dtm_gdfs.append(dtm_gdf)
-    print("{} DTM data frames combined".format(len(out_dtm_gdfs)))
-
-    # Concat all the point DTM gdfs into a single gdf
-    print("Concatenating DTM geodataframes")
-    concat_dtm_gdf = pd.concat(out_dtm_gdfs, axis=0, ignore_index=True)
-    # Add a unique ID for each point
-    concat_dtm_gdf['gliht_ptidx'] = concat_dtm_gdf.index + 1
-    concat_dtm_gdf['gliht_ptid'] = concat_dtm_gdf[dtm_columns['x']].astype(str) + "_" + concat_dtm_gdf[dtm_columns['y']].astype(str)
-    print(concat_dtm_gdf)
-
-    ## --------- CHM ------------
-    # Create point geodataframes from CHM tif files in file list
     chm_columns = {
         'x': 'x_utm16n',
         'y': 'y_utm16n',
         'z': 'z_chm_m',
+        'key': 'gliht_cellkey',
     }
-    out_chm_dfs = []
-    for file in in_chmfiles:
-        print("Processing {}".format(file))
-        chm_file_path = os.path.join(in_chmdir, file)
-        chm_df = raster_to_points(chm_file_path, chm_columns, type='df')
-        out_chm_dfs.append(chm_df)
-    print("{} CHM data frames combined".format(len(out_chm_dfs)))
-
-    # Concat all the point CHM gdfs into a single gdf
-    print("Concatenating CHM geodataframes")
-    concat_chm_df = pd.concat(out_chm_dfs, axis=0, ignore_index=True)
-    print(concat_chm_df)
-
-    #----------- Join and Export -------------
-    # Join the CHM and the DTM GeoDataframes
-    print("Joining CHM and DTM Geodataframes")
-    chm_dtm_gdf = pd.merge(concat_dtm_gdf, concat_chm_df, how='left',on=[dtm_columns['x'], dtm_columns['y']])
-    print(chm_dtm_gdf)
-
-    #  Export final Geodataframe
-    print("Exporting to Geofeather format")
-    geofeather_path = os.path.join(dest_dir, "{}.feather".format(out_layer))
-    to_geofeather(chm_dtm_gdf, geofeather_path)
-
-    # # export to Geopackage
-    # print("Exporting to Geopackage")
-    # chm_dtm_gdf.to_file(os.path.join(out_dir, "gliht_yucatan.gpkg"), layer=out_layer, driver="GPKG")
-
-
-def raster_to_points(raster_source, cols, type):
-
-    print("Processing {}".format(raster_source))
-
-    # Read GLiHT data into a masked numpy array
-    with rio.open(raster_source) as src:
-        raster_np = src.read(1, masked=True)  # as NumPy masked array
-        # Does not automatically mask nan values, so update the mask (in place)
-        raster_np = np.ma.masked_invalid(raster_np, copy=False)
-        raster_meta = src.meta
-        print(raster_meta)
-        # Cell indices for valid values (non-masked) in the raster
-        indices = get_valid_indices(raster_np)
-        # Initiate arrays to store x,y,z values from raster
-        x_coords = []
-        y_coords = []
-        vals = []
-        # Get x,y coords in projection and associated value
-        for row, col in indices:
-            x, y = src.xy(row, col)
-            val = raster_np[row][col]
-            x_coords.append(x)
-            y_coords.append(y)
-            vals.append(val)
-    # print(x_coords[250], y_coords[250], vals[250])  # print an example
-
-    # Create Pandas Data Frame with x, y, z values -- set of parallel lists
-    # The data as a set of parallel lists
-    rasterpts_xyz = {
-        cols['z']: vals,
-        cols['x']: x_coords,
-        cols['y']: y_coords
-    }
-    pts_df = pd.DataFrame(rasterpts_xyz)
-    print(pts_df)
-
-    # Return a simple data frame or geodataframe depending on type requested
-    if type == 'df':
-        return pts_df
-
-    elif type == 'gdf':
-        pts_gdf = gpd.GeoDataFrame(pts_df, geometry=gpd.points_from_xy(pts_df[cols['x']], pts_df[cols['y']]))
-        print(pts_gdf)
+    # Co-registered DTM/CHM pairs add the CHM value to the DTM points directly
+    pair_columns = dict(dtm_columns, join_z=chm_columns['z'])
 
-        # Get CRS from GLiHT and convert it to right format to assign to CRS of GeoData Frame
-        raster_epsg = raster_meta['crs'].to_epsg()
-        pts_gdf.crs = fiona.crs.from_epsg(raster_epsg)
+    # DTM and CHM tiles on the same grid
+    pairs = pair_tiles(in_chmdir, in_chmfiles, in_dtmdir, in_dtmfiles)
+    print("{} of {} DTM tiles have a co-registered CHM tile".format(len(pairs), len(in_dtmfiles)))
 
-        # Reproject GLiHT points to SRTM CRS
-        pts_latlon_gdf = pts_gdf.to_crs(epsg=4326)
-        print(pts_latlon_gdf)
+    ## -------- DTM ------------
+    # Create point geodataframe (or point table) partitions from DTM tif files in file list
+    # (with CHM for co-registered pairs)
+    dtm_type = 'gdf' if geometry else 'xy'
+    dtm_tasks = []
+    for file in in_dtmfiles:
+        part_path = os.path.join(part_dir, 'dtm', "{}.feather".format(os.path.splitext(file)[0]))
+        if file in pairs:
+            raster_paths = (os.path.join(in_dtmdir, file), os.path.join(in_chmdir, pairs[file]))
+            dtm_tasks.append((raster_paths, pair_columns, dtm_type, part_path))
+        else:
+            dtm_tasks.append(((os.path.join(in_dtmdir, file),), dtm_columns, dtm_type, part_path))
+    dtm_parts = convert_tiles(dtm_tasks, workers)
+    print("{} DTM partitions written: {}".format(len(dtm_parts), time_elapsed(start_time)))
 
-        return pts_latlon_gdf
+    ## --------- CHM ------------
+    # Create point data frame partitions from the CHM tif files that overlap a DTM tile without
+    # a co-registered CHM tile -- the only ones the key join needs
+    unpaired_bounds = [raster_bounds(os.path.join(in_dtmdir, file)) for file in in_dtmfiles if file not in pairs]
+    paired_chm = set(pairs.values())
+    chm_bounds = []
+    chm_tasks = []
+    for file in in_chmfiles:
+        if file in paired_chm:
+            continue
+        bounds = raster_bounds(os.path.join(in_chmdir, file))
+        if any(bounds_overlap(bounds, dtm_bounds) for dtm_bounds in unpaired_bounds):
+            chm_bounds.append(bounds)
+            chm_tasks.append(((os.path.join(in_chmdir, file),), chm_columns, 'df',
+                              os.path.join(part_dir, 'chm', "{}.feather".format(os.path.splitext(file)[0]))))
+    chm_parts = list(zip(chm_bounds, convert_tiles(chm_tasks, workers)))
+    print("{} CHM partitions written: {}".format(len(chm_parts), time_elapsed(start_time)))
 
+    #----------- Join and Export -------------
+    # Append the DTM partitions to the output one at a time, so the merged data set is never held in memory
+    print("Exporting to {} format".format(out_format))
+    geofeather_path = os.path.join(out_dir, "{}.{}".format(out_layer, out_format))
+    store_dir = os.path.join(out_dir, "{}_tiles".format(out_layer))
+    if partition:
+        # Partitioned by SRTM tile so samplers can load only the tiles they need
+        os.makedirs(store_dir, exist_ok=True)
+    writers = {}
+    partitions = {}
+    pt_count = 0
+    crs = None
+    try:
+        for task, part_path in zip(dtm_tasks, dtm_parts):
+            pts = read_points(part_path)
+            # Add a unique ID for each point
+            pts['gliht_ptidx'] = np.arange(pt_count + 1, pt_count + len(pts) + 1)
+            if ptid:
+                pts['gliht_ptid'] = make_ptid(pts, dtm_columns)
+            if len(task[0]) == 2:
+                # Move the CHM column (from a co-registered pair) to the end, same column order as the keyed join
+                pts[chm_columns['z']] = pts.pop(chm_columns['z'])
+            else:
+                # Join CHM heights to the DTM points on the integer cell key
+                pts[chm_columns['z']] = join_chm(pts, raster_bounds(task[0][0]), chm_parts, dtm_columns, chm_columns)
+            append_points(writers, pts, geofeather_path)
+            if partition:
+                append_partitioned(writers, partitions, pts, store_dir)
+            pt_count += len(pts)
+            crs = points_crs(pts)
+            print("{} points written to {}".format(pt_count, geofeather_path))
+    finally:
+        close_writers(writers)
+    if partition:
+        write_partition_index(store_dir, partitions, crs)
+
+    if not keep_parts:
+        shutil.rmtree(part_dir)
+    print("Total processing time for {0}: {1}".format(geofeather_path, time_elapsed(start_time)))
+    return pt_count
 
 
 #### ---- SETUP and call main function ----------
@@ -190,7 +309,9 @@ if __name__ == '__main__':
     yucwest_dtm_files = getfilelist(os.path.join(yucwest_dtm_dir, yucwest_dtm_listfile))
     yucwest_out_lyr = 'gliht_yucatan_west_subset'
 
-    process_files(yucwest_chm_dir, yucwest_chm_files, yucwest_dtm_dir, yucwest_dtm_files, dest_dir, yucwest_out_lyr)
+    # One worker per physical core (cpu_count() also counts hyperthreads)
+    process_files(yucwest_chm_dir, yucwest_chm_files, yucwest_dtm_dir, yucwest_dtm_files, dest_dir, yucwest_out_lyr,
+                  workers=physical_cores(), partition=True)
 
 
 
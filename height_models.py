@@ -0,0 +1,179 @@
+""" height_models.py
+
+Date: 2026-10-18
+
+Registry of canopy height models that convert SRTM / TanDEM-X heights to mangrove canopy heights
+Used by srtm_mangrovehgt.py, which evaluates every requested model on one read of each tile window
+
+A height model is a HeightModel tuple with
+    evaluate(height_np, transform): NumPy array of model heights for a window of input heights,
+        transform is the affine transform of the window (only used by models that vary in space)
+    value_range(min_value, max_value): range of model heights for input heights in that range,
+        so the output data type is known without scanning the data
+
+Model types: linear (multiplier and offset), piecewise linear (interpolated between break points),
+lookup table (one value per integer input height) and regional (a different model inside each bounding box)
+
+Models are registered by name with register_model(), so worker processes look them up by name rather than
+pickling functions. The Simard et al (2019) models are registered as 'hmax_simard' and 'hba_simard'
+
+"""
+
+from collections import namedtuple
+import numpy as np
+
+# Simard et al (2019), https://doi.org/10.1038/s41561-018-0279-1
+HMAX_MULTIPLIER = 1.697
+HBA_MULTIPLIER = 1.0754
+
+HeightModel = namedtuple('HeightModel', ['name', 'description', 'evaluate', 'value_range'])
+
+# Registered models by name
+HEIGHT_MODELS = {}
+
+
+def register_model(model):
+    """
+    Add a model to the registry, replacing any model with the same name
+    :param model: HeightModel
+    :return: the model
+    """
+    HEIGHT_MODELS[model.name] = model
+    return model
+
+
+def get_models(names=None):
+    """
+    Registered models by name
+    :param names: list of model names, None for all registered models (in registration order)
+    :return: list of HeightModel
+    """
+    if names is None:
+        return list(HEIGHT_MODELS.values())
+    unknown = [name for name in names if name not in HEIGHT_MODELS]
+    if unknown:
+        raise ValueError("Unknown height models {}, registered: {}".format(unknown, list(HEIGHT_MODELS)))
+    return [HEIGHT_MODELS[name] for name in names]
+
+
+def fill_range(low, high, fill_value):
+    """
+    Range of model heights including the fill value of cells the model leaves undefined, so the output data type
+    can hold it (a NaN fill value makes the range floating point, so no integer type is chosen)
+    :param low: minimum model height
+    :param high: maximum model height
+    :param fill_value: model height of undefined cells
+    :return: (min, max)
+    """
+    if np.isnan(fill_value):
+        return float(low), float(high)
+    return min(low, fill_value), max(high, fill_value)
+
+
+def linear_model(name, multiplier, offset=0.0, description=''):
+    """
+    Height model multiplier * height + offset
+    """
+    def evaluate(height_np, transform):
+        return height_np * multiplier + offset
+
+    def value_range(min_value, max_value):
+        low, high = sorted((min_value * multiplier + offset, max_value * multiplier + offset))
+        return low, high
+
+    return HeightModel(name, description or "{} * h + {}".format(multiplier, offset), evaluate, value_range)
+
+
+def piecewise_model(name, heights, model_heights, description=''):
+    """
+    Piecewise linear height model, interpolated between break points and constant beyond the end points
+    :param heights: increasing input heights of the break points
+    :param model_heights: model heights at the break points
+    """
+    heights = np.asarray(heights, dtype=np.float64)
+    model_heights = np.asarray(model_heights, dtype=np.float64)
+
+    def evaluate(height_np, transform):
+        return np.interp(height_np, heights, model_heights)
+
+    def value_range(min_value, max_value):
+        return model_heights.min(), model_heights.max()
+
+    return HeightModel(name, description or "piecewise linear, {} break points".format(len(heights)),
+                       evaluate, value_range)
+
+
+def lookup_model(name, table, first_height=0, fill_value=np.nan, description=''):
+    """
+    Lookup table height model for integer input heights: model height = table[height - first_height]
+    :param table: model heights for input heights first_height, first_height + 1, ...
+    :param first_height: input height of the first table entry
+    :param fill_value: model height for input heights outside the table
+    """
+    table = np.asarray(table)
+
+    def evaluate(height_np, transform):
+        idx = height_np.astype(np.int64) - first_height
+        inside = (idx >= 0) & (idx < len(table))
+        model_dtype = np.result_type(table.dtype, np.min_scalar_type(fill_value))
+        model_np = np.full(height_np.shape, fill_value, dtype=model_dtype)
+        model_np[inside] = table[idx[inside]]
+        return model_np
+
+    def value_range(min_value, max_value):
+        values = table[np.isfinite(table)] if np.issubdtype(table.dtype, np.floating) else table
+        # heights outside the table are fill_value
+        return fill_range(values.min(), values.max(), fill_value)
+
+    return HeightModel(name, description or "lookup table, heights {} to {}".format(
+        first_height, first_height + len(table) - 1), evaluate, value_range)
+
+
+def regional_model(name, regions, default=None, fill_value=np.nan, description=''):
+    """
+    Height model with different coefficients per region: the model of the first region whose bounding box
+    contains the cell center is used, or the default model outside all regions
+    :param regions: list of ((left, bottom, right, top), HeightModel) pairs, in the raster CRS
+        (region models are evaluated on the cells of their region only, so they can't be regional models)
+    :param default: HeightModel outside all regions, None to use fill_value
+    :param fill_value: model height outside all regions when there is no default model
+    """
+    def evaluate(height_np, transform):
+        n_rows, n_cols = height_np.shape
+        # Cell center coordinates of the window
+        x = transform.c + transform.a * (np.arange(n_cols) + 0.5)
+        y = transform.f + transform.e * (np.arange(n_rows) + 0.5)
+        if default is None:
+            model_np = np.full(height_np.shape, fill_value, dtype=np.float64)
+        else:
+            model_np = np.asarray(default.evaluate(height_np, transform), dtype=np.float64)
+        done = np.zeros(height_np.shape, dtype=bool)
+        # Regions earlier in the list take precedence, cells already assigned to a region are skipped
+        for (left, bottom, right, top), model in regions:
+            in_cols = (x >= left) & (x <= right)
+            in_rows = (y >= bottom) & (y <= top)
+            if not in_cols.any() or not in_rows.any():
+                continue
+            in_region = np.outer(in_rows, in_cols) & ~done
+            model_np[in_region] = model.evaluate(height_np[in_region], transform)
+            done |= in_region
+        return model_np
+
+    def value_range(min_value, max_value):
+        ranges = [model.value_range(min_value, max_value) for _, model in regions]
+        if default is not None:
+            ranges.append(default.value_range(min_value, max_value))
+        low, high = min(low for low, _ in ranges), max(high for _, high in ranges)
+        # cells outside all regions are fill_value when there is no default model
+        if default is not None:
+            return low, high
+        return fill_range(low, high, fill_value)
+
+    return HeightModel(name, description or "regional, {} regions".format(len(regions)), evaluate, value_range)
+
+
+# Simard et al (2019) models
+register_model(linear_model('hmax_simard', HMAX_MULTIPLIER,
+                            description='Maximum canopy height, Simard et al (2019): 1.697 x Hsrtm'))
+register_model(linear_model('hba_simard', HBA_MULTIPLIER,
+                            description='Basal area weighted canopy height, Simard et al (2019): 1.0754 x Hsrtm'))
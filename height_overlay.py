@@ -0,0 +1,154 @@
+""" height_overlay.py
+
+Date: 2026-10-18
+
+Raster-native overlay of mangrove polygons and a mangrove height grid
+Used by srtm_mangrove_polygons.py, in place of vectorizing the height grid and running gpd.overlay
+
+The polygon ids are rasterized onto the height grid and the cells of every (polygon, height class) pair are counted
+and their areas summed with array reductions, one block of rows at a time. Height classes are the grid values
+(as with features.dataset_features) or height bins. Cells belong to the polygon that contains their center
+(the one with the largest poly_id where polygons overlap)
+
+Geometry is only built at the end, if requested: the cells of each (polygon, height class) are vectorized, dissolved
+and clipped to the polygon. These are the pieces gpd.overlay(mangrove_gdf, feats_gdf, how='intersection') returns,
+except for the slivers of polygons in cells whose center is outside the polygon
+
+"""
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import rasterio
+from rasterio import features
+from rasterio.windows import Window
+
+# Rows of the height grid read and reduced at a time
+OVERLAY_ROWS = 512
+# Authalic radius of the WGS84 ellipsoid, for cell areas of geographic grids (m)
+EARTH_RADIUS = 6371007.2
+# Columns added to the polygon attributes
+POLYGON_ID = 'poly_id'
+CELLS_COLUMN = 'cells'
+AREA_COLUMN = 'area_m2'
+
+
+def row_cell_areas(transform, crs, row_off, n_rows):
+    """
+    Area of one cell in each row of a grid, in square meters for geographic grids, else in CRS units
+    :param transform: affine transform of the grid (north up)
+    :param crs: CRS of the grid
+    :param row_off: first row
+    :param n_rows: number of rows
+    :return: NumPy array of n_rows cell areas
+    """
+    if crs is not None and crs.is_geographic:
+        # Spherical cell area between two latitudes: R^2 * dlon * (sin(lat1) - sin(lat2))
+        lat_edges = np.radians(transform.f + transform.e * np.arange(row_off, row_off + n_rows + 1))
+        return EARTH_RADIUS ** 2 * np.radians(abs(transform.a)) * np.abs(np.diff(np.sin(lat_edges)))
+    return np.full(n_rows, abs(transform.a * transform.e))
+
+
+def height_classes(height_np, bins=None):
+    """
+    Height class of each height: the height itself, or the lower edge of its bin
+    :param height_np: NumPy array of heights
+    :param bins: increasing bin edges, None to use the heights as classes
+    :return: NumPy array of height classes (NaN for heights outside the bins)
+    """
+    if bins is None:
+        return height_np
+    bins = np.asarray(bins, dtype=np.float64)
+    idx = np.digitize(height_np, bins) - 1
+    inside = (idx >= 0) & (idx < len(bins) - 1)
+    return np.where(inside, bins[np.clip(idx, 0, len(bins) - 2)], np.nan)
+
+
+def overlay_heights(hgtgrid_file, mangrove_gdf, attribute, bins=None, geometry=False, all_touched=False):
+    """
+    Area of every mangrove polygon in every height class of a height grid
+    :param hgtgrid_file: height grid, a masked height grid or a masked VRT (only unmasked cells are counted)
+    :param mangrove_gdf: mangrove polygons as a GeoDataFrame, in the CRS of the grid
+    :param attribute: name of the height class column (e.g. hba_m)
+    :param bins: increasing height bin edges, None for one class per grid value
+    :param geometry: True to also build the geometry of each (polygon, height class) piece
+    :param all_touched: count all cells touched by a polygon, not just cells with their center inside
+        (cells touched by several polygons are then counted for one of them)
+    :return: DataFrame (GeoDataFrame if geometry) with the polygon attributes, poly_id (index of mangrove_gdf,
+        the row number of the polygon in the layer unless the layer was subset), the height class, cells and
+        area_m2 for each (polygon, height class), None if no polygon has heights. Rows with the same index
+        (pieces of a split polygon, see layer_store.py) are counted as one polygon
+    """
+    # Polygons are numbered by position below, and given their index as poly_id at the end
+    poly_ids = mangrove_gdf.index.values
+    mangrove_gdf = mangrove_gdf.reset_index(drop=True)
+    sindex = mangrove_gdf.sindex
+    polygons = mangrove_gdf.geometry.values
+    counts = []
+    pieces = []
+    with rasterio.open(hgtgrid_file) as src:
+        class_dtype = src.dtypes[0] if bins is None else np.float64
+        for row_off in range(0, src.height, OVERLAY_ROWS):
+            window = Window(0, row_off, src.width, min(OVERLAY_ROWS, src.height - row_off))
+            window_transform = src.window_transform(window)
+            poly_idx = sindex.query(shapely.box(*src.window_bounds(window)), predicate='intersects')
+            if not len(poly_idx):
+                continue
+            # Burned in poly_id order, so cells of overlapping polygons go to the same polygon however the layer
+            # rows are ordered (the last one burned)
+            poly_idx = poly_idx[np.argsort(poly_ids[poly_idx], kind='stable')]
+            # Polygon ids are offset by one so 0 is no polygon
+            ids = features.rasterize(zip(polygons[poly_idx], poly_idx + 1),
+                                     out_shape=(window.height, window.width), transform=window_transform,
+                                     fill=0, all_touched=all_touched, dtype=np.int32)
+            height_np = src.read(1, window=window, masked=True)
+            valid = (ids > 0) & ~np.ma.getmaskarray(height_np)
+            if not valid.any():
+                continue
+            rows = np.nonzero(valid)[0]
+            classes = height_classes(height_np.data[valid], bins)
+            keep = ~np.isnan(classes) if bins is not None else slice(None)
+            window_df = pd.DataFrame({POLYGON_ID: ids[valid][keep] - 1, attribute: classes[keep]})
+            cell_areas = row_cell_areas(src.transform, src.crs, row_off, window.height)[rows][keep]
+            # One label per (polygon, height class) in this window
+            pairs, labels = np.unique(window_df[[POLYGON_ID, attribute]].to_numpy(), axis=0, return_inverse=True)
+            labels = labels.ravel()
+            window_counts = pd.DataFrame({POLYGON_ID: pairs[:, 0].astype(np.int64), attribute: pairs[:, 1],
+                                          CELLS_COLUMN: np.bincount(labels, minlength=len(pairs)),
+                                          AREA_COLUMN: np.bincount(labels, weights=cell_areas,
+                                                                   minlength=len(pairs))})
+            counts.append(window_counts)
+            if geometry:
+                label_np = np.zeros(valid.shape, dtype=np.int32)
+                label_cells = np.zeros(len(rows), dtype=np.int32) - 1
+                label_cells[keep] = labels
+                label_np[valid] = label_cells + 1
+                shapes = list(features.shapes(label_np, mask=label_np > 0, transform=window_transform))
+                shape_labels = np.array([int(value) - 1 for _, value in shapes])
+                pieces.append(gpd.GeoDataFrame({POLYGON_ID: pairs[shape_labels, 0].astype(np.int64),
+                                                attribute: pairs[shape_labels, 1]},
+                                               geometry=[shapely.geometry.shape(g) for g, _ in shapes],
+                                               crs=mangrove_gdf.crs))
+
+    if not counts:
+        return None
+    # Rows (pieces) of the same polygon share its poly_id, and are summed together
+    height_df = pd.concat(counts)
+    height_df[POLYGON_ID] = poly_ids[height_df[POLYGON_ID].values]
+    height_df = height_df.groupby([POLYGON_ID, attribute], as_index=False).sum()
+    height_df[attribute] = height_df[attribute].astype(class_dtype)
+    attributes = mangrove_gdf.drop(columns=mangrove_gdf.geometry.name).set_index(poly_ids)
+    attributes = attributes[~attributes.index.duplicated()]
+    height_df = attributes.join(height_df.set_index(POLYGON_ID), how='inner').rename_axis(POLYGON_ID).reset_index()
+    if not geometry:
+        return pd.DataFrame(height_df)
+
+    # Cells of each (polygon, height class), clipped to the polygon and dissolved across row blocks and pieces
+    pieces_gdf = pd.concat(pieces, ignore_index=True)
+    pieces_gdf['geometry'] = shapely.intersection(pieces_gdf.geometry.values,
+                                                  polygons[pieces_gdf[POLYGON_ID].values])
+    pieces_gdf[POLYGON_ID] = poly_ids[pieces_gdf[POLYGON_ID].values]
+    pieces_gdf = pieces_gdf.dissolve(by=[POLYGON_ID, attribute]).reset_index()
+    pieces_gdf = pieces_gdf.merge(height_df, on=[POLYGON_ID, attribute])
+    return gpd.GeoDataFrame(pieces_gdf, geometry='geometry', crs=mangrove_gdf.crs)
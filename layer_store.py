@@ -0,0 +1,132 @@
+""" layer_store.py
+
+Date: 2026-10-18
+
+On-disk store of a polygon layer (mangrove extent layers) shared by tile worker processes
+Used by srtm_mangrove_polygons.py
+
+The layer is written once to GeoParquet, sorted along a Hilbert curve and with a bounding box column (GeoParquet 1.1
+covering), so each worker reads only the row groups and polygons whose bounding box intersects its tile, instead of
+being sent a pickled copy of the whole layer. Polygons keep their row number in the source layer as poly_id
+
+Polygons spanning more than one 1 degree (SRTM tile) cell are split into pieces along the cell edges when the store
+is written, so a tile reads only its piece of a very large polygon. read_tile_polygons clips the polygons read for
+a tile to the tile, so the overlay only intersects the parts of the polygons inside the tile. Pieces of a split
+polygon share its poly_id (see height_overlay.py)
+
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import shapely
+import geopandas as gpd
+from height_overlay import POLYGON_ID
+from point_parquet import COMPRESSION, BBOX_COLUMN, BBOX_FIELDS
+from tile_farm import outputs_current
+
+# Polygons per row group, the unit of bounding box pruning when a tile is read
+LAYER_ROW_GROUP_SIZE = 5000
+# Size of the cells polygons are split into (in layer CRS units, one SRTM tile in degrees)
+SPLIT_SIZE = 1.0
+
+
+def layer_store_path(layer_path, store_dir=''):
+    """
+    Path of the store of a polygon layer
+    :param layer_path: path to the source vector layer
+    :param store_dir: directory for layer stores ('' for the current directory)
+    :return: path <store_dir>/<layer name>.parquet
+    """
+    return os.path.join(store_dir, '{}.parquet'.format(os.path.splitext(os.path.basename(layer_path))[0]))
+
+
+def write_layer_store(layer, out_path):
+    """
+    Write a polygon layer to a spatially sorted GeoParquet store, unless the store is newer than the layer file
+    :param layer: path to the source vector layer, or a GeoDataFrame (always written)
+    :param out_path: output GeoParquet path (see layer_store_path)
+    :return: out_path
+    """
+    if isinstance(layer, gpd.GeoDataFrame):
+        layer_gdf = layer
+    elif outputs_current([layer], [out_path]):
+        print("Using layer store {}".format(out_path))
+        return out_path
+    else:
+        layer_gdf = gpd.read_file(layer)
+    print("Writing layer store {}".format(out_path))
+    layer_gdf = layer_gdf.reset_index(drop=True)
+    layer_gdf[POLYGON_ID] = layer_gdf.index.values
+    layer_gdf = split_polygons(layer_gdf)
+    layer_gdf = layer_gdf.iloc[layer_gdf.hilbert_distance().argsort()]
+    layer_gdf.to_parquet(out_path, index=False, compression=COMPRESSION, write_covering_bbox=True,
+                         row_group_size=LAYER_ROW_GROUP_SIZE)
+    return out_path
+
+
+def split_polygons(layer_gdf, size=SPLIT_SIZE):
+    """
+    Split polygons that span more than one grid cell into one piece per cell, along the cell edges
+    :param layer_gdf: GeoDataFrame of polygons
+    :param size: grid cell size in layer CRS units, cell edges are multiples of size
+    :return: GeoDataFrame with the small polygons and the pieces of the large ones (attributes copied to each piece)
+    """
+    bounds = layer_gdf.bounds
+    cols = np.floor(bounds[['minx', 'maxx']].values / size)
+    rows = np.floor(bounds[['miny', 'maxy']].values / size)
+    large = (cols[:, 0] != cols[:, 1]) | (rows[:, 0] != rows[:, 1])
+    if not large.any():
+        return layer_gdf
+    print("Splitting {} polygons into {} x {} cells".format(large.sum(), size, size))
+    # Cells covered by the bounding boxes of the large polygons
+    cells = set()
+    for (col0, col1), (row0, row1) in zip(cols[large].astype(int), rows[large].astype(int)):
+        cells.update((col, row) for col in range(col0, col1 + 1) for row in range(row0, row1 + 1))
+    grid_gdf = gpd.GeoDataFrame(geometry=[shapely.box(col * size, row * size, (col + 1) * size, (row + 1) * size)
+                                          for col, row in sorted(cells)], crs=layer_gdf.crs)
+    pieces_gdf = gpd.overlay(layer_gdf[large], grid_gdf, how='intersection', keep_geom_type=True)
+    return gpd.GeoDataFrame(pd.concat([layer_gdf[~large], pieces_gdf], ignore_index=True), crs=layer_gdf.crs)
+
+
+def read_layer_store(in_path, bounds=None, columns=None):
+    """
+    Read the polygons of a layer store whose bounding box intersects a tile
+    :param in_path: GeoParquet layer store (see write_layer_store)
+    :param bounds: (left, bottom, right, top) in the layer CRS, None for the whole layer
+    :param columns: list of attribute columns to read, None for all
+    :return: GeoDataFrame indexed by poly_id (the row number in the source layer)
+    """
+    if columns is not None:
+        columns = list(columns) + [POLYGON_ID, 'geometry']
+    layer_gdf = gpd.read_parquet(in_path, columns=columns, bbox=bounds)
+    return layer_gdf.set_index(POLYGON_ID).drop(columns=BBOX_COLUMN, errors='ignore')
+
+
+def count_in_bounds(in_path, bounds_list):
+    """
+    Number of polygons whose bounding box intersects each tile, from the bounding box column only
+    (a measure of the work of each tile, to schedule the largest tiles first)
+    :param in_path: GeoParquet layer store
+    :param bounds_list: list of (left, bottom, right, top)
+    :return: list of polygon counts
+    """
+    bbox = pq.read_table(in_path, columns=[BBOX_COLUMN]).column(BBOX_COLUMN).combine_chunks()
+    xmin, ymin, xmax, ymax = (bbox.field(name).to_numpy() for name in BBOX_FIELDS)
+    return [int(((xmin <= right) & (xmax >= left) & (ymin <= top) & (ymax >= bottom)).sum())
+            for left, bottom, right, top in bounds_list]
+
+
+def read_tile_polygons(in_path, bounds, columns=None):
+    """
+    Polygons of a layer store inside a tile, clipped to the tile
+    Only polygons (and pieces of split polygons) whose bounding box intersects the tile are read, and of those
+    only the ones that intersect the tile are kept
+    :param in_path: GeoParquet layer store (see write_layer_store)
+    :param bounds: (left, bottom, right, top) of the tile in the layer CRS
+    :param columns: list of attribute columns to read, None for all
+    :return: GeoDataFrame of clipped polygons indexed by poly_id (pieces of a polygon share its poly_id)
+    """
+    layer_gdf = read_layer_store(in_path, bounds, columns)
+    return gpd.clip(layer_gdf, shapely.box(*bounds), keep_geom_type=True)
@@ -7,18 +7,22 @@ Mask the grids with  vector polygons
 
 Assumes all geographic data are in the same projection
 
+Only the polygons that intersect the raster, clipped to the raster, are used for masking, from a spatial index
+of the mask layer (see raster_mask.py), and a raster that no polygon overlaps is not read
+
+With windowed=True, large rasters (the 12 m TanDEM-X canopy heights) are masked one output tile at a time into a
+tiled, compressed GeoTIFF with overviews, instead of reading the whole cropped raster into memory
+
 """
 
 import os
 import glob
-import fiona
-import rasterio
-import rasterio.mask
+from raster_mask import mask_raster_layers, mask_raster_windowed
 
 def add_prefix(filename, prefix):
     return '{}_{}'.format(prefix, filename)
 
-def mask_raster(in_raster_file, mask_file, out_raster_file):
+def mask_raster(in_raster_file, mask_file, out_raster_file, windowed=False):
     """
 
     Main script to mask grids with polygons
@@ -26,26 +30,14 @@ def mask_raster(in_raster_file, mask_file, out_raster_file):
         https://rasterio.readthedocs.io/en/latest/api/rasterio.mask.html
     :param in_raster_file: input raster file
     :param mask_file: polygon layer used to mask the raster
-    :param out_raster_file: output raster file
-    :return:
+    :param out_raster_file: output raster file (not written if the mask and raster do not overlap)
+    :param windowed: True to mask window by window into a tiled, compressed GeoTIFF with overviews
+    :return: True if the output raster was written
 
     """
-    print(in_raster_file, mask_file, out_raster_file)
-
-    with fiona.open(mask_file, "r") as mask_file:
-        shapes = [feature["geometry"] for feature in mask_file]
-
-    with rasterio.open(in_raster_file)as src:
-        out_image, out_transform = rasterio.mask.mask(src, shapes, all_touched=True, crop=True)
-        out_meta = src.meta
-
-    out_meta.update({"driver": "GTiff",
-                     "height": out_image.shape[1],
-                     "width": out_image.shape[2],
-                     "transform": out_transform})
-
-    with rasterio.open(out_raster_file, "w", **out_meta) as dest:
-        dest.write(out_image)
+    if windowed:
+        return mask_raster_windowed(in_raster_file, mask_file, out_raster_file)
+    return bool(mask_raster_layers(in_raster_file, [(mask_file, out_raster_file)]))
 
 
 #### ---- SETUP and call main function ----------
@@ -82,17 +74,17 @@ if __name__ == '__main__':
 
     # WAM mask
     wam_hgt_raster = add_prefix(hgt_raster, wam_prefix)
-    mask_raster(in_raster, wam_path, wam_hgt_raster)
+    mask_raster(in_raster, wam_path, wam_hgt_raster, windowed=True)
 
     # GMW 2016 mask
     gmw2016_hgt_raster = add_prefix(hgt_raster, gmw2016_prefix)
-    mask_raster(in_raster, gmw2016_path, gmw2016_hgt_raster)
+    mask_raster(in_raster, gmw2016_path, gmw2016_hgt_raster, windowed=True)
 
     # GMF mask
     gmf_hgt_raster = add_prefix(hgt_raster, gmf_prefix)
-    mask_raster(in_raster, gmf_path, gmf_hgt_raster)
+    mask_raster(in_raster, gmf_path, gmf_hgt_raster, windowed=True)
 
     # TNC Landsat mask
     tnc_hgt_raster = add_prefix(hgt_raster, tnc_prefix)
-    mask_raster(in_raster, tnc_path, tnc_hgt_raster)
+    mask_raster(in_raster, tnc_path, tnc_hgt_raster, windowed=True)
 
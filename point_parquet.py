@@ -0,0 +1,246 @@
+""" point_parquet.py
+
+Date: 2026-10-18
+
+GeoParquet storage for large point sets, as an alternative to geofeather
+Used through point_store.read_points/write_points by the point pipelines, and by raster_points.py for streamed output
+
+Points are written with a GeoParquet 1.1 'bbox' covering column (xmin/ymin/xmax/ymax struct) next to the WKB geometry,
+so every row group carries min/max statistics of its bounding box as well as of every value column.
+Points are sorted by a coarse grid cell before writing, so each row group covers a compact area
+
+read_geoparquet() uses those statistics to read only the row groups that can hold points in a bounding box
+(and in optional value ranges), and only the requested columns, e.g. for a notebook plotting one area:
+
+    pts = read_geoparquet('gliht_srtm_N20W088.parquet', columns=['z_chm_m', 'srtm_hgt'], bounds=(-87.6, 20.5, -87.4, 20.7))
+
+"""
+
+import json
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pyproj import CRS
+
+# Number of points per row group, the unit of bbox/value filtering when reading
+ROW_GROUP_SIZE = 100000
+# Size of the grid cells points are sorted by before writing (in CRS units, ~1 km in degrees)
+SORT_CELL_SIZE = 0.01
+# Default parquet compression codec ('zstd', 'snappy', 'gzip', 'lz4', 'brotli' or 'none')
+COMPRESSION = 'zstd'
+# Names of the bbox covering column and its fields
+BBOX_COLUMN = 'bbox'
+BBOX_FIELDS = ('xmin', 'ymin', 'xmax', 'ymax')
+
+
+def geoparquet_metadata(crs, bounds=None):
+    """
+    GeoParquet file metadata for a WKB point geometry column with a bbox covering column
+    :param crs: pyproj CRS of the geometry column
+    :param bounds: (left, bottom, right, top) of all points in the file, None if not known (streamed output)
+    :return: dictionary of schema metadata
+    """
+    geometry = {
+        'encoding': 'WKB',
+        'geometry_types': ['Point'],
+        'crs': crs.to_json_dict(),
+        'covering': {'bbox': {field: [BBOX_COLUMN, field] for field in BBOX_FIELDS}},
+    }
+    if bounds is not None:
+        geometry['bbox'] = [float(bound) for bound in bounds]
+    geo = {
+        'version': '1.1.0',
+        'primary_column': 'geometry',
+        'columns': {'geometry': geometry},
+    }
+    return {b'geo': json.dumps(geo).encode('utf-8')}
+
+
+def bbox_array(x, y):
+    """
+    Arrow struct array for the bbox covering column of points (min and max are the point coordinates)
+    :param x: NumPy array of point x coordinates
+    :param y: NumPy array of point y coordinates
+    :return: pyarrow StructArray with xmin, ymin, xmax, ymax fields
+    """
+    x = pa.array(np.asarray(x, dtype=np.float64))
+    y = pa.array(np.asarray(y, dtype=np.float64))
+    return pa.StructArray.from_arrays([x, y, x, y], names=list(BBOX_FIELDS))
+
+
+def spatial_order(x, y, cell_size=SORT_CELL_SIZE):
+    """
+    Order of points sorted by the grid cell (row, then column) that contains them
+    Consecutive points, and so each row group, then cover a compact area
+    :param x: NumPy array of point x coordinates
+    :param y: NumPy array of point y coordinates
+    :param cell_size: grid cell size in CRS units
+    :return: NumPy array of point indices in sorted order
+    """
+    cell_rows = np.floor(y / cell_size).astype(np.int64)
+    cell_cols = np.floor(x / cell_size).astype(np.int64)
+    return np.lexsort((x, cell_cols, cell_rows))
+
+
+def points_to_table(pts_gdf):
+    """
+    Convert a point GeoDataFrame to an Arrow table with WKB geometry and bbox covering columns
+    :param pts_gdf: point GeoDataFrame
+    :return: pyarrow Table
+    """
+    pts_df = pd.DataFrame(pts_gdf.drop(columns=pts_gdf.geometry.name))
+    pts_table = pa.Table.from_pandas(pts_df, preserve_index=False)
+    pts_table = pts_table.append_column('geometry', pa.array(pts_gdf.geometry.to_wkb(), type=pa.binary()))
+    return pts_table.append_column(BBOX_COLUMN, bbox_array(pts_gdf.geometry.x.values, pts_gdf.geometry.y.values))
+
+
+def write_geoparquet(pts_gdf, out_path, compression=COMPRESSION, compression_level=None,
+                     row_group_size=ROW_GROUP_SIZE, sort_cell_size=SORT_CELL_SIZE):
+    """
+    Write a point GeoDataFrame to GeoParquet with bbox and value statistics for every row group
+    The file can also be read with geopandas.read_parquet
+    :param pts_gdf: point GeoDataFrame
+    :param out_path: output file path
+    :param compression: parquet compression codec, see COMPRESSION
+    :param compression_level: codec compression level (None for the codec default)
+    :param row_group_size: number of points per row group
+    :param sort_cell_size: grid cell size for sorting the points by area, None to keep the input order
+    :return: number of points written
+    """
+    x = pts_gdf.geometry.x.values
+    y = pts_gdf.geometry.y.values
+    if sort_cell_size is not None:
+        pts_gdf = pts_gdf.iloc[spatial_order(x, y, sort_cell_size)]
+    pts_table = points_to_table(pts_gdf)
+    bounds = [x.min(), y.min(), x.max(), y.max()] if len(x) else None
+    pts_table = pts_table.replace_schema_metadata(geoparquet_metadata(pts_gdf.crs, bounds))
+    pq.write_table(pts_table, out_path, row_group_size=row_group_size, compression=compression,
+                   compression_level=compression_level, write_statistics=True)
+    return pts_table.num_rows
+
+
+def row_group_stats(in_path):
+    """
+    Row count and min/max statistics of every row group in a parquet file
+    bbox covering fields are reported as bbox.xmin etc., the geometry column has no statistics
+    :param in_path: parquet file path
+    :return: DataFrame with one row per row group and num_rows, <column>_min and <column>_max columns
+    """
+    metadata = pq.ParquetFile(in_path).metadata
+    stats = []
+    for rg in range(metadata.num_row_groups):
+        row_group = metadata.row_group(rg)
+        rg_stats = {'num_rows': row_group.num_rows}
+        for col in range(row_group.num_columns):
+            column = row_group.column(col)
+            if column.statistics is not None and column.statistics.has_min_max:
+                rg_stats[column.path_in_schema + '_min'] = column.statistics.min
+                rg_stats[column.path_in_schema + '_max'] = column.statistics.max
+        stats.append(rg_stats)
+    return pd.DataFrame(stats)
+
+
+def value_ranges_overlap(stats, ranges):
+    """
+    Check whether a row group may hold values in all the given ranges, from its min/max statistics
+    Columns without statistics always match
+    :param stats: dictionary of <column>_min and <column>_max statistics for one row group
+    :param ranges: dictionary of column: (low, high) ranges (inclusive), None for an open end
+    :return: True if the row group may hold matching rows
+    """
+    for column, (low, high) in ranges.items():
+        col_min = stats.get(column + '_min')
+        col_max = stats.get(column + '_max')
+        if col_min is None or col_max is None:
+            continue
+        if (low is not None and col_max < low) or (high is not None and col_min > high):
+            return False
+    return True
+
+
+def bounds_to_ranges(bounds):
+    """
+    Value ranges of the bbox covering fields for points inside (or on the edge of) a bounding box
+    :param bounds: (left, bottom, right, top)
+    :return: dictionary of column: (low, high) ranges, see value_ranges_overlap
+    """
+    left, bottom, right, top = bounds
+    return {
+        BBOX_COLUMN + '.xmax': (left, None),
+        BBOX_COLUMN + '.xmin': (None, right),
+        BBOX_COLUMN + '.ymax': (bottom, None),
+        BBOX_COLUMN + '.ymin': (None, top),
+    }
+
+
+def select_row_groups(in_path, ranges):
+    """
+    Row groups of a parquet file whose statistics may hold values in all the given ranges
+    :param in_path: parquet file path
+    :param ranges: dictionary of column: (low, high) ranges, see value_ranges_overlap
+    :return: list of row group numbers, number of row groups in the file
+    """
+    stats = row_group_stats(in_path)
+    selected = [rg for rg, rg_stats in enumerate(stats.to_dict('records')) if value_ranges_overlap(rg_stats, ranges)]
+    return selected, len(stats)
+
+
+def ranges_mask(pts_table, ranges):
+    """
+    Boolean mask of the table rows with values in all the given ranges
+    :param pts_table: pyarrow Table
+    :param ranges: dictionary of column: (low, high) ranges, bbox fields as bbox.xmin etc.
+    :return: pyarrow BooleanArray
+    """
+    mask = pa.array(np.ones(pts_table.num_rows, dtype=bool))
+    for column, (low, high) in ranges.items():
+        if column.startswith(BBOX_COLUMN + '.'):
+            values = pc.struct_field(pts_table[BBOX_COLUMN], column.split('.', 1)[1])
+        else:
+            values = pts_table[column]
+        if low is not None:
+            mask = pc.and_(mask, pc.greater_equal(values, low))
+        if high is not None:
+            mask = pc.and_(mask, pc.less_equal(values, high))
+    return pc.fill_null(mask, False)
+
+
+def read_geoparquet(in_path, columns=None, bounds=None, value_ranges=None):
+    """
+    Read points from a GeoParquet file, only the requested columns and only the row groups that can hold
+    points in a bounding box and value ranges; the rows read are then filtered exactly
+    :param in_path: parquet file path
+    :param columns: list of columns to read (the geometry is always read), None for all columns
+    :param bounds: (left, bottom, right, top) to select points inside (or on the edge of), None for all points
+    :param value_ranges: dictionary of column: (low, high) inclusive ranges, None for an open end,
+        e.g. {'z_chm_m': (0, None)}
+    :return: point GeoDataFrame
+    """
+    ranges = dict(value_ranges or {})
+    if bounds is not None:
+        ranges.update(bounds_to_ranges(bounds))
+    parquet_file = pq.ParquetFile(in_path)
+    schema_columns = parquet_file.schema_arrow.names
+
+    # Columns needed to filter rows are read as well and dropped again afterwards
+    out_columns = [column for column in schema_columns if column not in (BBOX_COLUMN, 'geometry')] \
+        if columns is None else [column for column in columns if column != 'geometry']
+    filter_columns = {BBOX_COLUMN if column.startswith(BBOX_COLUMN + '.') else column for column in ranges}
+    read_columns = out_columns + ['geometry'] + sorted(filter_columns - set(out_columns))
+
+    row_groups, n_row_groups = select_row_groups(in_path, ranges)
+    print("Reading {} of {} row groups from {}".format(len(row_groups), n_row_groups, in_path))
+    pts_table = parquet_file.read_row_groups(row_groups, columns=read_columns)
+    if ranges:
+        pts_table = pts_table.filter(ranges_mask(pts_table, ranges))
+
+    # A GeoParquet geometry column without a crs is in OGC:CRS84 (lon/lat)
+    metadata = json.loads(parquet_file.schema_arrow.metadata[b'geo'])
+    crs_json = metadata['columns']['geometry'].get('crs', 'OGC:CRS84')
+    crs = CRS.from_json_dict(crs_json) if isinstance(crs_json, dict) else CRS.from_user_input(crs_json)
+    pts_df = pts_table.select(out_columns).to_pandas()
+    geometry = gpd.GeoSeries.from_wkb(pts_table['geometry'].to_numpy(zero_copy_only=False), crs=crs)
+    return gpd.GeoDataFrame(pts_df, geometry=geometry.values, crs=crs)
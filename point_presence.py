@@ -0,0 +1,188 @@
+""" point_presence.py
+
+Date: 2026-10-18
+
+Presence/absence flags for points inside polygon layers (e.g. mangrove extent layers)
+Used by gliht_mangrove_overlay.py
+
+Polygons of each layer are loaded once into a shapely STRtree, and all points are tested against it in bulk.
+Only a uint8 flag is returned per point, so no polygon attributes are carried through a join and
+points inside more than one overlapping polygon are not duplicated
+
+For dense point sets there is also a rasterize-then-sample mode: each polygon layer is burned once into
+a cached 1 bit presence raster on a chosen grid (presence_raster), and point flags come from array lookups
+(raster_presence_flags). compare_presence() reports how these differ from the exact polygon flags
+
+"""
+
+import os
+import math
+import functools
+import numpy as np
+import shapely
+import geopandas as gpd
+import rasterio as rio
+from rasterio import features
+from rasterio.transform import from_origin
+from rasterio.windows import Window, bounds as window_bounds
+from point_sample import xy_to_rowcol, read_at_rowcol
+
+# Number of points queried against the tree at once, bounds the size of the query result arrays
+QUERY_CHUNK_SIZE = 1000000
+# Block size (rows and columns) of presence rasters, each block is rasterized separately
+PRESENCE_BLOCK_SIZE = 1024
+
+
+@functools.lru_cache(maxsize=None)
+def polygon_tree(source_path):
+    """
+    STRtree of the polygons in a vector layer, built once per layer and reused on later calls
+    :param source_path: Path to the source vector data
+    :return: shapely STRtree of the layer geometries
+    """
+    print("Building spatial index for {}".format(source_path))
+    gdf = gpd.read_file(source_path, columns=[])
+    return shapely.STRtree(gdf.geometry.values)
+
+
+def presence_flags(x, y, tree, chunk_size=QUERY_CHUNK_SIZE):
+    """
+    Flag points that intersect any polygon in the tree (same rule as gpd.sjoin with predicate 'intersects')
+    :param x: NumPy array of point x coordinates, in the polygon CRS
+    :param y: NumPy array of point y coordinates, in the polygon CRS
+    :param tree: shapely STRtree of polygons (see polygon_tree)
+    :param chunk_size: number of points queried at once
+    :return: NumPy uint8 array, 1 for points in a polygon, 0 otherwise
+    """
+    flags = np.zeros(len(x), dtype=np.uint8)
+    for start in range(0, len(x), chunk_size):
+        points = shapely.points(x[start:start + chunk_size], y[start:start + chunk_size])
+        pt_idx, _ = tree.query(points, predicate='intersects')
+        flags[start + pt_idx] = 1
+    return flags
+
+
+def presence_grid(grid_raster, resolution=None):
+    """
+    Grid for a presence raster: the grid of a reference raster, or its extent at a different resolution
+    :param grid_raster: path to the reference raster (e.g. SRTM or GMC canopy height)
+    :param resolution: cell size in the reference raster CRS units (default: the reference raster cell size)
+    :return: dictionary with crs, transform, width and height
+    """
+    with rio.open(grid_raster) as src:
+        if resolution is None:
+            return {'crs': src.crs, 'transform': src.transform, 'width': src.width, 'height': src.height}
+        bounds = src.bounds
+        return {
+            'crs': src.crs,
+            'transform': from_origin(bounds.left, bounds.top, resolution, resolution),
+            'width': int(math.ceil((bounds.right - bounds.left) / resolution)),
+            'height': int(math.ceil((bounds.top - bounds.bottom) / resolution)),
+        }
+
+
+def presence_raster_path(source_path, grid_raster, cache_dir, resolution=None, all_touched=False):
+    """
+    File name of the cached presence raster for a polygon layer, grid, resolution and rasterize rule
+    :param source_path: Path to the source vector data
+    :param grid_raster: path to the reference raster defining the grid
+    :param cache_dir: directory for the cached presence rasters
+    :param resolution: cell size (None for the reference raster cell size)
+    :param all_touched: rasterize rule, see presence_raster
+    :return: path to the presence raster in cache_dir
+    """
+    layer = os.path.splitext(os.path.basename(source_path))[0]
+    grid = os.path.splitext(os.path.basename(grid_raster))[0]
+    res = 'native' if resolution is None else '{:g}'.format(resolution)
+    rule = 'touched' if all_touched else 'center'
+    return os.path.join(cache_dir, "{}_on_{}_{}_{}.tif".format(layer, grid, res, rule))
+
+
+def presence_raster(source_path, grid_raster, cache_dir, resolution=None, all_touched=False):
+    """
+    Burn a polygon layer into a 1 bit presence raster (1 = in a polygon, 0 = not), cached on disk
+    The raster is written one block at a time with only the polygons that intersect the block, and
+    reused as long as it is newer than the polygon layer
+    :param source_path: Path to the source vector data
+    :param grid_raster: path to the reference raster defining the grid
+    :param cache_dir: directory for the cached presence rasters
+    :param resolution: cell size (default: the reference raster cell size)
+    :param all_touched: True to flag every cell touched by a polygon, False for cells whose center is in a polygon
+    :return: path to the presence raster
+    """
+    out_path = presence_raster_path(source_path, grid_raster, cache_dir, resolution, all_touched)
+    if os.path.exists(out_path) and os.path.getmtime(out_path) >= os.path.getmtime(source_path):
+        print("Using cached presence raster {}".format(out_path))
+        return out_path
+
+    print("Creating presence raster {}".format(out_path))
+    tree = polygon_tree(source_path)
+    polys = tree.geometries
+    grid = presence_grid(grid_raster, resolution)
+    block = PRESENCE_BLOCK_SIZE
+    profile = {
+        'driver': 'GTiff',
+        'dtype': 'uint8',
+        'nodata': None,
+        'count': 1,
+        'tiled': True,
+        'blockxsize': block,
+        'blockysize': block,
+        'compress': 'deflate',
+        'nbits': 1,
+    }
+    profile.update(grid)
+    os.makedirs(cache_dir, exist_ok=True)
+    # write to a temporary name first, so a partial raster is never mistaken for a cached one
+    tmp_path = "{}.{}.tmp".format(out_path, os.getpid())
+    try:
+        with rio.open(tmp_path, 'w', **profile) as dst:
+            for row_off in range(0, grid['height'], block):
+                for col_off in range(0, grid['width'], block):
+                    window = Window(col_off, row_off, min(block, grid['width'] - col_off),
+                                    min(block, grid['height'] - row_off))
+                    window_transform = dst.window_transform(window)
+                    window_box = shapely.box(*window_bounds(window, grid['transform']))
+                    window_polys = polys[tree.query(window_box, predicate='intersects')]
+                    if not len(window_polys):
+                        continue  # blocks that are never written read back as 0
+                    burned = features.rasterize(window_polys, out_shape=(window.height, window.width),
+                                                transform=window_transform, fill=0, default_value=1,
+                                                all_touched=all_touched, dtype='uint8')
+                    dst.write(burned, 1, window=window)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    os.replace(tmp_path, out_path)
+    return out_path
+
+
+def raster_presence_flags(x, y, presence_path):
+    """
+    Presence flags for points looked up from a presence raster (see presence_raster)
+    :param x: NumPy array of point x coordinates, in the raster CRS
+    :param y: NumPy array of point y coordinates, in the raster CRS
+    :param presence_path: path to the presence raster
+    :return: NumPy uint8 array, 1 for points in a presence cell, 0 otherwise (including outside the raster)
+    """
+    with rio.open(presence_path) as src:
+        rows, cols = xy_to_rowcol(src.transform, np.asarray(x), np.asarray(y))
+        flags = read_at_rowcol(src, rows, cols)
+    return np.nan_to_num(flags, nan=0).astype(np.uint8)
+
+
+def compare_presence(exact_flags, raster_flags):
+    """
+    Count the differences between exact polygon presence flags and presence raster flags
+    :param exact_flags: NumPy uint8 array from presence_flags
+    :param raster_flags: NumPy uint8 array from raster_presence_flags
+    :return: dictionary of point counts: agree, raster_only (false presence), exact_only (missed presence)
+    """
+    exact = exact_flags.astype(bool)
+    raster = raster_flags.astype(bool)
+    return {
+        'agree': int(np.count_nonzero(exact == raster)),
+        'raster_only': int(np.count_nonzero(raster & ~exact)),
+        'exact_only': int(np.count_nonzero(exact & ~raster)),
+    }
@@ -0,0 +1,199 @@
+""" point_sample.py
+
+Date: 2026-10-18
+
+Sample rasters at point locations
+Shared by gliht_srtm_sample.py, gliht_mangrove_overlay.py and bathy_conabio_tnc_sample.py
+
+Point coordinates are converted to raster row/col with the inverse affine transform for all points at once,
+and only the raster block windows that contain points are read, instead of DatasetReader.sample()
+which yields one value per point
+
+Unique cell ids (row * cols + col + 1) are calculated from row/col with sample_cell_index(),
+so no unique id raster needs to be created and sampled
+
+sample_rasters() samples a list of rasters with one point table, sharing row/col indices between rasters on the same grid
+
+All functions work on coordinate arrays, so points can be GeoDataFrames or compact point tables without geometry
+
+"""
+
+import numpy as np
+import rasterio as rio
+from rasterio.windows import Window
+from point_table import is_point_table, table_xy
+
+
+def point_xy(pt_gdf):
+    """
+    x and y coordinate arrays of a point GeoDataFrame, or of a point table (see point_table.py)
+    :param pt_gdf: Point GeoDataFrame or point table
+    :return: x, y: NumPy float64 arrays
+    """
+    if is_point_table(pt_gdf):
+        return table_xy(pt_gdf)
+    return pt_gdf.geometry.x.values, pt_gdf.geometry.y.values
+
+
+def xy_to_rowcol(transform, x, y):
+    """
+    Raster row/col indices of the cells containing x/y coordinates, for arrays of coordinates
+    Same result as DatasetReader.index(x, y)
+    :param transform: Affine transform of the raster
+    :param x: NumPy array of x coordinates
+    :param y: NumPy array of y coordinates
+    :return: rows, cols: NumPy int64 arrays (may be outside the raster)
+    """
+    inv = ~transform
+    col_f = inv.a * x + inv.b * y + inv.c
+    row_f = inv.d * x + inv.e * y + inv.f
+    return np.floor(row_f).astype(np.int64), np.floor(col_f).astype(np.int64)
+
+
+def sample_nodata(src, band=1):
+    """
+    Value and datatype used for points with no raster value (outside the raster)
+    Uses the raster nodata value, or NaN (as a float type) if the raster has none
+    :param src: rasterio dataset
+    :param band: band number
+    :return: nodata, dtype
+    """
+    dtype = np.dtype(src.dtypes[band - 1])
+    nodata = src.nodatavals[band - 1]
+    if nodata is None:
+        return np.nan, np.result_type(dtype, np.float32)
+    return nodata, dtype
+
+
+def read_at_rowcol(src, rows, cols, band=1):
+    """
+    Read raster values at row/col indices, one block window at a time and only for blocks that contain points
+    :param src: rasterio dataset
+    :param rows: NumPy int64 array of row indices
+    :param cols: NumPy int64 array of column indices
+    :param band: band number
+    :return: NumPy array of values, nodata for indices outside the raster
+    """
+    nodata, dtype = sample_nodata(src, band)
+    values = np.full(len(rows), nodata, dtype=dtype)
+
+    inside = (rows >= 0) & (rows < src.height) & (cols >= 0) & (cols < src.width)
+    inside_idx = np.nonzero(inside)[0]
+    if not len(inside_idx):
+        return values
+
+    # Group the points by the block window that contains them
+    block_h, block_w = src.block_shapes[band - 1]
+    n_block_cols = (src.width + block_w - 1) // block_w
+    block_ids = (rows[inside_idx] // block_h) * n_block_cols + (cols[inside_idx] // block_w)
+    order = np.argsort(block_ids, kind='stable')
+    block_ids = block_ids[order]
+    inside_idx = inside_idx[order]
+    block_starts = np.flatnonzero(np.diff(block_ids)) + 1
+    for pt_idx in np.split(inside_idx, block_starts):
+        row_off = (rows[pt_idx[0]] // block_h) * block_h
+        col_off = (cols[pt_idx[0]] // block_w) * block_w
+        window = Window(col_off, row_off, min(block_w, src.width - col_off), min(block_h, src.height - row_off))
+        block_np = src.read(band, window=window)
+        values[pt_idx] = block_np[rows[pt_idx] - row_off, cols[pt_idx] - col_off]
+
+    return values
+
+
+def sample_points(raster_path, x, y, band=1):
+    """
+    Sample a raster at x/y coordinates
+    Points outside the raster get the raster nodata value (NaN if the raster has no nodata value)
+    :param raster_path: path to the raster
+    :param x: NumPy array of x coordinates, in the raster CRS
+    :param y: NumPy array of y coordinates, in the raster CRS
+    :param band: band number
+    :return: NumPy array of sampled values, one per point
+    """
+    with rio.open(raster_path) as src:
+        print(src.meta)
+        rows, cols = xy_to_rowcol(src.transform, np.asarray(x), np.asarray(y))
+        return read_at_rowcol(src, rows, cols, band)
+
+
+def cell_index(rows, cols, height, width):
+    """
+    Unique id of raster cells from their row/col indices, numbered row by row starting at 1
+    Same values as a unique id raster of np.arange(rows * cols).reshape(rows, cols) + 1, computed without one
+    :param rows: NumPy int64 array of row indices
+    :param cols: NumPy int64 array of column indices
+    :param height: number of rows in the raster
+    :param width: number of columns in the raster
+    :return: NumPy array of cell ids (uint32 if they fit), 0 for indices outside the raster
+    """
+    dtype = np.uint32 if height * width < np.iinfo(np.uint32).max else np.int64
+    inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+    ids = np.zeros(len(rows), dtype=dtype)
+    ids[inside] = rows[inside] * width + cols[inside] + 1
+    return ids
+
+
+def sample_cell_index(raster_path, x, y):
+    """
+    Unique id of the raster cell containing each x/y coordinate, computed from the raster transform
+    Replaces sampling a unique id raster, so the id raster never has to be created or read
+    :param raster_path: path to the raster defining the grid
+    :param x: NumPy array of x coordinates, in the raster CRS
+    :param y: NumPy array of y coordinates, in the raster CRS
+    :return: NumPy array of cell ids, 0 for points outside the raster
+    """
+    with rio.open(raster_path) as src:
+        rows, cols = xy_to_rowcol(src.transform, np.asarray(x), np.asarray(y))
+        return cell_index(rows, cols, src.height, src.width)
+
+
+def grid_signature(src):
+    """
+    Hashable description of a raster grid, rasters with the same signature share row/col indices for any point
+    :param src: rasterio dataset
+    :return: tuple of CRS, transform and shape
+    """
+    return (src.crs.to_wkt() if src.crs else None, tuple(src.transform)[:6], src.height, src.width)
+
+
+def sample_rasters(pts_df, raster_columns, index_columns=(), x=None, y=None):
+    """
+    Sample several rasters with one point table, adding a column per raster to the table in place
+    Row/col indices are computed once per distinct grid and shared by all rasters on that grid
+    :param pts_df: point GeoDataFrame or point table, modified in place
+    :param raster_columns: list of (raster path, column name) pairs, values sampled from each raster
+    :param index_columns: list of (raster path, column name) pairs, unique cell ids for the raster grid
+        (see sample_cell_index)
+    :param x: NumPy array of point x coordinates (default: from the pts_df geometry)
+    :param y: NumPy array of point y coordinates (default: from the pts_df geometry)
+    :return: pts_df with the new columns
+    """
+    if x is None or y is None:
+        x, y = point_xy(pts_df)
+    x = np.asarray(x)
+    y = np.asarray(y)
+
+    # Row/col indices of the points for each distinct raster grid
+    grid_rowcols = {}
+
+    def rowcols(src):
+        signature = grid_signature(src)
+        if signature not in grid_rowcols:
+            grid_rowcols[signature] = xy_to_rowcol(src.transform, x, y)
+        return grid_rowcols[signature]
+
+    for raster_path, column in raster_columns:
+        print("Sampling raster {} to column {}".format(raster_path, column))
+        with rio.open(raster_path) as src:
+            rows, cols = rowcols(src)
+            pts_df[column] = read_at_rowcol(src, rows, cols)
+
+    for raster_path, column in index_columns:
+        print("Unique cell ids for raster {} to column {}".format(raster_path, column))
+        with rio.open(raster_path) as src:
+            rows, cols = rowcols(src)
+            pts_df[column] = cell_index(rows, cols, src.height, src.width)
+
+    print("{} distinct grids for {} sampled columns".format(
+        len(grid_rowcols), len(raster_columns) + len(index_columns)))
+    return pts_df
@@ -0,0 +1,309 @@
+""" point_store.py
+
+Date: 2026-10-18
+
+Storing and selecting subsets of large point sets by area
+Used by gliht_prep.py, bathy_conabio_prep.py, gliht_srtm_sample.py and bathy_conabio_tnc_sample.py
+
+A bounding box clip is four comparisons on the x/y coordinate arrays, so clips are boolean masks (point_table.bbox_mask)
+rather than running a geometry predicate on every point
+
+Point sets in EPSG 4326 can be written as a partitioned store: a directory with one geofeather file per
+SRTM 1 degree tile (e.g. N20W088.feather) and a partitions.json index with the bounds and point count of each
+partition, so a sampler only loads the partitions that overlap its raster
+
+Large point sets can be written a piece at a time (e.g. one source tile at a time) with append_points() and
+append_partitioned(), which keep one open Arrow writer per output file, so the whole set is never held in memory
+
+read_points() and write_points() also handle GeoParquet files (.parquet, see point_parquet.py), which are read
+with only the row groups and columns needed, and compact point tables without geometry (see point_table.py)
+
+"""
+
+import os
+import json
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import rasterio as rio
+from geofeather import to_geofeather, from_geofeather
+from point_sample import point_xy
+from point_parquet import (read_geoparquet, write_geoparquet, points_to_table, geoparquet_metadata, spatial_order,
+                           COMPRESSION, ROW_GROUP_SIZE)
+from point_table import (is_point_table, table_crs, is_point_table_file, read_point_table, write_point_table,
+                         point_table_arrow)
+
+# Name of the partition index file in a partitioned point store
+PARTITION_INDEX = 'partitions.json'
+
+
+def raster_bounds(raster_path):
+    """
+    Bounding box of a raster
+    :param raster_path: path to the raster
+    :return: (left, bottom, right, top)
+    """
+    with rio.open(raster_path) as src:
+        return tuple(src.bounds)
+
+
+def coords_bounds(x, y):
+    """
+    Bounding box of point coordinate arrays (same as GeoSeries.total_bounds)
+    :param x: NumPy array of point x coordinates
+    :param y: NumPy array of point y coordinates
+    :return: NumPy array of [left, bottom, right, top], NaN if there are no points
+    """
+    if not len(x):
+        return np.full(4, np.nan)
+    return np.array([x.min(), y.min(), x.max(), y.max()])
+
+
+def srtm_tile_ids(lon, lat):
+    """
+    SRTM 1 degree tile id (lower left corner, e.g. N20W088) for longitude/latitude coordinate arrays
+    :param lon: NumPy array of longitudes
+    :param lat: NumPy array of latitudes
+    :return: NumPy array of tile id strings
+    """
+    lon_floor = np.floor(lon).astype(np.int64)
+    lat_floor = np.floor(lat).astype(np.int64)
+    # Build the ids from the distinct corners only -- there are few tiles and many points
+    corners, inverse = np.unique(np.stack([lat_floor, lon_floor], axis=1), axis=0, return_inverse=True)
+    names = np.array(["{}{:02d}{}{:03d}".format('N' if tile_lat >= 0 else 'S', abs(tile_lat),
+                                                 'E' if tile_lon >= 0 else 'W', abs(tile_lon))
+                      for tile_lat, tile_lon in corners], dtype=object)
+    return names[inverse.ravel()]
+
+
+def update_partition(partitions, tile_id, x, y):
+    """
+    Add points to the entry for a partition in a partition index, extending its bounds and count
+    :param partitions: dictionary of partition entries, modified in place
+    :param tile_id: partition (SRTM tile) id
+    :param x: NumPy array of x coordinates of the points added to the partition
+    :param y: NumPy array of y coordinates of the points added to the partition
+    :return: the partition entry
+    """
+    bounds = coords_bounds(x, y)
+    partition = partitions.setdefault(tile_id, {
+        'file': "{}.feather".format(tile_id),
+        'bounds': bounds.tolist(),
+        'count': 0,
+    })
+    old_bounds = partition['bounds']
+    partition['bounds'] = [min(old_bounds[0], bounds[0]), min(old_bounds[1], bounds[1]),
+                           max(old_bounds[2], bounds[2]), max(old_bounds[3], bounds[3])]
+    partition['count'] += int(len(x))
+    return partition
+
+
+def write_partition_index(store_dir, partitions, crs):
+    """
+    Write the partitions.json index of a partitioned point store
+    :param store_dir: partitioned store directory
+    :param partitions: dictionary of partition entries (see update_partition)
+    :param crs: pyproj CRS of the points
+    :return: dictionary of the partition index
+    """
+    index = {'crs': crs.to_wkt() if crs else None, 'partitions': partitions}
+    with open(os.path.join(store_dir, PARTITION_INDEX), 'w') as index_file:
+        json.dump(index, index_file, indent=1)
+    return index
+
+
+def points_crs(pts):
+    """
+    CRS of a point GeoDataFrame or point table
+    :param pts: point GeoDataFrame or point table
+    :return: pyproj CRS
+    """
+    return table_crs(pts) if is_point_table(pts) else pts.crs
+
+
+def write_partitioned(pts_gdf, store_dir):
+    """
+    Write points (EPSG 4326) as a partitioned store, one file per SRTM 1 degree tile
+    Partitions are geofeather files for a GeoDataFrame, or point table files for a point table
+    :param pts_gdf: point GeoDataFrame or point table with lon/lat coordinates
+    :param store_dir: output directory for the partition files and partitions.json index
+    :return: dictionary of the partition index
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    writers = {}
+    partitions = {}
+    try:
+        append_partitioned(writers, partitions, pts_gdf, store_dir)
+    finally:
+        close_writers(writers)
+    for partition in partitions.values():
+        print("Wrote partition {} ({} points)".format(partition['file'], partition['count']))
+    return write_partition_index(store_dir, partitions, points_crs(pts_gdf))
+
+
+def append_partitioned(writers, partitions, pts_gdf, store_dir):
+    """
+    Append points (EPSG 4326) to the partition files of a partitioned store, split by SRTM 1 degree tile
+    The partitions.json index is written with write_partition_index once all the points are appended
+    :param writers: dictionary of open writers by output path, modified in place (see append_points)
+    :param partitions: dictionary of partition entries, modified in place (see update_partition)
+    :param pts_gdf: point GeoDataFrame or point table with lon/lat coordinates
+    :param store_dir: partitioned store directory, must exist
+    :return:
+    """
+    x, y = point_xy(pts_gdf)
+    tile_ids = srtm_tile_ids(x, y)
+    for tile_id in np.unique(tile_ids):
+        in_tile = tile_ids == tile_id
+        partition = update_partition(partitions, tile_id, x[in_tile], y[in_tile])
+        append_points(writers, pts_gdf[in_tile], os.path.join(store_dir, partition['file']))
+
+
+def read_partition_index(store_dir):
+    """
+    Read the partition index of a partitioned point store
+    :param store_dir: partitioned store directory
+    :return: dictionary of the partition index
+    """
+    with open(os.path.join(store_dir, PARTITION_INDEX)) as index_file:
+        return json.load(index_file)
+
+
+def bounds_overlap(bounds_a, bounds_b):
+    """
+    Check whether two bounding boxes (left, bottom, right, top) overlap or touch
+    """
+    return not (bounds_a[2] < bounds_b[0] or bounds_a[0] > bounds_b[2] or
+                bounds_a[3] < bounds_b[1] or bounds_a[1] > bounds_b[3])
+
+
+def read_partitioned(store_dir, bounds=None):
+    """
+    Load the partitions of a partitioned point store that overlap a bounding box
+    Partitions are selected with the bounds in the index; the points still need to be clipped to the box
+    :param store_dir: partitioned store directory
+    :param bounds: (left, bottom, right, top), None to load all partitions
+    :return: point GeoDataFrame (or point table) with the points of the selected partitions
+    """
+    index = read_partition_index(store_dir)
+    tile_files = [partition['file'] for partition in index['partitions'].values()
+                  if bounds is None or bounds_overlap(partition['bounds'], bounds)]
+    print("Loading {} of {} partitions from {}".format(len(tile_files), len(index['partitions']), store_dir))
+    if not tile_files:
+        raise ValueError("No partitions in {} overlap {}".format(store_dir, bounds))
+    pts = pd.concat([read_points(os.path.join(store_dir, tile_file)) for tile_file in tile_files],
+                    axis=0, ignore_index=True)
+    if is_point_table(pts):
+        pts.attrs['crs'] = index['crs']
+    return pts
+
+
+def read_points(pt_data_source, bounds=None, columns=None):
+    """
+    Load points from a geofeather, GeoParquet or point table file, or only the overlapping partitions
+    of a partitioned point store
+    :param pt_data_source: path to a geofeather file, GeoParquet file (.parquet), point table file
+        or partitioned store directory
+    :param bounds: (left, bottom, right, top) used to select partitions or parquet row groups and points,
+        ignored for a single geofeather file
+    :param columns: list of columns to read, None for all (GeoParquet and point table files only)
+    :return: point GeoDataFrame, or point table for point table files
+    """
+    if os.path.isdir(pt_data_source):
+        return read_partitioned(pt_data_source, bounds)
+    if is_point_table_file(pt_data_source):
+        return read_point_table(pt_data_source, columns=columns, bounds=bounds)
+    if pt_data_source.endswith('.parquet'):
+        return read_geoparquet(pt_data_source, columns=columns, bounds=bounds)
+    return from_geofeather(pt_data_source)
+
+
+def points_format(pts_gdf, out_path):
+    """
+    Name of the file format write_points uses for a point data set and output path
+    :param pts_gdf: point GeoDataFrame or point table
+    :param out_path: output path ending in .feather or .parquet
+    :return: 'point table', 'GeoParquet' or 'geofeather'
+    """
+    if is_point_table(pts_gdf):
+        return 'point table'
+    if out_path.endswith('.parquet'):
+        return 'GeoParquet'
+    return 'geofeather'
+
+
+def write_points(pts_gdf, out_path):
+    """
+    Write points to a geofeather or GeoParquet file (by file extension), or a point table to a point table file
+    :param pts_gdf: point GeoDataFrame or point table
+    :param out_path: output path ending in .feather or .parquet
+    :return:
+    """
+    out_format = points_format(pts_gdf, out_path)
+    if out_format == 'point table':
+        write_point_table(pts_gdf, out_path)
+    elif out_format == 'GeoParquet':
+        write_geoparquet(pts_gdf, out_path)
+    else:
+        to_geofeather(pts_gdf.reset_index(drop=True), out_path)
+
+
+def points_to_arrow(pts_gdf, out_format):
+    """
+    Arrow table of points as stored in a file of the given format
+    :param pts_gdf: point GeoDataFrame or point table
+    :param out_format: 'point table', 'GeoParquet' or 'geofeather' (see points_format)
+    :return: pyarrow Table
+    """
+    if out_format == 'point table':
+        return point_table_arrow(pts_gdf)
+    if out_format == 'GeoParquet':
+        return points_to_table(pts_gdf).replace_schema_metadata(geoparquet_metadata(pts_gdf.crs))
+    # geofeather: the other columns as they are and the geometry as WKB
+    pts_df = pd.DataFrame(pts_gdf.drop(columns=pts_gdf.geometry.name))
+    pts_table = pa.Table.from_pandas(pts_df, preserve_index=False)
+    return pts_table.append_column('geometry', pa.array(pts_gdf.geometry.to_wkb(), type=pa.binary()))
+
+
+def append_points(writers, pts_gdf, out_path):
+    """
+    Append points to a file in the format write_points uses, opening a writer for the file on first use
+    Every call adds one or more parquet row groups (sorted by area like write_points) or feather record batches,
+    so files written a piece at a time read the same as files written whole
+    :param writers: dictionary of open writers by output path, modified in place; close them with close_writers
+    :param pts_gdf: point GeoDataFrame or point table, with the same columns for every call
+    :param out_path: output path ending in .feather or .parquet
+    :return:
+    """
+    if out_path.endswith('.parquet'):
+        pts_gdf = pts_gdf.iloc[spatial_order(*point_xy(pts_gdf))]
+    out_format = points_format(pts_gdf, out_path)
+    pts_table = points_to_arrow(pts_gdf, out_format)
+    writer = writers.get(out_path)
+    if writer is None:
+        if out_path.endswith('.parquet'):
+            writer = pq.ParquetWriter(out_path, pts_table.schema, compression=COMPRESSION, write_statistics=True)
+        else:
+            writer = pa.ipc.new_file(out_path, pts_table.schema, options=pa.ipc.IpcWriteOptions(compression='lz4'))
+        if out_format == 'geofeather':
+            # geofeather stores the CRS in a separate file next to the feather file
+            with open("{}.crs".format(out_path), "w") as crsfile:
+                crsfile.write(json.dumps({"wkt": pts_gdf.crs.to_wkt()}))
+        writers[out_path] = writer
+    if out_path.endswith('.parquet'):
+        # The parquet writer needs the schema metadata of the first piece (pandas metadata differs between pieces)
+        pts_table = pts_table.replace_schema_metadata(writer.schema.metadata)
+        writer.write_table(pts_table, row_group_size=ROW_GROUP_SIZE)
+    else:
+        writer.write_table(pts_table)
+
+
+def close_writers(writers):
+    """
+    Close the writers opened by append_points
+    :param writers: dictionary of open writers by output path
+    :return:
+    """
+    for writer in writers.values():
+        writer.close()
@@ -0,0 +1,204 @@
+""" point_table.py
+
+Date: 2026-10-18
+
+Compact point tables: plain DataFrames with lon/lat coordinate columns instead of a shapely geometry column
+Used by raster_points.py (type='xy'), point_store.py and point_sample.py
+
+Most steps after ingest (sampling, bounding box clips, cell key joins) only need coordinate arrays, and one shapely
+Point object per row is the largest memory cost of the point files. A point table keeps the coordinates as two
+float64 columns, reprojected as coordinate arrays (see reproject.py), and a GeoDataFrame is only built
+on request with to_geodataframe()
+
+Point table files are feather or parquet files with the coordinate columns, optionally stored as scaled int32
+(e.g. 1e-7 degrees, ~1 cm), and the CRS and scale in the file's schema metadata. Parquet point tables are sorted
+by area and written in row groups with min/max statistics of the coordinate columns (as GeoParquet points are, see
+point_parquet.py), so read_point_table reads only the row groups that can hold points in a bounding box
+
+"""
+
+import json
+import numpy as np
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+from pyproj import CRS
+from reproject import transform_xy
+from point_parquet import spatial_order, select_row_groups, COMPRESSION, ROW_GROUP_SIZE, SORT_CELL_SIZE
+
+# Coordinate column names of point tables
+X_COLUMN = 'lon'
+Y_COLUMN = 'lat'
+# CRS of point table coordinates unless recorded otherwise
+POINT_TABLE_EPSG = 4326
+# Scale of int32 coordinates when a point table is stored compactly (degrees per unit, ~1 cm)
+COORD_SCALE = 1e-7
+# Schema metadata key of point table files
+METADATA_KEY = b'point_table'
+
+
+def make_point_table(pts_df, x_column, y_column, crs, dst_epsg=POINT_TABLE_EPSG, threads=1):
+    """
+    Add lon/lat coordinate columns to a point data frame, reprojected from its x/y columns
+    :param pts_df: Pandas DataFrame with x/y columns, modified in place
+    :param x_column: name of the x column
+    :param y_column: name of the y column
+    :param crs: CRS of the x/y columns
+    :param dst_epsg: EPSG code of the point table coordinates
+    :param threads: number of threads used to reproject the coordinates
+    :return: the point table
+    """
+    dst_crs = CRS.from_epsg(dst_epsg)
+    pts_df[X_COLUMN], pts_df[Y_COLUMN] = transform_xy(pts_df[x_column].values, pts_df[y_column].values,
+                                                      crs, dst_crs, threads=threads)
+    pts_df.attrs['crs'] = dst_crs.to_wkt()
+    return pts_df
+
+
+def is_point_table(pts):
+    """
+    Check whether a point data set is a point table (coordinate columns, no geometry column)
+    :param pts: Pandas DataFrame or GeoPandas GeoDataFrame
+    :return: True for a point table
+    """
+    return not isinstance(pts, gpd.GeoDataFrame) and X_COLUMN in pts and Y_COLUMN in pts
+
+
+def table_crs(pts_df):
+    """
+    CRS of a point table, EPSG 4326 unless the table records another one
+    :param pts_df: point table
+    :return: pyproj CRS
+    """
+    return CRS.from_user_input(pts_df.attrs.get('crs', POINT_TABLE_EPSG))
+
+
+def table_xy(pts_df):
+    """
+    x and y coordinate arrays of a point table
+    :param pts_df: point table
+    :return: x, y: NumPy float64 arrays
+    """
+    return pts_df[X_COLUMN].values, pts_df[Y_COLUMN].values
+
+
+def bbox_mask(x, y, bounds):
+    """
+    Boolean mask of the points inside (or on the edge of) a bounding box
+    Same points as geometry.intersects(box(*bounds)) for a point GeoSeries
+    :param x: NumPy array of point x coordinates
+    :param y: NumPy array of point y coordinates
+    :param bounds: (left, bottom, right, top)
+    :return: NumPy boolean array
+    """
+    left, bottom, right, top = bounds
+    return (x >= left) & (x <= right) & (y >= bottom) & (y <= top)
+
+
+def to_geodataframe(pts_df, drop_xy=True):
+    """
+    Build a point GeoDataFrame from a point table, for steps that need geometry objects (plots, overlays, export)
+    :param pts_df: point table
+    :param drop_xy: drop the lon/lat columns, which the geometry replaces
+    :return: point GeoDataFrame
+    """
+    x, y = table_xy(pts_df)
+    geometry = gpd.points_from_xy(x, y, crs=table_crs(pts_df))
+    attrs = pts_df.drop(columns=[X_COLUMN, Y_COLUMN]) if drop_xy else pts_df
+    return gpd.GeoDataFrame(attrs, geometry=geometry)
+
+
+def point_table_arrow(pts_df, scale=None):
+    """
+    Arrow table of a point table with its CRS and scale in the schema metadata, as stored in point table files
+    :param pts_df: point table
+    :param scale: None to store coordinates as float64, or the size of one unit to store them as scaled int32
+        (e.g. COORD_SCALE)
+    :return: pyarrow Table
+    """
+    pts_table = pa.Table.from_pandas(pts_df, preserve_index=False)
+    if scale is not None:
+        for column in (X_COLUMN, Y_COLUMN):
+            scaled = np.round(pts_df[column].values / scale).astype(np.int32)
+            pts_table = pts_table.set_column(pts_table.schema.get_field_index(column), column, pa.array(scaled))
+    metadata = {'x': X_COLUMN, 'y': Y_COLUMN, 'crs': table_crs(pts_df).to_wkt(), 'scale': scale}
+    return pts_table.replace_schema_metadata({METADATA_KEY: json.dumps(metadata).encode('utf-8')})
+
+
+def write_point_table(pts_df, out_path, scale=None, row_group_size=ROW_GROUP_SIZE, sort_cell_size=SORT_CELL_SIZE):
+    """
+    Write a point table to a feather or parquet file (by extension) with its CRS in the schema metadata
+    :param pts_df: point table
+    :param out_path: output path ending in .feather or .parquet
+    :param scale: None to store coordinates as float64, or the size of one unit to store them as scaled int32
+        (e.g. COORD_SCALE)
+    :param row_group_size: parquet only, number of points per row group
+    :param sort_cell_size: parquet only, grid cell size for sorting the points by area (see point_parquet.py),
+        None to keep the input order
+    :return:
+    """
+    if out_path.endswith('.parquet') and sort_cell_size is not None:
+        pts_df = pts_df.iloc[spatial_order(*table_xy(pts_df), sort_cell_size)]
+    pts_table = point_table_arrow(pts_df, scale)
+    if out_path.endswith('.parquet'):
+        pq.write_table(pts_table, out_path, row_group_size=row_group_size, compression=COMPRESSION,
+                       write_statistics=True)
+    else:
+        feather.write_feather(pts_table, out_path, compression='lz4')
+
+
+def file_schema(in_path):
+    """
+    Arrow schema of a feather or parquet file (by extension), without reading the data
+    """
+    if in_path.endswith('.parquet'):
+        return pq.read_schema(in_path)
+    with pa.memory_map(in_path) as source:
+        return pa.ipc.open_file(source).schema
+
+
+def is_point_table_file(in_path):
+    """
+    Check whether a feather or parquet file holds a point table (see write_point_table)
+    """
+    metadata = file_schema(in_path).metadata
+    return metadata is not None and METADATA_KEY in metadata
+
+
+def read_point_table(in_path, columns=None, bounds=None):
+    """
+    Read a point table file, scaled int32 coordinates are converted back to float64
+    :param in_path: path to a point table feather or parquet file
+    :param columns: list of columns to read (the coordinate columns are always read), None for all
+    :param bounds: (left, bottom, right, top) to select points inside (or on the edge of), None for all points.
+        Only the parquet row groups whose coordinate statistics overlap the bounds are read
+    :return: point table
+    """
+    metadata = json.loads(file_schema(in_path).metadata[METADATA_KEY])
+    scale = metadata['scale']
+    if columns is not None:
+        columns = [column for column in columns if column not in (X_COLUMN, Y_COLUMN)] + [X_COLUMN, Y_COLUMN]
+    if in_path.endswith('.parquet'):
+        parquet_file = pq.ParquetFile(in_path)
+        if bounds is None:
+            row_groups = range(parquet_file.num_row_groups)
+        else:
+            left, bottom, right, top = bounds
+            ranges = {X_COLUMN: (left, right), Y_COLUMN: (bottom, top)}
+            if scale is not None:
+                # Statistics are of the stored int32 units, widened to whole units
+                ranges = {column: (np.floor(low / scale), np.ceil(high / scale))
+                          for column, (low, high) in ranges.items()}
+            row_groups, n_row_groups = select_row_groups(in_path, ranges)
+            print("Reading {} of {} row groups from {}".format(len(row_groups), n_row_groups, in_path))
+        pts_df = parquet_file.read_row_groups(row_groups, columns=columns).to_pandas()
+    else:
+        pts_df = feather.read_feather(in_path, columns=columns)
+    if scale is not None:
+        for column in (X_COLUMN, Y_COLUMN):
+            pts_df[column] = pts_df[column].values * scale
+    if bounds is not None:
+        pts_df = pts_df[bbox_mask(*table_xy(pts_df), bounds)].reset_index(drop=True)
+    pts_df.attrs['crs'] = metadata['crs']
+    return pts_df
@@ -0,0 +1,181 @@
+""" presence_raster.py
+
+Date: 2026-10-18
+
+Mangrove presence rasters: one bit-packed (1 bit per cell) raster per mask source and SRTM tile, instead of a
+masked copy of every height raster for every mask source
+Used by srtm_mangrovemask.py (presence=True) and srtm_mangrove_polygons.py
+
+A presence raster is on the grid of the SRTM tile, 1 where a cell is covered (or touched) by a mangrove polygon and
+has height data, 0 elsewhere. The height rasters of a tile (hmax, hba, ...) all come from the same SRTM read and
+share their void cells, so one presence raster masks all of them. (point_presence.presence_raster burns a whole
+layer for point lookups, without the height grid's void cells)
+
+Masked heights are exposed without copying the heights:
+    write_masked_vrt: a VRT of the height raster with the presence raster as its mask band, which GDAL, rasterio
+        (read(masked=True), features.dataset_features) and QGIS read as the masked raster
+    read_masked, masked_heights, height_histogram: masked arrays, values and histograms read window by window
+
+"""
+
+import os
+from xml.sax.saxutils import escape
+import numpy as np
+import shapely
+import rasterio
+from rasterio.features import rasterize
+from raster_mask import tile_shapes, OUT_BLOCK_SIZE, OUT_COMPRESS
+
+
+def presence_filename(height_file, prefix, out_dir=''):
+    """
+    Presence raster path of a mask source for the SRTM tile of a height raster
+    :param height_file: height raster path named <model>_<tile>.tif (e.g. hmax_N20W088.tif)
+    :param prefix: mask source prefix (e.g. wam)
+    :param out_dir: output directory ('' for the current directory)
+    :return: path <prefix>_presence_<tile>.tif
+    """
+    tileid = os.path.splitext(os.path.basename(height_file))[0].split('_')[-1]
+    return os.path.join(out_dir, '{}_presence_{}.tif'.format(prefix, tileid))
+
+
+def write_presence(in_raster_file, mask_file, out_file, all_touched=True):
+    """
+    Write the bit-packed presence raster of a mask layer on the grid of a height raster, one tile at a time
+    Cells are present if covered (or touched) by a polygon of the layer and not nodata in the height raster,
+    the same cells rasterio.mask.mask(all_touched=True) keeps
+    :param in_raster_file: height raster of the SRTM tile
+    :param mask_file: polygon layer path
+    :param out_file: output presence raster (1 bit GeoTIFF)
+    :param all_touched: include all cells touched by the polygons, not just cells with their center inside
+    :return: True if the presence raster was written, False if the mask and raster do not overlap
+    """
+    print(in_raster_file, mask_file, out_file)
+    with rasterio.open(in_raster_file) as src:
+        shapes = tile_shapes(mask_file, src)
+        if not len(shapes):
+            print("Mask and input raster do not overlap -- no presence raster")
+            return False
+        tree = shapely.STRtree(shapes)
+        profile = {
+            'driver': 'GTiff',
+            'dtype': 'uint8',
+            'nbits': 1,
+            'count': 1,
+            'width': src.width,
+            'height': src.height,
+            'crs': src.crs,
+            'transform': src.transform,
+            'tiled': True,
+            'blockxsize': OUT_BLOCK_SIZE,
+            'blockysize': OUT_BLOCK_SIZE,
+            'compress': OUT_COMPRESS,
+            # tiles without mangroves are never written and take no space in the file
+            'sparse_ok': True,
+        }
+        with rasterio.open(out_file, 'w', **profile) as dst:
+            for _, window in dst.block_windows(1):
+                window_shapes = shapes[tree.query(shapely.box(*dst.window_bounds(window)))]
+                if not len(window_shapes):
+                    continue
+                present = rasterize(window_shapes, out_shape=(window.height, window.width),
+                                    transform=dst.window_transform(window), all_touched=all_touched,
+                                    dtype=np.uint8)
+                present[src.read_masks(1, window=window) == 0] = 0
+                if present.any():
+                    dst.write(present, 1, window=window)
+    return True
+
+
+def write_masked_vrt(height_file, presence_file, out_vrt):
+    """
+    Write a VRT of a height raster masked by a presence raster (its mask band), without copying the heights
+    Source paths are stored relative to the VRT, so the VRT and rasters can be moved together
+    :param height_file: height raster path
+    :param presence_file: presence raster path on the same grid
+    :param out_vrt: output VRT path
+    :return: out_vrt
+    """
+    vrt_dir = os.path.dirname(os.path.abspath(out_vrt))
+    with rasterio.open(height_file) as src:
+        data_type = rasterio.dtypes.typename_fwd[rasterio.dtypes.dtype_rev[src.dtypes[0]]]
+        nodata = '' if src.nodata is None else '    <NoDataValue>{}</NoDataValue>\n'.format(repr(src.nodata))
+        vrt = (
+            '<VRTDataset rasterXSize="{width}" rasterYSize="{height}">\n'
+            '  <SRS>{srs}</SRS>\n'
+            '  <GeoTransform>{geotransform}</GeoTransform>\n'
+            '  <VRTRasterBand dataType="{data_type}" band="1">\n'
+            '{nodata}'
+            '    <SimpleSource>\n'
+            '      <SourceFilename relativeToVRT="1">{height_file}</SourceFilename>\n'
+            '      <SourceBand>1</SourceBand>\n'
+            '    </SimpleSource>\n'
+            '  </VRTRasterBand>\n'
+            '  <MaskBand>\n'
+            '    <VRTRasterBand dataType="Byte">\n'
+            # presence is 0/1, GDAL masks are 0/255
+            '      <ComplexSource>\n'
+            '        <SourceFilename relativeToVRT="1">{presence_file}</SourceFilename>\n'
+            '        <SourceBand>1</SourceBand>\n'
+            '        <ScaleRatio>255</ScaleRatio>\n'
+            '      </ComplexSource>\n'
+            '    </VRTRasterBand>\n'
+            '  </MaskBand>\n'
+            '</VRTDataset>\n'
+        ).format(width=src.width, height=src.height, srs=escape(src.crs.to_wkt()),
+                 geotransform=', '.join(repr(value) for value in src.transform.to_gdal()),
+                 data_type=data_type, nodata=nodata,
+                 height_file=escape(os.path.relpath(os.path.abspath(height_file), vrt_dir)),
+                 presence_file=escape(os.path.relpath(os.path.abspath(presence_file), vrt_dir)))
+    with open(out_vrt, 'w') as vrt_file:
+        vrt_file.write(vrt)
+    return out_vrt
+
+
+def read_masked(height_file, presence_file, window=None):
+    """
+    Read a height raster masked by a presence raster, the heights of a masked copy without writing one
+    :param height_file: height raster path
+    :param presence_file: presence raster path on the same grid
+    :param window: rasterio Window to read, None for the whole raster
+    :return: NumPy masked array of heights, masked outside the mangroves and at nodata cells
+    """
+    with rasterio.open(height_file) as src, rasterio.open(presence_file) as presence:
+        height_np = src.read(1, window=window, masked=True)
+        height_np.mask = np.ma.getmaskarray(height_np) | (presence.read(1, window=window) == 0)
+    return height_np
+
+
+def masked_heights(height_file, presence_file):
+    """
+    Heights of the mangrove cells of a height raster (e.g. for histograms and summary statistics),
+    read one presence tile at a time; tiles without mangroves are not read from the height raster
+    :param height_file: height raster path
+    :param presence_file: presence raster path on the same grid
+    :return: 1-D NumPy array of heights
+    """
+    with rasterio.open(height_file) as src, rasterio.open(presence_file) as presence:
+        values = [np.empty(0, dtype=src.dtypes[0])]
+        for _, window in presence.block_windows(1):
+            present = presence.read(1, window=window) != 0
+            if present.any():
+                values.append(src.read(1, window=window)[present])
+    return np.concatenate(values)
+
+
+def height_histogram(height_file, presence_file, bins):
+    """
+    Histogram of the heights of the mangrove cells of a height raster, accumulated one presence tile at a time
+    :param height_file: height raster path
+    :param presence_file: presence raster path on the same grid
+    :param bins: bin edges, as for numpy.histogram
+    :return: counts, bin edges
+    """
+    bins = np.asarray(bins)
+    counts = np.zeros(len(bins) - 1, dtype=np.int64)
+    with rasterio.open(height_file) as src, rasterio.open(presence_file) as presence:
+        for _, window in presence.block_windows(1):
+            present = presence.read(1, window=window) != 0
+            if present.any():
+                counts += np.histogram(src.read(1, window=window)[present], bins=bins)[0]
+    return counts, bins
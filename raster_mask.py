@@ -0,0 +1,205 @@
+""" raster_mask.py
+
+Date: 2026-10-18
+
+Mask rasters with several polygon layers (mangrove extent layers) in one pass
+Used by srtm_mangrovemask.py and mask_raster.py
+
+Each mask layer is loaded once into a shapely STRtree (see point_presence.polygon_tree) and reused for every raster.
+Each raster is opened and read once, and the masked output for every mask layer is cut from that one read, with
+only the polygons of the layer that intersect the raster, clipped to the raster. Masked cells are the same as
+rasterio.mask.mask(src, shapes, all_touched=True, crop=True) on each (raster, layer) pair (up to cells that a polygon
+edge only grazes within floating point rounding), and the crop is to the part of the polygons inside the raster
+
+For large rasters (e.g. 12 m TanDEM-X canopy heights) mask_raster_windowed writes the same cells one output tile at
+a time: the polygons are rasterized per window and only windows with masked cells are read, so memory stays flat.
+Its output is a tiled, compressed GeoTIFF with overviews
+
+"""
+
+import numpy as np
+import shapely
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.features import geometry_window, rasterize
+from rasterio.mask import raster_geometry_mask
+from rasterio.windows import Window
+from point_presence import polygon_tree
+
+# Windowed masking (mask_raster_windowed): output tile size, compression and overview levels
+OUT_BLOCK_SIZE = 512
+OUT_COMPRESS = 'deflate'
+OVERVIEW_LEVELS = [2, 4, 8, 16, 32]
+
+
+def layer_shapes(mask_file, bounds):
+    """
+    Polygons of a mask layer that intersect a bounding box, from the layer's spatial index
+    :param mask_file: polygon layer path
+    :param bounds: (left, bottom, right, top) in the layer CRS
+    :return: NumPy array of shapely geometries
+    """
+    tree = polygon_tree(mask_file)
+    return tree.geometries[tree.query(shapely.box(*bounds), predicate='intersects')]
+
+
+def tile_shapes(mask_file, src):
+    """
+    Polygons of a mask layer that intersect a raster, clipped to the raster bounds plus one cell on each side
+    Clipping leaves the cells of the raster covered (or touched) by each polygon unchanged, but large polygons
+    are reduced to the part that has to be rasterized
+    :param mask_file: polygon layer path
+    :param src: open rasterio dataset, in the layer CRS
+    :return: NumPy array of clipped shapely geometries (empty if the layer does not overlap the raster)
+    """
+    res_x, res_y = src.res
+    left, bottom, right, top = src.bounds
+    clip_bounds = (left - res_x, bottom - res_y, right + res_x, top + res_y)
+    shapes = shapely.clip_by_rect(layer_shapes(mask_file, clip_bounds), *clip_bounds)
+    return shapes[~shapely.is_empty(shapes)]
+
+
+def mask_read(src, data, shapes, all_touched=True):
+    """
+    Mask an already read raster with polygons and crop it to the polygons, like rasterio.mask.mask(crop=True)
+    :param src: open rasterio dataset the data were read from
+    :param data: masked array of all bands of src (src.read(masked=True))
+    :param shapes: polygons to mask with
+    :param all_touched: include all cells touched by the polygons, not just cells with their center inside
+    :return: out_image (filled with the nodata value, 0 if the raster has none), out_transform
+    """
+    shape_mask, out_transform, window = raster_geometry_mask(src, shapes, all_touched=all_touched, crop=True)
+    rows, cols = window.toslices()
+    out_image = data[:, rows, cols].copy()
+    out_image.mask = out_image.mask | shape_mask
+    nodata = src.nodata if src.nodata is not None else 0
+    return out_image.filled(nodata), out_transform
+
+
+def write_masked(out_raster_file, src_meta, out_image, out_transform):
+    """
+    Write a masked and cropped raster with the metadata of its source raster
+    :param out_raster_file: output raster file
+    :param src_meta: metadata of the source raster
+    :param out_image: NumPy array of bands, rows, cols
+    :param out_transform: transform of the cropped raster
+    :return:
+    """
+    out_meta = dict(src_meta)
+    out_meta.update({"driver": "GTiff",
+                     "height": out_image.shape[1],
+                     "width": out_image.shape[2],
+                     "transform": out_transform})
+
+    with rasterio.open(out_raster_file, "w", **out_meta) as dest:
+        dest.write(out_image)
+
+
+def mask_raster_layers(in_raster_file, mask_outputs, all_touched=True):
+    """
+    Mask one raster with several polygon layers, reading the raster once
+    Each layer only contributes its polygons that intersect the raster, clipped to the raster (see tile_shapes).
+    Layers that do not overlap the raster are skipped (no output raster), and the raster data are not read
+    at all when no layer overlaps
+    :param in_raster_file: input raster file
+    :param mask_outputs: list of (mask layer path, output raster file) pairs
+    :param all_touched: include all cells touched by the polygons, not just cells with their center inside
+    :return: list of the output raster files written
+    """
+    written = []
+    with rasterio.open(in_raster_file) as src:
+        # Only the raster header is needed to select the polygons of each layer
+        layer_outputs = []
+        for mask_file, out_raster_file in mask_outputs:
+            print(in_raster_file, mask_file, out_raster_file)
+            shapes = tile_shapes(mask_file, src)
+            if not len(shapes):
+                print("Mask and input raster do not overlap -- no output raster")
+                continue
+            layer_outputs.append((shapes, out_raster_file))
+        if not layer_outputs:
+            return written
+
+        data = src.read(masked=True)
+        for shapes, out_raster_file in layer_outputs:
+            try:
+                out_image, out_transform = mask_read(src, data, shapes, all_touched)
+            except ValueError:
+                # polygons touching the raster bounds only, with no cells to mask
+                print("Mask and input raster do not overlap -- no output raster")
+                continue
+            write_masked(out_raster_file, src.meta, out_image, out_transform)
+            written.append(out_raster_file)
+    return written
+
+
+def masked_profile(src_meta, window_transform, height, width):
+    """
+    Creation options for a tiled, compressed masked raster with the data type and nodata of its source raster
+    :param src_meta: metadata of the source raster
+    :param window_transform: transform of the cropped raster
+    :param height: number of rows of the cropped raster
+    :param width: number of columns of the cropped raster
+    :return: dictionary of rasterio creation options
+    """
+    profile = dict(src_meta)
+    profile.update({"driver": "GTiff",
+                    "height": height,
+                    "width": width,
+                    "transform": window_transform,
+                    "nodata": src_meta['nodata'] if src_meta['nodata'] is not None else 0,
+                    "tiled": True,
+                    "blockxsize": OUT_BLOCK_SIZE,
+                    "blockysize": OUT_BLOCK_SIZE,
+                    "compress": OUT_COMPRESS,
+                    "predictor": 3 if np.issubdtype(np.dtype(src_meta['dtype']), np.floating) else 2,
+                    # tiles without masked cells are never written and take no space in the file
+                    "sparse_ok": True})
+    return profile
+
+
+def mask_raster_windowed(in_raster_file, mask_file, out_raster_file, all_touched=True):
+    """
+    Mask a raster with a polygon layer one output tile at a time, cropped to the polygons
+    The polygons (clipped to the raster, see tile_shapes) are rasterized for each window, and the raster is only
+    read in windows with masked cells, so memory use does not grow with the raster size
+    :param in_raster_file: input raster file
+    :param mask_file: polygon layer path
+    :param out_raster_file: output tiled and compressed GeoTIFF, with overviews
+    :param all_touched: include all cells touched by the polygons, not just cells with their center inside
+    :return: True if the output raster was written, False if the mask and raster do not overlap
+    """
+    print(in_raster_file, mask_file, out_raster_file)
+    with rasterio.open(in_raster_file) as src:
+        shapes = tile_shapes(mask_file, src)
+        if not len(shapes):
+            print("Mask and input raster do not overlap -- no output raster")
+            return False
+        try:
+            crop = geometry_window(src, shapes)
+        except ValueError:
+            print("Mask and input raster do not overlap -- no output raster")
+            return False
+        # Polygons of each output tile are picked from an index of the clipped polygons
+        tree = shapely.STRtree(shapes)
+        profile = masked_profile(src.meta, src.window_transform(crop), crop.height, crop.width)
+        nodata = profile['nodata']
+
+        with rasterio.open(out_raster_file, 'w', **profile) as dst:
+            for _, window in dst.block_windows(1):
+                window_transform = dst.window_transform(window)
+                window_shapes = shapes[tree.query(shapely.box(*dst.window_bounds(window)))]
+                if not len(window_shapes):
+                    continue
+                inside = rasterize(window_shapes, out_shape=(window.height, window.width),
+                                   transform=window_transform, all_touched=all_touched, dtype=np.uint8)
+                if not inside.any():
+                    continue
+                src_window = Window(crop.col_off + window.col_off, crop.row_off + window.row_off,
+                                    window.width, window.height)
+                data = src.read(window=src_window, masked=True)
+                data.mask = data.mask | (inside == 0)
+                dst.write(data.filled(nodata), window=window)
+            dst.build_overviews(OVERVIEW_LEVELS, Resampling.nearest)
+            dst.update_tags(ns='rio_overview', resampling='nearest')
+    return True
@@ -0,0 +1,459 @@
+""" raster_points.py
+
+Date: 2026-10-18
+
+Convert single band rasters to point data sets (one point per valid cell center)
+Shared by gliht_prep.py and bathy_conabio_prep.py
+
+Cell center coordinates are calculated from the raster affine transform with NumPy array operations
+rather than calling DatasetReader.xy() once per cell, and reprojected as arrays with a cached transformer
+(see reproject.py) rather than GeoDataFrame.to_crs()
+
+Each point can carry a packed int64 cell key (see cell_keys) so point sets from rasters on the same
+grid lattice, like G-LiHT CHM and DTM tiles, can be joined on integers instead of float coordinates
+
+When the two rasters are on exactly the same grid, raster_pair_to_points() reads both bands into one
+point table in a single pass and no join is needed at all
+
+type='xy' returns a compact point table with reprojected lon/lat columns and no geometry objects (see point_table.py)
+
+For rasters too large to hold in memory, raster_to_point_chunks() walks the raster's internal
+block windows and write_point_chunks() streams the chunks to a geofeather (Arrow IPC) or GeoParquet file,
+or to a point store partitioned by SRTM tile (see point_store.py)
+
+"""
+
+import os
+import json
+import numpy as np
+import rasterio as rio
+import pandas as pd
+import geopandas as gpd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from pyproj import CRS
+from point_parquet import geoparquet_metadata, bbox_array, COMPRESSION, ROW_GROUP_SIZE
+from reproject import transform_xy
+from point_table import make_point_table
+from point_store import srtm_tile_ids, update_partition, write_partition_index
+
+# Default maximum number of points held in one chunk when streaming
+CHUNK_SIZE = 1000000
+
+
+def cell_centers(transform, rows, cols):
+    """
+    Calculate x/y coordinates of cell centers for arrays of row and column indices
+    Same result as DatasetReader.xy(row, col), but for all cells at once
+    :param transform: Affine transform of the raster
+    :param rows: NumPy array of row indices
+    :param cols: NumPy array of column indices
+    :return: x, y: NumPy float64 arrays of cell center coordinates in the raster CRS
+    """
+    col_center = cols + 0.5
+    row_center = rows + 0.5
+    x = transform.a * col_center + transform.b * row_center + transform.c
+    y = transform.d * col_center + transform.e * row_center + transform.f
+    return x, y
+
+
+def valid_cells(band_np):
+    """
+    Boolean array of valid cells in a masked array
+    Nodata cells are already masked by rasterio, NaN and inf values are added to the mask here
+    :param band_np: NumPy masked array read from a raster band
+    :return: NumPy boolean array, True for valid cells
+    """
+    valid = ~np.ma.getmaskarray(band_np)
+    if np.issubdtype(band_np.dtype, np.floating):
+        valid &= np.isfinite(band_np.data)
+    return valid
+
+
+def band_to_xyz(band_np, transform, row_off=0, col_off=0):
+    """
+    Extract row/col indices, cell center coordinates and values for valid cells of a band
+    :param band_np: NumPy masked array read from a raster band (or a window of it)
+    :param transform: Affine transform of the full raster
+    :param row_off: Row offset of band_np within the full raster (for windowed reads)
+    :param col_off: Column offset of band_np within the full raster (for windowed reads)
+    :return: rows, cols, x, y, vals: NumPy arrays, one element per valid cell
+    """
+    win_rows, win_cols = np.nonzero(valid_cells(band_np))
+    vals = band_np.data[win_rows, win_cols]
+    rows = win_rows + row_off
+    cols = win_cols + col_off
+    x, y = cell_centers(transform, rows, cols)
+    return rows, cols, x, y, vals
+
+
+# Largest distance (in cells) of a raster origin from the 0,0 key lattice
+LATTICE_TOLERANCE = 1e-6
+
+
+def lattice_origin(transform):
+    """
+    Column and row of a raster's upper left corner on the global key lattice (the grid with the raster's cell size
+    and its origin at 0,0 of the CRS)
+    Assumes the raster is aligned to that lattice (upper left corner a whole number of cells from 0,0), as are the
+    G-LiHT tiles; keys of rasters with other origins would not match cell for cell
+    :param transform: affine transform of the raster (north up)
+    :return: lattice column, lattice row of the upper left corner
+    """
+    col = transform.c / abs(transform.a)
+    row = transform.f / abs(transform.e)
+    origin_col = int(np.round(col))
+    origin_row = int(np.round(row))
+    if abs(col - origin_col) > LATTICE_TOLERANCE or abs(row - origin_row) > LATTICE_TOLERANCE:
+        raise ValueError("Raster origin ({}, {}) is not a whole number of cells ({}, {}) from 0,0, "
+                         "cell keys need a lattice aligned raster".format(transform.c, transform.f,
+                                                                           abs(transform.a), abs(transform.e)))
+    return origin_col, origin_row
+
+
+def cell_keys(transform, rows, cols):
+    """
+    Packed int64 key for raster cells, their column and row on the global lattice (see lattice_origin)
+    Keys are computed from the integer row/col indices and the origin offset, so they are not affected by
+    float differences in the coordinates (unlike joining or comparing on x/y directly), and cells of
+    different rasters on the same lattice get the same key
+    Lattice row index is in the high 32 bits, column index in the low 32 bits
+    :param transform: affine transform of the raster (north up)
+    :param rows: NumPy array of row indices in the raster
+    :param cols: NumPy array of column indices in the raster
+    :return: NumPy int64 array of cell keys
+    """
+    origin_col, origin_row = lattice_origin(transform)
+    lattice_col = origin_col + np.asarray(cols, dtype=np.int64)
+    # Rows count down from the top of the raster, lattice rows count up (north)
+    lattice_row = origin_row - 1 - np.asarray(rows, dtype=np.int64)
+    return (lattice_row << 32) | (lattice_col & 0xFFFFFFFF)
+
+
+def key_join(left_keys, right_keys, right_vals, fill_value=np.nan):
+    """
+    Left join of values to an array of keys, like pd.merge(how='left') but on NumPy arrays
+    Uses a sort of the right keys and a binary search instead of a hash merge of whole data frames
+    If a key occurs more than once on the right side, the first value is used, so the result
+    always has one element per left key
+    :param left_keys: NumPy int64 array of keys to look up
+    :param right_keys: NumPy int64 array of keys for right_vals
+    :param right_vals: NumPy array of values to join
+    :param fill_value: value for left keys with no match on the right
+    :return: NumPy array of joined values, aligned with left_keys
+    """
+    right_vals = np.asarray(right_vals)
+    out_dtype = np.result_type(right_vals.dtype, np.min_scalar_type(fill_value))
+    joined = np.full(len(left_keys), fill_value, dtype=out_dtype)
+    if not len(right_keys):
+        return joined
+    order = np.argsort(right_keys, kind='stable')
+    sorted_keys = right_keys[order]
+    pos = np.searchsorted(sorted_keys, left_keys, side='left')
+    pos_clip = np.minimum(pos, len(sorted_keys) - 1)
+    matched = sorted_keys[pos_clip] == left_keys
+    joined[matched] = right_vals[order[pos_clip[matched]]]
+    return joined
+
+
+def xyz_to_df(x, y, vals, cols, keys=None):
+    """
+    Create a data frame with value and x/y columns named with the output columns dictionary
+    :param x: NumPy array of x coordinates
+    :param y: NumPy array of y coordinates
+    :param vals: NumPy array of cell values
+    :param cols: dictionary with the output column names for 'x', 'y' and 'z' (and optionally 'key')
+    :param keys: NumPy int64 array of cell keys, added as the cols['key'] column if given
+    :return: Pandas DataFrame with z, x, y (and key) columns
+    """
+    pts_df = pd.DataFrame({
+        cols['z']: vals,
+        cols['x']: x,
+        cols['y']: y
+    })
+    if keys is not None:
+        pts_df[cols['key']] = keys
+    return pts_df
+
+
+def raster_to_points(raster_source, cols, type, threads=1):
+    """
+    Create a point data frame from the valid cells of a single band raster
+    :param raster_source: path to the input raster
+    :param cols: dictionary with the output column names for 'x', 'y' and 'z'
+        If it also has a 'key' entry, a packed int64 cell key column is added (see cell_keys)
+    :param type: 'df' for a data frame with coordinates in the raster CRS,
+        'gdf' for a point geodataframe reprojected to EPSG 4326,
+        'xy' for a point table with lon/lat columns (EPSG 4326) and no geometry (see point_table.py)
+    :param threads: number of threads used to reproject the points (see reproject.transform_xy)
+    :return: Pandas DataFrame or GeoPandas GeoDataFrame depending on type requested
+    """
+
+    print("Processing {}".format(raster_source))
+
+    # Read raster into a masked numpy array
+    with rio.open(raster_source) as src:
+        raster_np = src.read(1, masked=True)  # as NumPy masked array
+        raster_meta = src.meta
+        print(raster_meta)
+        # x,y coords in projection and associated value for valid (non-masked, non-nan) cells
+        rows, cols_idx, x_coords, y_coords, vals = band_to_xyz(raster_np, src.transform)
+        # Integer cell key for joining with other rasters on the same grid lattice
+        keys = cell_keys(src.transform, rows, cols_idx) if 'key' in cols else None
+    del raster_np, rows, cols_idx
+
+    # Create Pandas Data Frame with x, y, z values
+    pts_df = xyz_to_df(x_coords, y_coords, vals, cols, keys)
+    print(pts_df)
+
+    return points_df_to_type(pts_df, cols, raster_meta['crs'], type, threads)
+
+
+def points_df_to_type(pts_df, cols, crs, type, threads=1):
+    """
+    Return a point data frame as is, as a point geodataframe reprojected to EPSG 4326,
+    or as a point table with lon/lat columns in EPSG 4326
+    :param pts_df: Pandas DataFrame with x/y columns in the raster CRS
+    :param cols: dictionary with the x/y column names
+    :param crs: CRS of the x/y columns
+    :param type: 'df', 'gdf' or 'xy'
+    :param threads: number of threads used to reproject the points
+    :return: Pandas DataFrame or GeoPandas GeoDataFrame depending on type requested
+    """
+    # Return a simple data frame or geodataframe depending on type requested
+    if type == 'df':
+        return pts_df
+
+    elif type == 'gdf':
+        # Reproject the coordinate arrays to EPSG 4326 and build the points from them
+        # (same points as GeoDataFrame.to_crs, without creating a transformer per call)
+        lon, lat = transform_xy(pts_df[cols['x']].values, pts_df[cols['y']].values, crs, 4326, threads=threads)
+        pts_latlon_gdf = gpd.GeoDataFrame(pts_df, geometry=gpd.points_from_xy(lon, lat), crs='EPSG:4326')
+        print(pts_latlon_gdf)
+
+        return pts_latlon_gdf
+
+    elif type == 'xy':
+        # Reprojected coordinate columns only, geometry is built later if needed (point_table.to_geodataframe)
+        pts_table = make_point_table(pts_df, cols['x'], cols['y'], crs, threads=threads)
+        print(pts_table)
+
+        return pts_table
+
+
+def same_grid(src_a, src_b):
+    """
+    Check whether two open rasters are on the same grid (same CRS, transform and shape)
+    :param src_a: first rasterio dataset
+    :param src_b: second rasterio dataset
+    :return: True if cells of the two rasters are co-registered one to one
+    """
+    return (src_a.crs == src_b.crs and
+            src_a.shape == src_b.shape and
+            src_a.transform.almost_equals(src_b.transform))
+
+
+def grids_match(raster_a, raster_b):
+    """
+    Check whether two raster files are on the same grid (see same_grid)
+    :param raster_a: path to the first raster
+    :param raster_b: path to the second raster
+    :return: True if cells of the two rasters are co-registered one to one
+    """
+    with rio.open(raster_a) as src_a, rio.open(raster_b) as src_b:
+        return same_grid(src_a, src_b)
+
+
+def raster_pair_to_points(base_source, join_source, cols, type, threads=1):
+    """
+    Create a point data frame from two co-registered rasters in a single pass, without a point join
+    Points are the valid cells of the base raster, and the join raster value is added for the same cell
+    (NaN where the join raster cell is not valid), the same result as a left join of the two point sets
+    :param base_source: path to the raster that defines the points
+    :param join_source: path to a raster on the same grid as base_source (see grids_match)
+    :param cols: dictionary with the output column names for 'x', 'y', 'z' (base value) and
+        'join_z' (join raster value), and optionally 'key'
+    :param type: 'df', 'gdf' or 'xy' (see raster_to_points)
+    :param threads: number of threads used to reproject the points
+    :return: Pandas DataFrame or GeoPandas GeoDataFrame depending on type requested
+    """
+
+    print("Processing {} with {}".format(base_source, join_source))
+
+    with rio.open(base_source) as src, rio.open(join_source) as join_src:
+        if not same_grid(src, join_src):
+            raise ValueError("{} and {} are not on the same grid".format(base_source, join_source))
+        raster_np = src.read(1, masked=True)
+        raster_meta = src.meta
+        print(raster_meta)
+        rows, cols_idx, x_coords, y_coords, vals = band_to_xyz(raster_np, src.transform)
+        del raster_np
+        keys = cell_keys(src.transform, rows, cols_idx) if 'key' in cols else None
+
+        # Values of the join raster at the same cells, NaN where not valid
+        join_np = join_src.read(1, masked=True)
+        join_valid = valid_cells(join_np)[rows, cols_idx]
+        join_vals = join_np.data[rows, cols_idx].astype(np.result_type(join_np.dtype, np.float32))
+        join_vals[~join_valid] = np.nan
+        del join_np, join_valid, rows, cols_idx
+
+    pts_df = xyz_to_df(x_coords, y_coords, vals, cols, keys)
+    pts_df[cols['join_z']] = join_vals
+    print(pts_df)
+
+    return points_df_to_type(pts_df, cols, raster_meta['crs'], type, threads)
+
+
+def raster_to_point_chunks(raster_source, cols, chunk_size=CHUNK_SIZE):
+    """
+    Generator of point data frames from the valid cells of a single band raster, read one block window at a time
+    Small blocks are combined until they reach chunk_size points, so peak memory depends on
+    the block and chunk size and not on the size of the raster
+    :param raster_source: path to the input raster
+    :param cols: dictionary with the output column names for 'x', 'y' and 'z'
+    :param chunk_size: approximate maximum number of points in each chunk
+    :return: yields Pandas DataFrames with z, x, y columns (coordinates in the raster CRS)
+    """
+
+    print("Processing {} by block window".format(raster_source))
+
+    with rio.open(raster_source) as src:
+        print(src.meta)
+
+        def pending_to_df(pending):
+            rows, cols_idx, x, y, vals = [np.concatenate(arrs) for arrs in zip(*pending)]
+            keys = cell_keys(src.transform, rows, cols_idx) if 'key' in cols else None
+            return xyz_to_df(x, y, vals, cols, keys)
+
+        pending = []
+        pending_count = 0
+        for _, window in src.block_windows(1):
+            band_np = src.read(1, window=window, masked=True)
+            rows, cols_idx, x, y, vals = band_to_xyz(band_np, src.transform, window.row_off, window.col_off)
+            if not len(vals):
+                continue
+            pending.append((rows, cols_idx, x, y, vals))
+            pending_count += len(vals)
+            if pending_count >= chunk_size:
+                yield pending_to_df(pending)
+                pending = []
+                pending_count = 0
+        if pending:
+            yield pending_to_df(pending)
+
+
+def chunk_to_table(pts_df, cols, src_crs, dst_crs):
+    """
+    Convert a chunk of points to an Arrow table with a WKB geometry column in the output CRS
+    :param pts_df: Pandas DataFrame with z, x, y columns in the source CRS
+    :param cols: dictionary with the output column names for 'x', 'y' and 'z'
+    :param src_crs: CRS of the x/y columns
+    :param dst_crs: CRS for the output geometry
+    :return: pyarrow Table, GeoSeries of the points in the output CRS
+    """
+    lon, lat = transform_xy(pts_df[cols['x']].values, pts_df[cols['y']].values, src_crs, dst_crs)
+    geometry = gpd.GeoSeries.from_xy(lon, lat, crs=dst_crs)
+    pts_table = pa.Table.from_pandas(pts_df, preserve_index=False)
+    return pts_table.append_column('geometry', pa.array(geometry.to_wkb(), type=pa.binary())), geometry
+
+
+def append_table(writers, out_path, pts_table, out_format, crs):
+    """
+    Append an Arrow table to an output file, opening a writer for the file on first use
+    :param writers: dictionary of open writers by output path, modified in place
+    :param out_path: output file path
+    :param pts_table: pyarrow Table with a WKB geometry column (and a bbox covering column for 'parquet')
+    :param out_format: 'feather' or 'parquet'
+    :param crs: pyproj CRS of the geometry column
+    :return:
+    """
+    writer = writers.get(out_path)
+    if writer is None:
+        if out_format == 'feather':
+            writer = pa.ipc.new_file(out_path, pts_table.schema,
+                                     options=pa.ipc.IpcWriteOptions(compression='lz4'))
+        elif out_format == 'parquet':
+            schema = pts_table.schema.with_metadata(geoparquet_metadata(crs))
+            writer = pq.ParquetWriter(out_path, schema, compression=COMPRESSION)
+        else:
+            raise ValueError("Unknown output format {}".format(out_format))
+        writers[out_path] = writer
+    if out_format == 'parquet':
+        pts_table = pts_table.replace_schema_metadata(writer.schema.metadata)
+        writer.write_table(pts_table, row_group_size=ROW_GROUP_SIZE)
+    else:
+        writer.write_table(pts_table)
+
+
+def write_point_chunks(chunks, cols, src_crs, out_path, out_format='feather', dst_epsg=4326):
+    """
+    Stream point chunks to an output file without holding the whole point set in memory
+    'feather' output is Arrow IPC with WKB geometry and a .crs sidecar, readable with geofeather.from_geofeather
+    'parquet' output is GeoParquet with a bbox covering column, readable with point_parquet.read_geoparquet
+    or geopandas.read_parquet
+    'partitioned' output is a point store directory with one feather file per SRTM 1 degree tile
+    (see point_store.read_partitioned), dst_epsg must be 4326
+    :param chunks: iterable of Pandas DataFrames with z, x, y columns (from raster_to_point_chunks)
+    :param cols: dictionary with the output column names for 'x', 'y' and 'z'
+    :param src_crs: CRS of the x/y columns
+    :param out_path: output file path (directory for 'partitioned')
+    :param out_format: 'feather', 'parquet' or 'partitioned'
+    :param dst_epsg: EPSG code for the output geometry
+    :return: number of points written
+    """
+    dst_crs = CRS.from_epsg(dst_epsg)
+    writers = {}
+    partitions = {}
+    pt_count = 0
+    if out_format == 'partitioned':
+        os.makedirs(out_path, exist_ok=True)
+    try:
+        for pts_df in chunks:
+            pts_table, geometry = chunk_to_table(pts_df, cols, src_crs, dst_crs)
+            if out_format == 'partitioned':
+                # Split the chunk by SRTM tile and append each part to its tile's file
+                lon = geometry.x.values
+                lat = geometry.y.values
+                tile_ids = srtm_tile_ids(lon, lat)
+                for tile_id in np.unique(tile_ids):
+                    in_tile = tile_ids == tile_id
+                    partition = update_partition(partitions, tile_id, lon[in_tile], lat[in_tile])
+                    append_table(writers, os.path.join(out_path, partition['file']),
+                                 pts_table.filter(pa.array(in_tile)), 'feather', dst_crs)
+            else:
+                if out_format == 'parquet':
+                    # Row groups come from raster block windows, so their bbox statistics are already compact
+                    pts_table = pts_table.append_column('bbox', bbox_array(geometry.x.values, geometry.y.values))
+                append_table(writers, out_path, pts_table, out_format, dst_crs)
+            pt_count += pts_table.num_rows
+            print("{} points written to {}".format(pt_count, out_path))
+    finally:
+        for writer in writers.values():
+            writer.close()
+
+    # geofeather stores the CRS in a separate file next to the feather file
+    if out_format in ('feather', 'partitioned'):
+        for feather_path in writers:
+            with open("{}.crs".format(feather_path), "w") as crsfile:
+                crsfile.write(json.dumps({"wkt": dst_crs.to_wkt()}))
+    if out_format == 'partitioned':
+        write_partition_index(out_path, partitions, dst_crs)
+
+    return pt_count
+
+
+def raster_to_points_file(raster_source, cols, out_path, out_format='feather', chunk_size=CHUNK_SIZE):
+    """
+    Convert a raster to points and write them to a file in chunks, reprojected to EPSG 4326
+    Streaming equivalent of to_geofeather(raster_to_points(raster_source, cols, type='gdf'), out_path)
+    :param raster_source: path to the input raster
+    :param cols: dictionary with the output column names for 'x', 'y' and 'z'
+    :param out_path: output file path (directory for 'partitioned')
+    :param out_format: 'feather', 'parquet' or 'partitioned'
+    :param chunk_size: approximate maximum number of points in each chunk
+    :return: number of points written
+    """
+    with rio.open(raster_source) as src:
+        src_crs = src.crs
+    chunks = raster_to_point_chunks(raster_source, cols, chunk_size)
+    return write_point_chunks(chunks, cols, src_crs, out_path, out_format)
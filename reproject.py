@@ -0,0 +1,82 @@
+""" reproject.py
+
+Date: 2026-10-18
+
+Reproject point coordinate arrays with cached pyproj Transformers
+Used by raster_points.py and point_table.py for every point reprojection (e.g. UTM 16N -> EPSG 4326)
+
+GeoDataFrame.to_crs() builds a new Transformer on every call and works through geometry objects.
+Here a Transformer is created once per (source CRS, destination CRS) pair and reused, and raw x/y arrays are
+transformed in place in fixed size chunks. PROJ releases the GIL while transforming, so chunks can be spread
+over several threads; pyproj Transformers should not be shared between threads, so the cache is per thread
+
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from pyproj import CRS, Transformer
+
+# Number of points transformed in one call
+TRANSFORM_CHUNK_SIZE = 1000000
+
+
+def crs_key(crs):
+    """
+    Hashable key for a CRS given as anything pyproj accepts (EPSG code, 'EPSG:32616', WKT, rasterio or pyproj CRS)
+    :param crs: coordinate reference system
+    :return: WKT string
+    """
+    if hasattr(crs, 'to_wkt'):
+        return crs.to_wkt()
+    return CRS.from_user_input(crs).to_wkt()
+
+
+# Transformers of the current thread by (source WKT, destination WKT), freed with the thread
+_thread_cache = threading.local()
+
+
+def get_transformer(src_crs, dst_crs):
+    """
+    Transformer from one CRS to another (x/y order, i.e. lon/lat for geographic CRS), created once per
+    CRS pair and thread and reused on later calls
+    :param src_crs: source CRS
+    :param dst_crs: destination CRS
+    :return: pyproj Transformer
+    """
+    transformers = getattr(_thread_cache, 'transformers', None)
+    if transformers is None:
+        transformers = _thread_cache.transformers = {}
+    key = (crs_key(src_crs), crs_key(dst_crs))
+    if key not in transformers:
+        transformers[key] = Transformer.from_crs(CRS.from_wkt(key[0]), CRS.from_wkt(key[1]), always_xy=True)
+    return transformers[key]
+
+
+def transform_xy(x, y, src_crs, dst_crs, chunk_size=TRANSFORM_CHUNK_SIZE, threads=1):
+    """
+    Reproject coordinate arrays, without building geometry objects
+    Same coordinates as GeoSeries.to_crs() for points
+    :param x: NumPy array of x coordinates in src_crs
+    :param y: NumPy array of y coordinates in src_crs
+    :param src_crs: CRS of the coordinates
+    :param dst_crs: output CRS
+    :param chunk_size: number of points transformed in one call
+    :param threads: number of threads transforming chunks in parallel
+    :return: x, y: new NumPy float64 arrays in dst_crs (x is longitude for geographic CRS)
+    """
+    out_x = np.array(x, dtype=np.float64)
+    out_y = np.array(y, dtype=np.float64)
+
+    def transform_chunk(start):
+        get_transformer(src_crs, dst_crs).transform(out_x[start:start + chunk_size], out_y[start:start + chunk_size],
+                                                    inplace=True)
+
+    starts = range(0, len(out_x), chunk_size)
+    if threads > 1 and len(starts) > 1:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(transform_chunk, starts))
+    else:
+        for start in starts:
+            transform_chunk(start)
+    return out_x, out_y
@@ -7,6 +7,17 @@ Vectorized the Masked SRTM grids and overlay with the mangrove polygons
 
 Assumes all geographic data are in the same projection (currently EPSG 4326)
 
+By default (method='vector') the grid is polygonized and intersected with the mangrove polygons with gpd.overlay,
+and the pieces are written to a shapefile (<tile>_overlay.shp). method='raster' is the raster-native overlay (see
+height_overlay.py): the mangrove polygon ids are rasterized onto the height grid and the area of every polygon in
+every height class is summed with array reductions; it writes a table of areas (<tile>_overlay.csv), or the
+pieces to the shapefile with geometry=True
+
+Tiles are run by tile_farm.run_tiles: one worker per physical core, largest tiles (most mangrove polygons) first,
+with a timeout and retry per tile and a timing summary. Workers read the polygons of their tile from a GeoParquet
+store of the mangrove layer (see layer_store.py) instead of being sent a pickled copy of the whole layer, clipped
+to the tile, so the overlay cost follows the mangrove density of the tile rather than the size of the layer
+
 Examples of raster to poly:
 https://gis.stackexchange.com/questions/295362/how-to-polygonize-raster-file-according-to-band-values
 https://gis.stackexchange.com/questions/187877/how-to-polygonize-raster-to-shapely-polygons
@@ -21,7 +32,9 @@ import pprint
 import rasterio
 from rasterio import features
 import geopandas as gpd
-import multiprocessing
+from height_overlay import overlay_heights
+from layer_store import layer_store_path, write_layer_store, read_tile_polygons, count_in_bounds
+from tile_farm import physical_cores, run_tiles
 
 
 def time_elapsed(start_time):
@@ -34,14 +47,38 @@ def time_elapsed(start_time):
     # print(str(datetime.timedelta(seconds=te)))
     return str(datetime.timedelta(seconds=te))
 
-def process_data(hgtgrid_file, mangrove_gdf, attribute):
+def process_data(hgtgrid_file, mangrove_gdf, attribute, method='vector', geometry=False, bins=None):
     """
 
-    :param hgtgrid_file: mangrove height estimate grid
+    :param hgtgrid_file: mangrove height estimate grid, a masked copy or a masked VRT (only unmasked cells are
+        vectorized, see presence_raster.py)
     :param mangrove_gdf: mangrove boundary polygons as a GeoDataFrame
-    :return:
+    :param attribute: name of the height column (e.g. hba_m)
+    :param method: 'raster' for the raster-native overlay (height_overlay.py), 'vector' to polygonize the grid
+        and intersect the polygons with gpd.overlay
+    :param geometry: raster method only, True to write the (polygon, height class) pieces to a shapefile
+        (<tile>_overlay.shp), False to write the areas only, as a table (<tile>_overlay.csv)
+    :param bins: raster method only, height class bin edges, None for one class per grid value
+    :return: output file path, None if the grid has no mangrove heights
 
     """
+    if method == 'raster':
+        start_time = time.time()
+        height_df = overlay_heights(hgtgrid_file, mangrove_gdf, attribute, bins=bins, geometry=geometry)
+        print("Raster overlay time for {0}: {1}".format(hgtgrid_file, time_elapsed(start_time)))
+        # No output for all No Data grids, like the vector method
+        if height_df is not None:
+            tile_name = os.path.splitext(hgtgrid_file)[0]
+            if geometry:
+                out_file = "{}_overlay.shp".format(tile_name)
+                height_df.to_file(out_file)
+            else:
+                out_file = "{}_overlay.csv".format(tile_name)
+                height_df.to_csv(out_file, index=False)
+            print(out_file)
+            return out_file
+        return None
+
     # # From https://rasterio.readthedocs.io/en/stable/topics/features.html#extracting-shapes-of-raster-features
     # # Tuple of geometry and raster
     # #   -- Did not Use this section
@@ -87,34 +124,63 @@ def process_data(hgtgrid_file, mangrove_gdf, attribute):
         out_polygon_file = "{}_overlay.shp".format(tile_name)
         height_intersect_gdf.to_file(out_polygon_file)
         print(out_polygon_file)
+        return out_polygon_file
 
 
-def worker(work_queue, poly_gdf, attribute):
-
-    for raster in iter(work_queue.get, 'STOP'):
-        print(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") + ', begin processing file ' + raster)
-        process_data(raster, poly_gdf, attribute)
-        print(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") + ', finished processing file ' + raster)
-        work_queue.task_done()
-    work_queue.task_done()
-
+def process_tile(hgtgrid_file, store_path, attribute, method='vector', geometry=False):
+    """
+    Overlay one height grid with the mangrove polygons of its tile, read from the layer store and clipped to the
+    tile (plus one cell on each side, so no polygon edge is moved inside the grid)
+    Run in a worker process by tile_farm.run_tiles
+    :param hgtgrid_file: mangrove height estimate grid (see process_data)
+    :param store_path: GeoParquet store of the mangrove layer (see layer_store.py)
+    :param attribute: name of the height column (e.g. hba_m)
+    :param method: 'raster' or 'vector' (see process_data)
+    :param geometry: True to write polygon geometry with the raster method
+    :return: output file path, None if the grid has no mangrove heights
+    """
+    print(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") + ', begin processing file ' + hgtgrid_file)
+    with rasterio.open(hgtgrid_file) as src:
+        res_x, res_y = src.res
+        left, bottom, right, top = src.bounds
+    mangrove_gdf = read_tile_polygons(store_path, (left - res_x, bottom - res_y, right + res_x, top + res_y))
+    out_file = process_data(hgtgrid_file, mangrove_gdf, attribute, method=method, geometry=geometry)
+    print(datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S") + ', finished processing file ' + hgtgrid_file)
+    return out_file
 
-def main(raster_list, mangrove_gdf, attribute):
-    work_queue = multiprocessing.JoinableQueue()
 
+def main(raster_list, mangrove_layer, attribute, method='vector', geometry=False, workers=None, timeout=None,
+         retries=1, store_dir=''):
+    """
+    Overlay height grids with mangrove polygons, one tile per worker process
+    :param raster_list: list of height grid paths
+    :param mangrove_layer: path to the mangrove polygon layer, or a GeoDataFrame of the polygons
+    :param attribute: name of the height column (e.g. hba_m)
+    :param method: 'raster' or 'vector' (see process_data)
+    :param geometry: True to write polygon geometry with the raster method
+    :param workers: number of worker processes, None for the number of physical cores
+    :param timeout: seconds a tile may run before it is stopped, None for no limit
+    :param retries: number of times a failed or timed out tile is run again
+    :param store_dir: directory for the GeoParquet store of the mangrove layer
+    :return: list of tile_farm.run_tile result dictionaries, in the order of raster_list
+    """
+    if isinstance(mangrove_layer, gpd.GeoDataFrame):
+        store_path = os.path.join(store_dir, 'mangrove_layer.parquet')
+    else:
+        store_path = layer_store_path(mangrove_layer, store_dir)
+    write_layer_store(mangrove_layer, store_path)
+
+    if workers is None:
+        workers = physical_cores()
+    bounds_list = []
     for raster in raster_list:
-        work_queue.put(raster)
-
-    # NUMBER_OF_PROCESSES = multiprocessing.cpu_count()
-    # print(NUMBER_OF_PROCESSES)  # This returns 16 on my 8 core machine ??
-    NUMBER_OF_PROCESSES = 1
-    for _ in range(NUMBER_OF_PROCESSES):
-        multiprocessing.Process(target=worker, args=[work_queue, mangrove_gdf, attribute]).start()
-
-    for _ in range(NUMBER_OF_PROCESSES):
-        work_queue.put('STOP')
-
-    work_queue.join()
+        with rasterio.open(raster) as src:
+            bounds_list.append(tuple(src.bounds))
+    tasks = [(os.path.basename(raster), process_tile, (raster, store_path, attribute, method, geometry))
+             for raster in raster_list]
+    # Tiles with the most mangrove polygons take longest, so they are started first
+    return run_tiles(tasks, workers=workers, sizes=count_in_bounds(store_path, bounds_list), timeout=timeout,
+                     retries=retries)
 
 
 if __name__ == "__main__":
@@ -132,10 +198,6 @@ if __name__ == "__main__":
     gmw2016_path = os.path.join(data_dir, 'gmw2016_Bahamas_MAR.shp')
     gmw2016_prefix = 'gmw2016'
 
-    # Load mangrove polygons
-    wam_gdf = gpd.GeoDataFrame.from_file(wam_path)
-    gmw2016_gdf = gpd.GeoDataFrame.from_file(gmw2016_path)
-
     # Working directory
     work_dir = os.path.join(data_dir, 'srtm')
     os.chdir(work_dir)
@@ -145,31 +207,32 @@ if __name__ == "__main__":
     hba_attribute = '{}_m'.format(hba_prefix)
     hmax_attribute = '{}_m'.format(hmax_prefix)
 
-    wam_hmax_rasters = glob.glob("wam_hmax_*.tif")
-    wam_hba_rasters = glob.glob("wam_hba_*.tif")
-    gmw2016_hmax_rasters = glob.glob("gmw2016_hmax_*.tif")
-    gmw2016_hba_rasters = glob.glob("gmw2016_hba_*.tif")
+    # Masked copies (*.tif) or masked VRTs over presence rasters (*.vrt, srtm_mangrovemask.py with presence=True)
+    wam_hmax_rasters = glob.glob("wam_hmax_*.tif") + glob.glob("wam_hmax_*.vrt")
+    wam_hba_rasters = glob.glob("wam_hba_*.tif") + glob.glob("wam_hba_*.vrt")
+    gmw2016_hmax_rasters = glob.glob("gmw2016_hmax_*.tif") + glob.glob("gmw2016_hmax_*.vrt")
+    gmw2016_hba_rasters = glob.glob("gmw2016_hba_*.tif") + glob.glob("gmw2016_hba_*.vrt")
 
     # Testing subsets or missing tiles
     # input_rasters = ['wam_hba_N21W087.tif', 'wam_hba_N21W088.tif', 'wam_hba_N21W089.tif', 'wam_hba_N21W090.tif']
     # input_rasters = ['wam_hba_N21W087.tif']
-    # main(input_rasters, wam_gdf, hba_attribute)
+    # main(input_rasters, wam_path, hba_attribute)
     # input_rasters = ['wam_hmax_N16W088.tif', 'wam_hmax_N24W080.tif', 'wam_hmax_N26W080.tif', 'wam_hmax_N22W076.tif']
-    # main(input_rasters, wam_gdf, hmax_attribute)
+    # main(input_rasters, wam_path, hmax_attribute)
 
     # These didn't complete in the original run -- seem to have significantly more polys than other tiles
     input_rasters = ['gmw2016_hba_N19W088.tif', 'gmw2016_hba_N20W091.tif']
-    main(input_rasters, gmw2016_gdf, hba_attribute)
+    main(input_rasters, gmw2016_path, hba_attribute, timeout=4 * 3600)
     input_rasters = ['gmw2016_hmax_N19W088.tif', 'gmw2016_hmax_N20W091.tif']
-    main(input_rasters, gmw2016_gdf, hmax_attribute)
+    main(input_rasters, gmw2016_path, hmax_attribute, timeout=4 * 3600)
 
     #-- FINAL - Max Height and WAM
-    # main(wam_hmax_rasters, wam_gdf, hmax_attribute)
+    # main(wam_hmax_rasters, wam_path, hmax_attribute)
     #
-    # main(wam_hba_rasters, wam_gdf, hba_attribute)
+    # main(wam_hba_rasters, wam_path, hba_attribute)
     #
-    # main(gmw2016_hmax_rasters, gmw2016_gdf, hmax_attribute)
+    # main(gmw2016_hmax_rasters, gmw2016_path, hmax_attribute)
     #
-    # main(gmw2016_hba_rasters, gmw2016_gdf, hba_attribute)
+    # main(gmw2016_hba_rasters, gmw2016_path, hba_attribute)
 
 
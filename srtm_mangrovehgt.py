@@ -12,128 +12,220 @@ SRTM Hmax = 1.697 x Hsrtm
 Basal area weighted mangrove canopy height
 SRTM Hba = 1.0754 x Hsrtm
 
+Both height grids are written in one pass over the SRTM tile, one output tile (block window) at a time, to tiled
+and compressed GeoTIFFs (or Cloud Optimized GeoTIFFs). The output data type comes from the range of the SRTM data
+type through the height model, so the heights are never scanned for their min/max
+
+The height models are registered in height_models.py (linear, piecewise linear, lookup table and regional models).
+Any list of registered models can be written as the bands of one hgtmodels_<tile>.tif grid, from the same read
+of the tile as the hmax and hba grids
+
+Run as a script, all SRTM tiles in the source directory are processed in a process pool (see tile_farm.py);
+zips are extracted once into a cache directory and tiles with outputs newer than their zip are skipped
+
 """
 
 import os
 import numpy as np
 import rasterio as rio
+from rasterio.shutil import copy as rio_copy
 import glob
-#import pprint
+from tile_farm import extract_zip, outputs_current, run_tiles, physical_cores
+from height_models import get_models
 
-# Simard et al (2019), https://doi.org/10.1038/s41561-018-0279-1
-HMAX_MULTIPLIER = 1.697
-HBA_MULTIPLIER = 1.0754
+# Output rasters are tiled GeoTIFFs, written and compressed one tile (block window) at a time
+OUT_BLOCK_SIZE = 512
+OUT_COMPRESS = 'deflate'
 
 
-def range2datatype(data_np):
+def dtype_range(dtype):
     """
-    Calculate the rasterio minimum data type that will hold the range of values in the array
-    :param data_np: NumPy array of data values
-    :return: datatype:  minimum datatype to include the range of values in the array
+    Range of values a NumPy data type can hold
+    :param dtype: NumPy or rasterio data type
+    :return: (min, max)
     """
-    min_value = np.min(data_np)
-    max_value = np.max(data_np)
-    datatype = rio.dtypes.get_minimum_dtype([min_value, max_value])
-    return datatype
+    dtype = np.dtype(dtype)
+    info = np.iinfo(dtype) if np.issubdtype(dtype, np.integer) else np.finfo(dtype)
+    return info.min, info.max
 
 
-def create_raster(data_np, metadata, out_file):
+def models_datatype(src_dtype, models, nodata=None):
     """
-    Create a single band raster file from a NumPy array with the specified metadata and output filename/path
-    :param data_np: Input NumPy data array
-    :param metadata: Spatial metadata for output raster
-    :param out_file: output raster filename or full path
-    :return:
+    Minimum rasterio data type that holds the heights of all models for any value of the input data type
+    Uses the known range of the input type, so the data don't have to be scanned for their min/max
+    :param src_dtype: data type of the input raster
+    :param models: list of HeightModel (see height_models.py)
+    :param nodata: output nodata value, which also has to fit
+    :return: datatype: minimum datatype to include the range of model heights
     """
+    min_value, max_value = dtype_range(src_dtype)
+    values = [bound for model in models for bound in model.value_range(min_value, max_value)]
+    if nodata is not None:
+        values.append(nodata)
+    return rio.dtypes.get_minimum_dtype(values)
 
-    # Check datatypes of array and metadata - change array to match metadata if necessary
-    if data_np.dtype != metadata['dtype']:
-        data_np = data_np.astype(metadata['dtype'])
 
-    # Create output raster
-    with rio.open(out_file, 'w', **metadata) as dst:
-        dst.write(data_np, 1)
-    print(out_file)
-
-
-def main(srtm_source):
+def height_profile(src, dtype, count=1, cog=False):
     """
-    Main script to create two mangrove height grids from SRTM grid
-    :param srtm_source: path for the input SRTM raster
-    :return:
+    Creation options for a tiled, compressed height raster on the grid of the source raster
+    A new dictionary each call, so outputs never share (and change) one metadata dictionary
+    :param src: open source rasterio dataset
+    :param dtype: output data type
+    :param count: number of bands
+    :param cog: True for the intermediate GeoTIFF of a Cloud Optimized GeoTIFF (see write_height_models)
+    :return: dictionary of rasterio creation options
+    """
+    return {
+        'driver': 'GTiff',
+        'dtype': dtype,
+        'nodata': src.nodata,
+        'width': src.width,
+        'height': src.height,
+        'count': count,
+        'crs': src.crs,
+        'transform': src.transform,
+        'tiled': True,
+        'blockxsize': OUT_BLOCK_SIZE,
+        'blockysize': OUT_BLOCK_SIZE,
+        # the COG driver compresses the final copy, so the intermediate file is left uncompressed
+        'compress': None if cog else OUT_COMPRESS,
+        'predictor': 3 if np.issubdtype(np.dtype(dtype), np.floating) else 2,
+    }
+
+
+def write_height_models(srtm_source, outputs, cog=False):
+    """
+    Write height model rasters from an SRTM (or TanDEM-X) tile, reading the tile one window at a time
+    Every model of every output is evaluated on the same window read, straight into its tiled output raster,
+    and input nodata (void) cells stay nodata
+    :param srtm_source: path for the input SRTM raster (hgt or hgt.zip), or a GeoTIFF height raster
+    :param outputs: list of (list of height model names, output raster path) pairs, one band per model
+        (see height_models.py for the registered models)
+    :param cog: True to write Cloud Optimized GeoTIFFs (with overviews) instead of plain tiled GeoTIFFs
+    :return: list of output raster paths
+    """
+    driver = 'SRTMHGT' if '.hgt' in os.path.basename(srtm_source) else None
+    output_models = [get_models(model_names) for model_names, _ in outputs]
+    with rio.open(srtm_source, driver=driver) as srtm:
+        nodata = srtm.nodata
+        profiles = [height_profile(srtm, models_datatype(srtm.dtypes[0], models, nodata), len(models), cog)
+                    for models in output_models]
+        write_paths = ["{}.tmp.tif".format(out_file) if cog else out_file for _, out_file in outputs]
+        dsts = [rio.open(write_path, 'w', **profile) for write_path, profile in zip(write_paths, profiles)]
+        try:
+            for models, dst in zip(output_models, dsts):
+                for band, model in enumerate(models, start=1):
+                    dst.set_band_description(band, model.name)
+                    dst.update_tags(band, model=model.name, description=model.description)
+            # Windows are the output tiles, so each tile is written (and compressed) once
+            for _, window in dsts[0].block_windows(1):
+                srtm_np = srtm.read(1, window=window)
+                window_transform = srtm.window_transform(window)
+                void = srtm_np == nodata if nodata is not None else None
+                for models, profile, dst in zip(output_models, profiles, dsts):
+                    for band, model in enumerate(models, start=1):
+                        height_np = np.asarray(model.evaluate(srtm_np, window_transform))
+                        if nodata is not None:
+                            height_np = np.where(void | ~np.isfinite(height_np), nodata, height_np)
+                        dst.write(height_np.astype(profile['dtype']), band, window=window)
+        finally:
+            for dst in dsts:
+                dst.close()
+
+    if cog:
+        for write_path, (_, out_file) in zip(write_paths, outputs):
+            rio_copy(write_path, out_file, driver='COG', compress=OUT_COMPRESS, blocksize=OUT_BLOCK_SIZE,
+                     predictor='YES')
+            os.remove(write_path)
+
+    for _, out_file in outputs:
+        print(out_file)
+    return [out_file for _, out_file in outputs]
+
+
+def height_filenames(srtm_source, out_dir='', models=None):
+    """
+    Output raster paths for the Maximum Height and Basal Area Weighted Height grids of an SRTM tile,
+    and for the multi-band grid of other height models if any are requested
+    :param srtm_source: path for the input SRTM raster (zip or extracted hgt)
+    :param out_dir: output directory ('' for the current directory)
+    :param models: list of height model names for the multi-band grid, None for no multi-band grid
+    :return: list of hmax_filename, hba_filename (and models_filename)
     """
     # output raster variables
-    out_driver = 'GTiff'  # GDAL raster driver for output raster
     out_ext = 'tif'
 
-    with rio.open(srtm_source, driver='SRTMHGT') as srtm:
-    # Get SRTM as NumPy array and it's metadata
-        srtm_np = srtm.read(1)
-        srtm_meta = srtm.meta
-        # print(srtm.name)
-        # pprint.pprint(srtm_meta)
-
-        # Create NumPy arrays from SRTM using the corresponding multipliers for
-        # Maximum Height and Basal Area Weighted Height
-        hmax_np = srtm_np * HMAX_MULTIPLIER
-        hba_np = srtm_np * HBA_MULTIPLIER
-
-        # Determine the best output datatype for each height array
-        hmax_datatype = range2datatype(hmax_np)
-        hba_datatype = range2datatype(hba_np)
-
-        # Create metadata for output mangrove height rasters
-        # Max Height
-        hmax_meta = srtm_meta  # Copy metadata from SRTM input
-        hmax_meta.update({
-            'dtype' : hmax_datatype,
-            'driver' : out_driver
-        })
-        # Basal Area Weighted Height
-        hba_meta = srtm_meta
-        hba_meta.update({
-            'dtype' : hba_datatype,
-            'driver' : out_driver
-        })
-
-        # Get the source SRTM filename and pull out the first part which is the Tile identifier (looks like this: N##W###)
-        filename = os.path.basename(srtm.name)
-        tileid = filename.split('.')[0]
-
-        # Filenames for Max Height and Basal Area Weighted Height output rasters
-        hmax_filename = '{}_{}.{}'.format('hmax', tileid, out_ext)
-        hba_filename = '{}_{}.{}'.format('hba', tileid, out_ext)
-
-        # Create raster files
-        create_raster(hmax_np, hmax_meta, hmax_filename)
-        create_raster(hba_np, hba_meta, hba_filename)
+    # Get the source SRTM filename and pull out the first part which is the Tile identifier (looks like this: N##W###)
+    filename = os.path.basename(srtm_source)
+    tileid = filename.split('.')[0]
 
+    # Filenames for Max Height and Basal Area Weighted Height output rasters
+    hmax_filename = os.path.join(out_dir, '{}_{}.{}'.format('hmax', tileid, out_ext))
+    hba_filename = os.path.join(out_dir, '{}_{}.{}'.format('hba', tileid, out_ext))
+    filenames = [hmax_filename, hba_filename]
+    if models:
+        # One band per height model, in the order requested
+        filenames.append(os.path.join(out_dir, '{}_{}.{}'.format('hgtmodels', tileid, out_ext)))
+    return filenames
 
-### ------ Setup directories and data for input and output in the main script ----------
-
-# Source directory, SRTM
-source_dir = '/Users/arbailey/natcap/idb/data/source/srtm/nasa'
-# Working and output directory
-work_dir = '/Users/arbailey/natcap/idb/data/work/mangroves/srtm'
-
-# srtm_source = os.path.join(source_dir, 'N23W078.SRTMGL1.hgt.zip')  # one file for testing
 
-# Get a list of all files with the SRTM extension in the source directory
-os.chdir(source_dir)
-srtm_files = glob.glob("*.hgt.zip")
-srtm_files_path = [os.path.join(source_dir, file) for file in srtm_files]  # add directory path
-print(srtm_files)
+def main(srtm_source, cog=False, out_dir='', models=None):
+    """
+    Main script to create two mangrove height grids from SRTM grid
+    :param srtm_source: path for the input SRTM raster
+    :param cog: True to write Cloud Optimized GeoTIFFs
+    :param out_dir: output directory ('' for the current directory)
+    :param models: list of registered height model names (see height_models.py) to also write as bands
+        of one hgtmodels_<tile>.tif grid, None for only the hmax and hba grids
+    :return: list of output raster paths
+    """
+    filenames = height_filenames(srtm_source, out_dir, models)
 
-# Call the main script with each source file
-os.chdir(work_dir)  # Change to output directory
-for srtm_source in srtm_files_path:
-    main(srtm_source)
+    # Create raster files for Maximum Height and Basal Area Weighted Height (and the other height models)
+    # in one pass over the SRTM tile
+    outputs = [(['hmax_simard'], filenames[0]), (['hba_simard'], filenames[1])]
+    if models:
+        outputs.append((models, filenames[2]))
+    return write_height_models(srtm_source, outputs, cog=cog)
 
 
+def process_tile(srtm_zip, out_dir, cache_dir, cog=False, overwrite=False, models=None):
+    """
+    Create the mangrove height grids for one zipped SRTM tile, unless they are newer than the zip
+    The zip is extracted once into cache_dir and the extracted hgt file is read
+    Run in a worker process by tile_farm.run_tiles
+    :param srtm_zip: path for the zipped SRTM tile (*.hgt.zip)
+    :param out_dir: output directory
+    :param cache_dir: directory for extracted SRTM tiles
+    :param cog: True to write Cloud Optimized GeoTIFFs
+    :param overwrite: True to process the tile even if its outputs are up to date
+    :param models: list of height model names for the multi-band grid (see main)
+    :return: list of output raster paths, None if the tile was skipped
+    """
+    if not overwrite and outputs_current([srtm_zip], height_filenames(srtm_zip, out_dir, models)):
+        return None
+    srtm_hgt = extract_zip(srtm_zip, cache_dir)
+    return main(srtm_hgt, cog=cog, out_dir=out_dir, models=models)
 
 
+### ------ Setup directories and data for input and output in the main script ----------
 
+if __name__ == '__main__':
 
+    # Source directory, SRTM
+    source_dir = '/Users/arbailey/natcap/idb/data/source/srtm/nasa'
+    # Working and output directory
+    work_dir = '/Users/arbailey/natcap/idb/data/work/mangroves/srtm'
+    # Extracted SRTM tiles, reused by later runs
+    cache_dir = os.path.join(work_dir, 'hgt_cache')
 
+    # srtm_source = os.path.join(source_dir, 'N23W078.SRTMGL1.hgt.zip')  # one file for testing
 
+    # Get a list of all files with the SRTM extension in the source directory
+    srtm_files = sorted(glob.glob(os.path.join(source_dir, "*.hgt.zip")))
+    print(srtm_files)
 
+    # Process the tiles in parallel (one worker per physical core), skipping tiles with up to date outputs
+    tasks = [(os.path.basename(srtm_source).split('.')[0], process_tile, (srtm_source, work_dir, cache_dir))
+             for srtm_source in srtm_files]
+    run_tiles(tasks, workers=physical_cores())
@@ -7,13 +7,20 @@ Mask the SRTM grids with mangrove vector polygons
 
 Assumes all geographic data are in the same projection (EPSG 4326)
 
+Each raster is read once and masked with all of its mangrove layers, and each layer is loaded and spatially
+indexed once for all rasters (see raster_mask.py)
+
+By default each masked grid is written as a masked copy (<prefix>_<grid>.tif).
+With presence=True, no masked copies are written: each mask source is stored once per SRTM tile as a 1 bit presence
+raster (<prefix>_presence_<tile>.tif), shared by the hmax and hba grids of the tile, and each masked grid is a VRT
+(<prefix>_<grid>.vrt) of the height grid with the presence raster as its mask band (see presence_raster.py)
+
 """
 
 import os
 import glob
-import fiona
-import rasterio
-import rasterio.mask
+from raster_mask import mask_raster_layers
+from presence_raster import presence_filename, write_presence, write_masked_vrt
 
 def add_prefix(filename, prefix):
     return '{}_{}'.format(prefix, filename)
@@ -30,123 +37,95 @@ def main(in_raster_file, mask_file, out_raster_file):
     :return:
 
     """
-    print(in_raster_file, mask_file, out_raster_file)
+    mask_raster_layers(in_raster_file, [(mask_file, out_raster_file)])
 
-    with fiona.open(mask_file, "r") as mask_file:
-        shapes = [feature["geometry"] for feature in mask_file]
 
-    try:
-        with rasterio.open(in_raster_file)as src:
-            out_image, out_transform = rasterio.mask.mask(src, shapes, all_touched=True, crop=True)
-            out_meta = src.meta
+def mask_batch(raster_masks, presence=False):
+    """
+    Mask each SRTM grid with all of its mangrove polygon layers, reading each grid and loading each layer once
+    :param raster_masks: dictionary of input raster file: list of (mask layer path, prefix) pairs,
+        output files are named <prefix>_<input raster file>
+    :param presence: True to write presence rasters and masked VRTs instead of masked copies (see presence_batch)
+    :return: list of the output raster files written
+    """
+    if presence:
+        return presence_batch(raster_masks)
+    written = []
+    for in_raster, masks in raster_masks.items():
+        mask_outputs = [(mask_file, add_prefix(in_raster, prefix)) for mask_file, prefix in masks]
+        written.extend(mask_raster_layers(in_raster, mask_outputs))
+    return written
 
-        out_meta.update({"driver": "GTiff",
-                         "height": out_image.shape[1],
-                         "width": out_image.shape[2],
-                         "transform": out_transform})
 
-        with rasterio.open(out_raster_file, "w", **out_meta) as dest:
-            dest.write(out_image)
-    except ValueError:
-        # get WindowError if mask does not overlap raster -- just skip these
-        # rasterio.errors.WindowError: windows do not intersect
-        # ValueError: Input shapes do not overlap raster.
-        print("Mask and input raster do not overlap -- no output raster")
-        pass
+def presence_batch(raster_masks):
+    """
+    Masked SRTM grids as VRTs over one presence raster per mask source and tile, instead of masked copies
+    The presence raster of a (mask source, tile) is written for the first grid of the tile and reused by the others
+    :param raster_masks: dictionary of input raster file: list of (mask layer path, prefix) pairs,
+        VRTs are named <prefix>_<input raster name>.vrt
+    :return: list of the VRT files written
+    """
+    written = []
+    # presence raster path: True if written, False if the mask source does not overlap the tile
+    presence_files = {}
+    for in_raster, masks in raster_masks.items():
+        for mask_file, prefix in masks:
+            presence_file = presence_filename(in_raster, prefix)
+            if presence_file not in presence_files:
+                presence_files[presence_file] = write_presence(in_raster, mask_file, presence_file)
+            if presence_files[presence_file]:
+                out_vrt = '{}.vrt'.format(os.path.splitext(add_prefix(in_raster, prefix))[0])
+                written.append(write_masked_vrt(in_raster, presence_file, out_vrt))
+    return written
 
 
 #### ---- SETUP and call main function ----------
 
-# Top level data directory
-data_dir = '/Users/arbailey/natcap/idb/data/work/mangroves'
-
-# Working directory
-work_dir = os.path.join(data_dir, 'srtm')
-
-# Vector shapefile paths
-# World Atlas of Mangroves
-wam_path = os.path.join(data_dir, 'wam_Bahamas_MAR.shp')
-wam_prefix = 'wam'
-# Global Mangrove Watch
-gmw2016_path = os.path.join(data_dir, 'gmw2016_Bahamas_MAR.shp')
-gmw2016_prefix = 'gmw2016'
-# TNC Landsat Mangroves (Andros)
-tnc_path = os.path.join(data_dir, 'tnc_mangroves_andros.shp')
-tnc_prefix = 'tnc'
-# Global Mangrove Forests
-gmf_path = os.path.join(data_dir, 'gmf_bahamas_MAR.shp')
-gmf_prefix = 'gmf'
-# NatCap Mangroves for MAR region
-ncmar_path = os.path.join(data_dir, 'natcap_mangrovesV4_MAR.shp')
-ncmar_prefix = 'ncmar'
-
-
-# Get a list of raster files with the hmax or hba prefix in the work directory
-os.chdir(work_dir)
-hmax_rasters = glob.glob("hmax_*.tif")
-hba_rasters = glob.glob("hba_*.tif")
-
-
-# Create output filenames with prefix based on mangrove data source
-wam_hmax_rasters = [add_prefix(r, wam_prefix) for r in hmax_rasters]
-wam_hba_rasters = [add_prefix(r, wam_prefix) for r in hba_rasters]
-
-gmw2016_hmax_rasters = [add_prefix(r, gmw2016_prefix) for r in hmax_rasters]
-gmw2016_hba_rasters = [add_prefix(r, gmw2016_prefix) for r in hba_rasters]
-
-# WAM mask of Max Height rasters
-for in_raster, out_raster in zip(hmax_rasters, wam_hmax_rasters):
-    main(in_raster, wam_path, out_raster)
-
-# WAM mask of Basal area weighted height rasters
-for in_raster, out_raster in zip(hba_rasters, wam_hba_rasters):
-    main(in_raster, wam_path, out_raster)
-
-# GMW 2016 mask of Max Height rasters
-for in_raster, out_raster in zip(hmax_rasters, gmw2016_hmax_rasters):
-    main(in_raster, gmw2016_path, out_raster)
-
-# GMW 2016 mask of Basal area weighted height rasters
-for in_raster, out_raster in zip(hba_rasters, gmw2016_hba_rasters):
-    main(in_raster, gmw2016_path, out_raster)
-
-# Andros only tiles
-andros_tiles = ['N25W079', 'N25W078', 'N24W079', 'N24W078', 'N23W078']
-hmax_rasters = ['hmax_{}.tif'.format(tile) for tile in andros_tiles]
-hba_rasters = ['hba_{}.tif'.format(tile) for tile in andros_tiles]
-
-# TNC Landsat data
-tnc_hmax_rasters = [add_prefix(r, tnc_prefix) for r in hmax_rasters]
-tnc_hba_rasters = [add_prefix(r, tnc_prefix) for r in hba_rasters]
-
-# TNC Landsat mask of Max Height rasters
-for in_raster, out_raster in zip(hmax_rasters, tnc_hmax_rasters):
-    main(in_raster, tnc_path, out_raster)
-
-# TNC Landsat mask of Basal area weighted height rasters
-for in_raster, out_raster in zip(hba_rasters, tnc_hba_rasters):
-    main(in_raster, tnc_path, out_raster)
-
-##---------  GMF (Bahamas & MAR) and NatCap mangroves (MAR only)
-# Create output filenames with prefix based on mangrove data source
-gmf_hmax_rasters = [add_prefix(r, gmf_prefix) for r in hmax_rasters]
-gmf_hba_rasters = [add_prefix(r, gmf_prefix) for r in hba_rasters]
-
-ncmar_hmax_rasters = [add_prefix(r, ncmar_prefix) for r in hmax_rasters]
-ncmar_hba_rasters = [add_prefix(r, ncmar_prefix) for r in hba_rasters]
-
-# GMF mask of Max Height rasters
-for in_raster, out_raster in zip(hmax_rasters, gmf_hmax_rasters):
-    main(in_raster, gmf_path, out_raster)
-
-# GMF mask of Basal area weighted height rasters
-for in_raster, out_raster in zip(hba_rasters, gmf_hba_rasters):
-    main(in_raster, gmf_path, out_raster)
-
-# ncMAR mask of Max Height rasters
-for in_raster, out_raster in zip(hmax_rasters, ncmar_hmax_rasters):
-    main(in_raster, ncmar_path, out_raster)
-
-# ncMAR mask of Basal area weighted height rasters
-for in_raster, out_raster in zip(hba_rasters, ncmar_hba_rasters):
-    main(in_raster, ncmar_path, out_raster)
+if __name__ == '__main__':
+
+    # Top level data directory
+    data_dir = '/Users/arbailey/natcap/idb/data/work/mangroves'
+
+    # Working directory
+    work_dir = os.path.join(data_dir, 'srtm')
+
+    # Vector shapefile paths
+    # World Atlas of Mangroves
+    wam_path = os.path.join(data_dir, 'wam_Bahamas_MAR.shp')
+    wam_prefix = 'wam'
+    # Global Mangrove Watch
+    gmw2016_path = os.path.join(data_dir, 'gmw2016_Bahamas_MAR.shp')
+    gmw2016_prefix = 'gmw2016'
+    # TNC Landsat Mangroves (Andros)
+    tnc_path = os.path.join(data_dir, 'tnc_mangroves_andros.shp')
+    tnc_prefix = 'tnc'
+    # Global Mangrove Forests
+    gmf_path = os.path.join(data_dir, 'gmf_bahamas_MAR.shp')
+    gmf_prefix = 'gmf'
+    # NatCap Mangroves for MAR region
+    ncmar_path = os.path.join(data_dir, 'natcap_mangrovesV4_MAR.shp')
+    ncmar_prefix = 'ncmar'
+
+    # Get a list of raster files with the hmax or hba prefix in the work directory
+    os.chdir(work_dir)
+    hmax_rasters = glob.glob("hmax_*.tif")
+    hba_rasters = glob.glob("hba_*.tif")
+
+    # Mask layers for each raster, so each raster is read once for all of its masks
+    # WAM and GMW 2016 masks of all Max Height and Basal area weighted height rasters
+    raster_masks = {r: [(wam_path, wam_prefix), (gmw2016_path, gmw2016_prefix)] for r in hmax_rasters + hba_rasters}
+
+    # Andros only tiles
+    andros_tiles = ['N25W079', 'N25W078', 'N24W079', 'N24W078', 'N23W078']
+    andros_rasters = ['hmax_{}.tif'.format(tile) for tile in andros_tiles] + \
+                     ['hba_{}.tif'.format(tile) for tile in andros_tiles]
+
+    # TNC Landsat, GMF (Bahamas & MAR) and NatCap mangroves (MAR only) masks of the Andros tiles
+    for r in andros_rasters:
+        raster_masks.setdefault(r, []).extend([(tnc_path, tnc_prefix), (gmf_path, gmf_prefix),
+                                               (ncmar_path, ncmar_prefix)])
+
+    # Masked copy of every grid for every mask source (<prefix>_<grid>.tif), as read by the downstream scripts
+    # True to write presence rasters and masked VRTs (<prefix>_<grid>.vrt) instead
+    use_presence = False
+    mask_batch(raster_masks, presence=use_presence)
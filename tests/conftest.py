@@ -0,0 +1,82 @@
+""" conftest.py
+
+Date: 2026-10-18
+
+Synthetic rasters and polygon layers shared by the tests
+The pipeline modules live at the top of the repository, so it is put on the import path here
+
+"""
+
+import os
+import sys
+import numpy as np
+import pytest
+import shapely
+import geopandas as gpd
+import rasterio
+from rasterio.transform import from_origin
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+NODATA = -9999.0
+# Geographic height grid: 1/600 degree cells over the lower left corner of tile N20W088
+HGT_ORIGIN = (-88.0, 20.25)
+HGT_RES = 1 / 600
+HGT_SHAPE = (150, 180)
+
+
+def write_raster(path, data, transform, crs, nodata=NODATA, **options):
+    """
+    Write a single band raster
+    """
+    with rasterio.open(path, 'w', driver='GTiff', width=data.shape[1], height=data.shape[0], count=1,
+                       dtype=data.dtype, crs=crs, transform=transform, nodata=nodata, **options) as dst:
+        dst.write(data, 1)
+    return str(path)
+
+
+@pytest.fixture
+def rng():
+    return np.random.default_rng(20)
+
+
+@pytest.fixture
+def utm_raster(tmp_path, rng):
+    """
+    Bathy/G-LiHT like raster in UTM 16N: 1 m cells on the 0,0 lattice, tiled, with nodata cells
+    """
+    data = (rng.random((90, 70)) * 30).astype(np.float32)
+    data[rng.random(data.shape) < 0.2] = NODATA
+    return write_raster(tmp_path / 'utm.tif', data, from_origin(500013.0, 2000042.0, 1.0, 1.0), 'EPSG:32616',
+                        tiled=True, blockxsize=32, blockysize=32)
+
+
+@pytest.fixture
+def height_raster(tmp_path, rng):
+    """
+    SRTM like height grid in EPSG 4326 (hmax_<tile>.tif) with whole meter heights and nodata cells
+    """
+    data = rng.integers(1, 25, HGT_SHAPE).astype(np.float32)
+    data[rng.random(HGT_SHAPE) < 0.05] = NODATA
+    return write_raster(tmp_path / 'hmax_N20W088.tif', data, from_origin(*HGT_ORIGIN, HGT_RES, HGT_RES), 'EPSG:4326')
+
+
+@pytest.fixture
+def mangrove_gdf(rng):
+    """
+    Non-overlapping mangrove polygons over the height grid, one of them across its right edge
+    """
+    left, top = HGT_ORIGIN
+    right = left + HGT_SHAPE[1] * HGT_RES
+    bottom = top - HGT_SHAPE[0] * HGT_RES
+    centers = [(left + 0.05 + 0.07 * i, bottom + 0.05 + 0.07 * j) for i in range(3) for j in range(3)]
+    polygons = [shapely.Point(x, y).buffer(0.01 + 0.02 * rng.random(), quad_segs=5) for x, y in centers]
+    polygons.append(shapely.box(right - 0.03, bottom + 0.1, right + 0.05, bottom + 0.14))
+    return gpd.GeoDataFrame({'mg_id': np.arange(len(polygons))}, geometry=polygons, crs='EPSG:4326')
+
+
+@pytest.fixture
+def mangrove_shp(tmp_path, mangrove_gdf):
+    path = str(tmp_path / 'mangroves.shp')
+    mangrove_gdf.to_file(path)
+    return path
@@ -0,0 +1,75 @@
+""" G-LiHT DTM/CHM tiles to one merged point data set, against a coordinate merge of every tile """
+
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from rasterio.transform import from_origin
+from conftest import write_raster, NODATA
+from raster_points import raster_to_points
+from point_store import read_points, read_partition_index
+from gliht_prep import process_files
+
+DTM_COLS = {'x': 'x_utm16n', 'y': 'y_utm16n', 'z': 'z_dtm_m', 'key': 'gliht_cellkey'}
+CHM_COLS = dict(DTM_COLS, z='z_chm_m')
+
+
+@pytest.fixture
+def gliht_tiles(tmp_path, rng):
+    """
+    Tile a has co-registered DTM and CHM rasters, the CHM of tile b is on a shifted grid, and the CHM of tile c
+    has no DTM tile
+    """
+    dtm_dir = tmp_path / 'dtm'
+    chm_dir = tmp_path / 'chm'
+    dtm_dir.mkdir()
+    chm_dir.mkdir()
+    origins = {'a': (500000.0, 2260040.0), 'b': (500040.0, 2260040.0), 'c': (509000.0, 2260040.0)}
+    for tile, (left, top) in origins.items():
+        chm = (rng.random((40, 40)) * 20).astype(np.float32)
+        chm[rng.random(chm.shape) < 0.2] = NODATA
+        # Shift the CHM grid of tile b by whole cells, so it is on the same lattice but not the same grid
+        chm_left, chm_top = (left + 5, top - 3) if tile == 'b' else (left, top)
+        write_raster(chm_dir / 'gliht_{}_CHM.tif'.format(tile), chm, from_origin(chm_left, chm_top, 1.0, 1.0),
+                     'EPSG:32616')
+        if tile != 'c':
+            dtm = (rng.random((40, 40)) * 5).astype(np.float32)
+            dtm[rng.random(dtm.shape) < 0.1] = NODATA
+            write_raster(dtm_dir / 'gliht_{}_DTM.tif'.format(tile), dtm, from_origin(left, top, 1.0, 1.0),
+                         'EPSG:32616')
+    return str(chm_dir), sorted(os.listdir(chm_dir)), str(dtm_dir), sorted(os.listdir(dtm_dir))
+
+
+def reference_points(chm_dir, chm_files, dtm_dir, dtm_files):
+    """
+    DTM points of every tile with the CHM height of the same cell, merged on the cell center coordinates
+    (whole + 0.5 m here, so they compare exactly)
+    """
+    chm_df = pd.concat([raster_to_points(os.path.join(chm_dir, file), CHM_COLS, 'df') for file in chm_files],
+                       ignore_index=True)
+    dtm_df = pd.concat([raster_to_points(os.path.join(dtm_dir, file), DTM_COLS, 'df') for file in dtm_files],
+                       ignore_index=True)
+    return dtm_df.merge(chm_df[[CHM_COLS['x'], CHM_COLS['y'], CHM_COLS['z']]],
+                        on=[DTM_COLS['x'], DTM_COLS['y']], how='left')
+
+
+@pytest.mark.parametrize('out_format,geometry', [('feather', True), ('parquet', True), ('feather', False)])
+def test_process_files_matches_coordinate_merge(tmp_path, gliht_tiles, out_format, geometry):
+    chm_dir, chm_files, dtm_dir, dtm_files = gliht_tiles
+    out_dir = str(tmp_path / 'out')
+    os.makedirs(out_dir)
+    count = process_files(chm_dir, chm_files, dtm_dir, dtm_files, out_dir, 'gliht', partition=True,
+                          out_format=out_format, geometry=geometry)
+    pts = read_points(os.path.join(out_dir, 'gliht.{}'.format(out_format)))
+    ref_df = reference_points(*gliht_tiles)
+    assert count == len(pts) == len(ref_df)
+    assert np.isfinite(pts[CHM_COLS['z']].values).sum() > 0
+    np.testing.assert_array_equal(np.sort(pts['gliht_ptidx'].values), np.arange(1, count + 1))
+    pts = pts.sort_values([DTM_COLS['x'], DTM_COLS['y']]).reset_index(drop=True)
+    ref_df = ref_df.sort_values([DTM_COLS['x'], DTM_COLS['y']]).reset_index(drop=True)
+    for column in (DTM_COLS['z'], CHM_COLS['z'], DTM_COLS['key']):
+        np.testing.assert_array_equal(pts[column].values, ref_df[column].values)
+
+    index = read_partition_index(os.path.join(out_dir, 'gliht_tiles'))
+    assert sum(partition['count'] for partition in index['partitions'].values()) == count
+    assert not os.path.exists(os.path.join(out_dir, 'gliht_parts'))
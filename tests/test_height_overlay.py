@@ -0,0 +1,99 @@
+""" Raster-native height overlay against per-polygon rasterization, gpd.overlay and the tiled layer store path """
+
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import rasterio
+from rasterio import features
+from height_overlay import overlay_heights, POLYGON_ID, CELLS_COLUMN, AREA_COLUMN, EARTH_RADIUS
+from layer_store import write_layer_store, read_tile_polygons, split_polygons
+from srtm_mangrove_polygons import process_data, process_tile
+
+ATTRIBUTE = 'hmax_m'
+
+
+def reference_counts(height_raster, mangrove_gdf):
+    """
+    Cells and spherical areas of every (polygon, height) from one full grid rasterization per polygon
+    """
+    with rasterio.open(height_raster) as src:
+        height_np = src.read(1, masked=True)
+        transform = src.transform
+    rows = np.arange(height_np.shape[0])
+    lat_top = np.radians(transform.f + transform.e * rows)
+    lat_bottom = np.radians(transform.f + transform.e * (rows + 1))
+    row_areas = EARTH_RADIUS ** 2 * np.radians(transform.a) * (np.sin(lat_top) - np.sin(lat_bottom))
+    cell_areas = np.broadcast_to(row_areas[:, None], height_np.shape)
+    records = []
+    for poly_id, polygon in zip(mangrove_gdf.index, mangrove_gdf.geometry):
+        inside = features.geometry_mask([polygon], height_np.shape, transform, invert=True)
+        inside &= ~np.ma.getmaskarray(height_np)
+        for value in np.unique(height_np.data[inside]):
+            cells = inside & (height_np.data == value)
+            records.append({POLYGON_ID: poly_id, ATTRIBUTE: value, CELLS_COLUMN: cells.sum(),
+                            AREA_COLUMN: cell_areas[cells].sum()})
+    return pd.DataFrame(records)
+
+
+def sorted_counts(height_df):
+    return height_df.sort_values([POLYGON_ID, ATTRIBUTE]).reset_index(drop=True)
+
+
+def test_overlay_matches_per_polygon_rasterization(height_raster, mangrove_gdf, monkeypatch):
+    # Small row blocks, so polygons span several blocks
+    monkeypatch.setattr('height_overlay.OVERLAY_ROWS', 16)
+    height_df = sorted_counts(overlay_heights(height_raster, mangrove_gdf, ATTRIBUTE))
+    ref_df = sorted_counts(reference_counts(height_raster, mangrove_gdf))
+    np.testing.assert_array_equal(height_df[[POLYGON_ID, ATTRIBUTE, CELLS_COLUMN]].values,
+                                  ref_df[[POLYGON_ID, ATTRIBUTE, CELLS_COLUMN]].values)
+    np.testing.assert_allclose(height_df[AREA_COLUMN].values, ref_df[AREA_COLUMN].values, rtol=1e-9)
+    assert (height_df['mg_id'] == height_df[POLYGON_ID]).all()
+
+
+def test_overlay_bins_sum_the_height_classes(height_raster, mangrove_gdf):
+    bins = [0, 5, 10, 30]
+    binned_df = overlay_heights(height_raster, mangrove_gdf, ATTRIBUTE, bins=bins)
+    height_df = overlay_heights(height_raster, mangrove_gdf, ATTRIBUTE)
+    height_df[ATTRIBUTE] = np.array(bins)[np.digitize(height_df[ATTRIBUTE], bins) - 1]
+    ref_df = height_df.groupby([POLYGON_ID, ATTRIBUTE], as_index=False)[[CELLS_COLUMN, AREA_COLUMN]].sum()
+    binned_df = sorted_counts(binned_df)
+    np.testing.assert_array_equal(binned_df[[POLYGON_ID, ATTRIBUTE, CELLS_COLUMN]].values,
+                                  sorted_counts(ref_df)[[POLYGON_ID, ATTRIBUTE, CELLS_COLUMN]].values)
+
+
+def test_overlay_pieces_are_inside_vector_overlay(height_raster, mangrove_gdf):
+    pieces_gdf = overlay_heights(height_raster, mangrove_gdf, ATTRIBUTE, geometry=True)
+    vector_file = process_data(height_raster, mangrove_gdf, ATTRIBUTE, method='vector')
+    vector_gdf = gpd.read_file(vector_file).dissolve(by=['mg_id', ATTRIBUTE]).reset_index()
+    merged = pieces_gdf.merge(vector_gdf, on=['mg_id', ATTRIBUTE], suffixes=('', '_vector'))
+    assert len(merged) == len(pieces_gdf)
+    # Areas in square degrees
+    outside = shapely.area(shapely.difference(merged.geometry.values, merged['geometry_vector'].values))
+    assert outside.max() < 1e-12
+
+
+def test_tile_from_layer_store_matches_whole_layer(tmp_path, height_raster, mangrove_gdf):
+    store_path = write_layer_store(mangrove_gdf, str(tmp_path / 'mangroves.parquet'))
+    out_file = process_tile(height_raster, store_path, ATTRIBUTE, method='raster')
+    assert out_file == os.path.splitext(height_raster)[0] + '_overlay.csv'
+    tile_df = sorted_counts(pd.read_csv(out_file))
+    full_df = sorted_counts(overlay_heights(height_raster, mangrove_gdf, ATTRIBUTE))
+    np.testing.assert_array_equal(tile_df[[POLYGON_ID, ATTRIBUTE, CELLS_COLUMN]].values,
+                                  full_df[[POLYGON_ID, ATTRIBUTE, CELLS_COLUMN]].values)
+
+    with rasterio.open(height_raster) as src:
+        tile_gdf = read_tile_polygons(store_path, src.bounds)
+    assert set(tile_gdf.index) == set(mangrove_gdf.index)
+
+
+def test_split_polygons_overlay_as_whole_polygons(height_raster, mangrove_gdf):
+    layer_gdf = mangrove_gdf.copy()
+    layer_gdf[POLYGON_ID] = layer_gdf.index.values
+    split_gdf = split_polygons(layer_gdf, size=0.05).set_index(POLYGON_ID)
+    assert len(split_gdf) > len(mangrove_gdf)
+    split_df = sorted_counts(overlay_heights(height_raster, split_gdf, ATTRIBUTE))
+    full_df = sorted_counts(overlay_heights(height_raster, mangrove_gdf, ATTRIBUTE))
+    np.testing.assert_array_equal(split_df[[POLYGON_ID, ATTRIBUTE, CELLS_COLUMN]].values,
+                                  full_df[[POLYGON_ID, ATTRIBUTE, CELLS_COLUMN]].values)
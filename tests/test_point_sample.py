@@ -0,0 +1,88 @@
+""" Point sampling and presence flags against rasterio sample, a unique id raster and gpd.sjoin """
+
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import rasterio
+from rasterio import features
+from conftest import write_raster, HGT_ORIGIN, HGT_RES, HGT_SHAPE
+from point_sample import sample_points, sample_cell_index, sample_rasters
+from point_presence import presence_flags, polygon_tree, presence_raster, raster_presence_flags
+
+
+def random_points(rng, n=3000, margin=0.02):
+    """
+    Points over the height grid and a margin around it (outside the raster)
+    """
+    left, top = HGT_ORIGIN
+    width = HGT_SHAPE[1] * HGT_RES
+    height = HGT_SHAPE[0] * HGT_RES
+    x = left - margin + rng.random(n) * (width + 2 * margin)
+    y = top + margin - rng.random(n) * (height + 2 * margin)
+    return x, y
+
+
+def test_sample_points_matches_rasterio_sample(height_raster, rng):
+    x, y = random_points(rng)
+    with rasterio.open(height_raster) as src:
+        ref = np.array([value[0] for value in src.sample(zip(x, y), masked=False)])
+    np.testing.assert_array_equal(sample_points(height_raster, x, y), ref)
+
+
+def test_sample_cell_index_matches_id_raster(tmp_path, height_raster, rng):
+    x, y = random_points(rng, margin=0)
+    with rasterio.open(height_raster) as src:
+        ids = (np.arange(src.height * src.width).reshape(src.height, src.width) + 1).astype(np.uint32)
+        id_raster = write_raster(tmp_path / 'uniqueid.tif', ids, src.transform, src.crs, nodata=0)
+    np.testing.assert_array_equal(sample_cell_index(height_raster, x, y), sample_points(id_raster, x, y))
+
+
+def test_sample_rasters_matches_one_raster_at_a_time(tmp_path, height_raster, rng):
+    x, y = random_points(rng)
+    with rasterio.open(height_raster) as src:
+        second = write_raster(tmp_path / 'hba_N20W088.tif', src.read(1) / 2, src.transform, src.crs)
+    pts_df = pd.DataFrame({'lon': x, 'lat': y})
+    sample_rasters(pts_df, [(height_raster, 'hmax'), (second, 'hba')], index_columns=[(height_raster, 'idx')])
+    np.testing.assert_array_equal(pts_df['hmax'].values, sample_points(height_raster, x, y))
+    np.testing.assert_array_equal(pts_df['hba'].values, sample_points(second, x, y))
+    np.testing.assert_array_equal(pts_df['idx'].values, sample_cell_index(height_raster, x, y))
+
+
+def test_presence_flags_match_sjoin(mangrove_shp, mangrove_gdf, rng):
+    x, y = random_points(rng)
+    pts_gdf = gpd.GeoDataFrame(geometry=gpd.points_from_xy(x, y), crs='EPSG:4326')
+    joined = gpd.sjoin(pts_gdf, mangrove_gdf, how='left', predicate='intersects')
+    ref = (~joined.groupby(level=0)['index_right'].first().isna()).astype(np.uint8).values
+    flags = presence_flags(x, y, polygon_tree(mangrove_shp), chunk_size=700)
+    np.testing.assert_array_equal(flags, ref)
+    assert flags.sum() > 0
+
+
+def test_raster_presence_flags_match_rasterized_layer(tmp_path, mangrove_shp, mangrove_gdf, height_raster, rng):
+    x, y = random_points(rng)
+    presence_path = presence_raster(mangrove_shp, height_raster, str(tmp_path / 'presence'))
+    # Written under a temporary name and renamed, nothing else is left in the cache
+    assert os.listdir(tmp_path / 'presence') == [os.path.basename(presence_path)]
+    with rasterio.open(height_raster) as src:
+        burned = features.rasterize(mangrove_gdf.geometry, out_shape=src.shape, transform=src.transform,
+                                    dtype=np.uint8)
+        rows, cols = rasterio.transform.rowcol(src.transform, x, y)
+    rows = np.asarray(rows)
+    cols = np.asarray(cols)
+    inside = (rows >= 0) & (rows < burned.shape[0]) & (cols >= 0) & (cols < burned.shape[1])
+    ref = np.zeros(len(x), dtype=np.uint8)
+    ref[inside] = burned[rows[inside], cols[inside]]
+    np.testing.assert_array_equal(raster_presence_flags(x, y, presence_path), ref)
+
+
+def test_raster_presence_at_cell_centers_matches_exact_flags(tmp_path, mangrove_shp, height_raster):
+    # Cells are burned when their center is in a polygon, so the flags of cell centers are exact
+    with rasterio.open(height_raster) as src:
+        rows, cols = np.indices(src.shape).reshape(2, -1)
+        x, y = rasterio.transform.xy(src.transform, rows, cols)
+    x = np.asarray(x)
+    y = np.asarray(y)
+    presence_path = presence_raster(mangrove_shp, height_raster, str(tmp_path / 'presence'))
+    np.testing.assert_array_equal(raster_presence_flags(x, y, presence_path),
+                                  presence_flags(x, y, polygon_tree(mangrove_shp)))
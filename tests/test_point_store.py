@@ -0,0 +1,75 @@
+""" Point clips and point stores: bounding box selections against a clip of the full point set """
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+import pytest
+from point_store import read_points, write_points, write_partitioned
+from point_table import write_point_table, to_geodataframe, bbox_mask, COORD_SCALE
+
+BOUNDS = (-87.62, 20.41, -87.48, 20.57)
+
+
+@pytest.fixture
+def pts_table(rng):
+    """
+    Point table over two SRTM tiles
+    """
+    n = 250000
+    pts_df = pd.DataFrame({'z_m': rng.random(n), 'lon': rng.uniform(-88.5, -87.0, n), 'lat': rng.uniform(20.0, 21.0, n)})
+    pts_df.attrs['crs'] = 'EPSG:4326'
+    return pts_df
+
+
+def clipped(pts_df, bounds=BOUNDS):
+    return pts_df[bbox_mask(pts_df['lon'].values, pts_df['lat'].values, bounds)]
+
+
+def test_bbox_mask_matches_intersects(pts_table):
+    pts_gdf = gpd.GeoDataFrame(geometry=gpd.points_from_xy(pts_table['lon'], pts_table['lat']), crs='EPSG:4326')
+    np.testing.assert_array_equal(clipped(pts_table).index.values,
+                                  np.flatnonzero(pts_gdf.geometry.intersects(shapely.box(*BOUNDS))))
+
+
+def assert_same_points(pts_df, ref_df):
+    order = np.lexsort((pts_df['lat'].values, pts_df['lon'].values))
+    ref_order = np.lexsort((ref_df['lat'].values, ref_df['lon'].values))
+    for column in ('z_m', 'lon', 'lat'):
+        np.testing.assert_array_equal(pts_df[column].values[order], ref_df[column].values[ref_order])
+
+
+@pytest.mark.parametrize('extension', ['parquet', 'feather'])
+def test_point_table_bounds(tmp_path, pts_table, extension):
+    out_path = str(tmp_path / 'pts.{}'.format(extension))
+    write_points(pts_table, out_path)
+    assert_same_points(read_points(out_path, bounds=BOUNDS), clipped(pts_table))
+    assert_same_points(read_points(out_path), pts_table)
+
+
+def test_scaled_point_table_bounds(tmp_path, pts_table):
+    out_path = str(tmp_path / 'pts.parquet')
+    write_point_table(pts_table, out_path, scale=COORD_SCALE)
+    full_df = read_points(out_path)
+    np.testing.assert_allclose(full_df['lon'].values.max(), pts_table['lon'].max(), rtol=0, atol=COORD_SCALE)
+    # Bounds apply to the stored (rounded) coordinates
+    assert_same_points(read_points(out_path, bounds=BOUNDS), clipped(full_df))
+
+
+def test_geoparquet_bounds(tmp_path, pts_table):
+    pts_gdf = to_geodataframe(pts_table, drop_xy=False)
+    out_path = str(tmp_path / 'pts.parquet')
+    write_points(pts_gdf, out_path)
+    pts = read_points(out_path, bounds=BOUNDS)
+    assert isinstance(pts, gpd.GeoDataFrame)
+    assert_same_points(pts, clipped(pts_table))
+
+
+def test_partitioned_store_bounds(tmp_path, pts_table):
+    store_dir = str(tmp_path / 'pts_tiles')
+    index = write_partitioned(pts_table, store_dir)
+    assert len(index['partitions']) == 2
+    pts = read_points(store_dir, bounds=BOUNDS)
+    # Only the overlapping partition is read, the points still have to be clipped to the box
+    assert_same_points(clipped(pts), clipped(pts_table))
+    assert len(pts) < len(pts_table)
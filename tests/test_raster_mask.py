@@ -0,0 +1,60 @@
+""" Masked height grids and presence rasters against rasterio.mask.mask """
+
+import numpy as np
+import rasterio
+import rasterio.mask
+from raster_mask import mask_raster_layers, mask_raster_windowed
+from presence_raster import write_presence, write_masked_vrt, read_masked, masked_heights, height_histogram
+
+
+def reference_mask(height_raster, mangrove_gdf, crop):
+    with rasterio.open(height_raster) as src:
+        return rasterio.mask.mask(src, list(mangrove_gdf.geometry), all_touched=True, crop=crop, filled=False)
+
+
+def test_mask_raster_layers_matches_mask(tmp_path, height_raster, mangrove_shp, mangrove_gdf):
+    out_file = str(tmp_path / 'wam_hmax_N20W088.tif')
+    assert mask_raster_layers(height_raster, [(mangrove_shp, out_file)]) == [out_file]
+    ref_image, ref_transform = reference_mask(height_raster, mangrove_gdf, crop=True)
+    with rasterio.open(out_file) as out:
+        assert out.transform == ref_transform
+        np.testing.assert_array_equal(out.read(), ref_image.filled(out.nodata))
+
+
+def test_mask_raster_windowed_matches_mask(tmp_path, height_raster, mangrove_shp, mangrove_gdf, monkeypatch):
+    # Small output tiles, so the grid is masked over several windows
+    monkeypatch.setattr('raster_mask.OUT_BLOCK_SIZE', 32)
+    out_file = str(tmp_path / 'wam_hmax_N20W088.tif')
+    assert mask_raster_windowed(height_raster, mangrove_shp, out_file)
+    ref_image, ref_transform = reference_mask(height_raster, mangrove_gdf, crop=True)
+    with rasterio.open(out_file) as out:
+        assert out.transform == ref_transform
+        np.testing.assert_array_equal(out.read(), ref_image.filled(out.nodata))
+
+
+def test_presence_raster_masks_like_mask(tmp_path, height_raster, mangrove_shp, mangrove_gdf):
+    presence_file = str(tmp_path / 'wam_presence_N20W088.tif')
+    assert write_presence(height_raster, mangrove_shp, presence_file)
+    ref_image = reference_mask(height_raster, mangrove_gdf, crop=False)[0][0]
+    masked = read_masked(height_raster, presence_file)
+    np.testing.assert_array_equal(np.ma.getmaskarray(masked), np.ma.getmaskarray(ref_image))
+    np.testing.assert_array_equal(masked.compressed(), ref_image.compressed())
+    np.testing.assert_array_equal(np.sort(masked_heights(height_raster, presence_file)),
+                                  np.sort(ref_image.compressed()))
+    bins = np.arange(0, 30, 5)
+    np.testing.assert_array_equal(height_histogram(height_raster, presence_file, bins)[0],
+                                  np.histogram(ref_image.compressed(), bins)[0])
+
+    # The masked VRT reads as the masked grid
+    out_vrt = write_masked_vrt(height_raster, presence_file, str(tmp_path / 'wam_hmax_N20W088.vrt'))
+    with rasterio.open(out_vrt) as vrt:
+        vrt_np = vrt.read(1, masked=True)
+    np.testing.assert_array_equal(np.ma.getmaskarray(vrt_np), np.ma.getmaskarray(ref_image))
+    np.testing.assert_array_equal(vrt_np.compressed(), ref_image.compressed())
+
+
+def test_no_output_without_overlap(tmp_path, height_raster, mangrove_gdf):
+    far_shp = str(tmp_path / 'far.shp')
+    mangrove_gdf.set_geometry(mangrove_gdf.translate(10, 10)).to_file(far_shp)
+    assert mask_raster_layers(height_raster, [(far_shp, str(tmp_path / 'far_hmax.tif'))]) == []
+    assert not write_presence(height_raster, far_shp, str(tmp_path / 'far_presence.tif'))
@@ -0,0 +1,103 @@
+""" Raster to point conversion, in memory and streamed, against per-cell rasterio and GeoDataFrame.to_crs references """
+
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from geofeather import from_geofeather
+from conftest import write_raster, NODATA
+from raster_points import (raster_to_points, raster_pair_to_points, raster_to_points_file, cell_keys, key_join,
+                           lattice_origin)
+from reproject import transform_xy
+
+COLS = {'x': 'x_utm', 'y': 'y_utm', 'z': 'z_m', 'key': 'cellkey'}
+
+
+def reference_points(raster_path):
+    """
+    Valid cells of a raster one at a time with DatasetReader.xy, the original conversion
+    """
+    with rasterio.open(raster_path) as src:
+        data = src.read(1)
+        rows, cols = np.nonzero(data != src.nodata)
+        xy = [src.xy(row, col) for row, col in zip(rows, cols)]
+    return pd.DataFrame({COLS['z']: data[rows, cols], COLS['x']: [x for x, _ in xy], COLS['y']: [y for _, y in xy]})
+
+
+def test_raster_to_points_matches_cell_by_cell(utm_raster):
+    pts_df = raster_to_points(utm_raster, COLS, 'df')
+    ref_df = reference_points(utm_raster)
+    pd.testing.assert_frame_equal(pts_df[[COLS['z'], COLS['x'], COLS['y']]], ref_df)
+    assert pts_df[COLS['key']].is_unique
+
+
+def test_raster_to_points_gdf_matches_to_crs(utm_raster):
+    pts_gdf = raster_to_points(utm_raster, COLS, 'gdf')
+    ref_gdf = gpd.GeoDataFrame(geometry=gpd.points_from_xy(pts_gdf[COLS['x']], pts_gdf[COLS['y']]),
+                               crs='EPSG:32616').to_crs(4326)
+    np.testing.assert_allclose(pts_gdf.geometry.x.values, ref_gdf.geometry.x.values, rtol=0, atol=1e-9)
+    np.testing.assert_allclose(pts_gdf.geometry.y.values, ref_gdf.geometry.y.values, rtol=0, atol=1e-9)
+
+
+def test_transform_xy_threads_match_single_call(rng):
+    x = 500000 + rng.random(2500) * 1000
+    y = 2000000 + rng.random(2500) * 1000
+    lon, lat = transform_xy(x, y, 32616, 4326)
+    lon_t, lat_t = transform_xy(x, y, 'EPSG:32616', 'EPSG:4326', chunk_size=300, threads=4)
+    np.testing.assert_array_equal(lon, lon_t)
+    np.testing.assert_array_equal(lat, lat_t)
+
+
+@pytest.mark.parametrize('out_format', ['feather', 'parquet'])
+def test_streamed_points_match_in_memory(tmp_path, utm_raster, out_format):
+    cols = {key: COLS[key] for key in ('x', 'y', 'z')}
+    out_path = str(tmp_path / 'pts.{}'.format(out_format))
+    count = raster_to_points_file(utm_raster, cols, out_path, out_format=out_format, chunk_size=500)
+    if out_format == 'feather':
+        streamed = from_geofeather(out_path)
+    else:
+        streamed = gpd.read_parquet(out_path)
+    in_memory = raster_to_points(utm_raster, cols, 'gdf')
+    assert count == len(in_memory)
+    # Parquet points are sorted by area, compare in raster order
+    streamed = streamed.sort_values([cols['y'], cols['x']], ascending=[False, True]).reset_index(drop=True)
+    np.testing.assert_array_equal(streamed[cols['z']].values, in_memory[cols['z']].values)
+    np.testing.assert_allclose(streamed.geometry.x.values, in_memory.geometry.x.values, rtol=0, atol=1e-9)
+    np.testing.assert_allclose(streamed.geometry.y.values, in_memory.geometry.y.values, rtol=0, atol=1e-9)
+
+
+def test_cell_keys_match_between_offset_rasters(tmp_path, rng):
+    # A second raster on the same lattice, shifted by whole cells and with its own nodata cells
+    base = (rng.random((20, 30)) * 10).astype(np.float32)
+    shifted = (rng.random((25, 25)) * 10).astype(np.float32)
+    shifted[rng.random(shifted.shape) < 0.3] = NODATA
+    base_path = write_raster(tmp_path / 'dtm.tif', base, from_origin(600000.0, 2100000.0, 1.0, 1.0), 'EPSG:32616')
+    join_path = write_raster(tmp_path / 'chm.tif', shifted, from_origin(600007.0, 2099995.0, 1.0, 1.0),
+                             'EPSG:32616')
+    base_df = raster_to_points(base_path, COLS, 'df')
+    join_df = raster_to_points(join_path, COLS, 'df')
+    joined = key_join(base_df[COLS['key']].values, join_df[COLS['key']].values, join_df[COLS['z']].values)
+    # Reference: merge on the cell center coordinates, which are whole + 0.5 m here and compare exactly
+    ref = base_df.merge(join_df, on=[COLS['x'], COLS['y']], how='left', suffixes=('', '_join'))
+    np.testing.assert_array_equal(joined, ref[COLS['z'] + '_join'].values)
+    assert np.isfinite(joined).sum() > 0
+
+
+def test_raster_pair_matches_key_join(tmp_path, utm_raster, rng):
+    with rasterio.open(utm_raster) as src:
+        join = (rng.random((src.height, src.width)) * 5).astype(np.float32)
+        join[rng.random(join.shape) < 0.3] = NODATA
+        join_path = write_raster(tmp_path / 'join.tif', join, src.transform, src.crs)
+    pair_df = raster_pair_to_points(utm_raster, join_path, dict(COLS, join_z='join_m'), 'df')
+    base_df = raster_to_points(utm_raster, COLS, 'df')
+    join_df = raster_to_points(join_path, COLS, 'df')
+    joined = key_join(base_df[COLS['key']].values, join_df[COLS['key']].values, join_df[COLS['z']].values)
+    np.testing.assert_array_equal(pair_df['join_m'].values, joined)
+
+
+def test_cell_keys_need_lattice_aligned_origin():
+    assert lattice_origin(from_origin(-30.0, 60.0, 10.0, 10.0)) == (-3, 6)
+    with pytest.raises(ValueError):
+        cell_keys(from_origin(0.5, 10.0, 1.0, 1.0), np.arange(3), np.arange(3))
@@ -0,0 +1,35 @@
+""" Tile scheduling: results in task order, failed tiles reported, slow tiles stopped """
+
+import os
+import time
+from tile_farm import run_tiles
+
+
+def test_run_tiles_pool(tmp_path):
+    tasks = [('exists', os.path.exists, (str(tmp_path),)),
+             ('missing', os.listdir, (str(tmp_path / 'missing'),)),
+             ('skipped', time.sleep, (0,))]
+    results = run_tiles(tasks, workers=2, sizes=[1, 3, 2])
+    assert [result['tile'] for result in results] == ['exists', 'missing', 'skipped']
+    assert [result['status'] for result in results] == ['done', 'failed', 'skipped']
+    assert 'FileNotFoundError' in results[1]['error']
+
+
+def test_run_tiles_supervised_timeout_and_retry(tmp_path):
+    tasks = [('slow', time.sleep, (30,)),
+             ('missing', os.listdir, (str(tmp_path / 'missing'),)),
+             ('exists', os.path.exists, (str(tmp_path),))]
+    start = time.time()
+    results = run_tiles(tasks, workers=2, timeout=1, retries=1)
+    assert time.time() - start < 20
+    assert [result['status'] for result in results] == ['timeout', 'failed', 'done']
+    assert [result['attempts'] for result in results] == [2, 2, 1]
+
+
+def test_run_tiles_supervised_keeps_tasks_with_the_same_name(tmp_path):
+    tasks = [('tile', os.path.exists, (str(tmp_path),)),
+             ('tile', os.listdir, (str(tmp_path / 'missing'),)),
+             ('tile', time.sleep, (0,))]
+    results = run_tiles(tasks, workers=2, sizes=[1, 3, 2], retries=1)
+    assert [result['status'] for result in results] == ['done', 'failed', 'skipped']
+    assert [result['attempts'] for result in results] == [1, 2, 1]
@@ -0,0 +1,253 @@
+""" tile_farm.py
+
+Date: 2026-10-18
+
+Run a per-tile function over many raster tiles in a process pool, with timing for every tile
+Used by srtm_mangrovehgt.py and srtm_mangrove_polygons.py
+
+Zipped SRTM tiles (*.hgt.zip) are extracted once into a local cache directory, so workers open a plain file
+instead of decompressing the zip on every open, and tiles whose outputs are already newer than their inputs
+are skipped
+
+Tiles can be scheduled largest first (so one big tile doesn't start last and hold up the batch), and with a
+timeout, each tile runs in its own worker process, which is stopped when the tile runs over the timeout.
+Failed and timed out tiles are retried, and the summary lists the time, status and attempts of every tile
+
+"""
+
+import os
+import sys
+import time
+import datetime
+import zipfile
+import traceback
+import subprocess
+import multiprocessing
+from multiprocessing.connection import wait
+
+
+def time_elapsed(start_time):
+    """
+    Calculate a string representation of  elapsed time given an input start time
+    :param start_time: Start time
+    :return: current time - start time formatted as hours:minutes:seconds
+    """
+    te = time.time() - start_time
+    return str(datetime.timedelta(seconds=te))
+
+
+def physical_cores():
+    """
+    Number of physical CPU cores; multiprocessing.cpu_count() counts hyperthreads (16 on an 8 core machine)
+    :return: number of physical cores, or the number of logical CPUs if it can't be found
+    """
+    if sys.platform == 'darwin':
+        try:
+            return int(subprocess.check_output(['sysctl', '-n', 'hw.physicalcpu']))
+        except (OSError, subprocess.CalledProcessError, ValueError):
+            pass
+    elif os.path.exists('/proc/cpuinfo'):
+        cores = set()
+        physical_id = None
+        with open('/proc/cpuinfo') as cpuinfo:
+            for line in cpuinfo:
+                key, _, value = line.partition(':')
+                key = key.strip()
+                if key == 'physical id':
+                    physical_id = value.strip()
+                elif key == 'core id':
+                    cores.add((physical_id, value.strip()))
+        if cores:
+            return len(cores)
+    return multiprocessing.cpu_count()
+
+
+def extract_zip(zip_path, cache_dir):
+    """
+    Extract a zipped tile into a cache directory, once: a cached file newer than the zip is reused
+    :param zip_path: path to the zip file with a single raster (e.g. N20W088.SRTMGL1.hgt.zip)
+    :param cache_dir: directory for extracted files
+    :return: path to the extracted raster file
+    """
+    with zipfile.ZipFile(zip_path) as zip_file:
+        member = zip_file.namelist()[0]
+        out_path = os.path.join(cache_dir, os.path.basename(member))
+        if not os.path.exists(out_path) or os.path.getmtime(out_path) < os.path.getmtime(zip_path):
+            os.makedirs(cache_dir, exist_ok=True)
+            # extract to a temporary name first, so a partial file is never mistaken for a cached one
+            tmp_path = "{}.{}.tmp".format(out_path, os.getpid())
+            with zip_file.open(member) as src, open(tmp_path, 'wb') as dst:
+                while True:
+                    chunk = src.read(1 << 20)
+                    if not chunk:
+                        break
+                    dst.write(chunk)
+            os.replace(tmp_path, out_path)
+    return out_path
+
+
+def outputs_current(input_paths, output_paths):
+    """
+    Check whether all outputs of a tile exist and are newer than all its inputs
+    :param input_paths: list of input file paths
+    :param output_paths: list of output file paths
+    :return: True if the tile does not need to be processed again
+    """
+    if not all(os.path.exists(path) for path in output_paths):
+        return False
+    newest_input = max(os.path.getmtime(path) for path in input_paths)
+    return min(os.path.getmtime(path) for path in output_paths) >= newest_input
+
+
+def run_tile(task):
+    """
+    Run one tile task and time it, catching errors so one failed tile doesn't stop the batch
+    Run in a worker process by run_tiles, so it takes a single tuple argument
+    :param task: tuple of (tile name, function, tuple of arguments)
+    :return: dictionary with tile, status ('done', 'skipped' or 'failed'), seconds and result or error
+    """
+    tile, func, args = task
+    start_time = time.time()
+    try:
+        result = func(*args)
+        status = 'skipped' if result is None else 'done'
+        error = None
+    except Exception:
+        result = None
+        status = 'failed'
+        error = traceback.format_exc()
+    seconds = time.time() - start_time
+    print("{}: {} in {}".format(tile, status, datetime.timedelta(seconds=seconds)))
+    return {'tile': tile, 'status': status, 'seconds': seconds, 'result': result, 'error': error, 'attempts': 1}
+
+
+def send_tile_result(task, conn):
+    """
+    Run one tile task in its own process and send the run_tile result back to the scheduler
+    :param task: tuple of (tile name, function, tuple of arguments)
+    :param conn: write end of a multiprocessing Pipe
+    :return:
+    """
+    conn.send(run_tile(task))
+    conn.close()
+
+
+def run_supervised(tasks, workers=1, timeout=None, retries=0):
+    """
+    Run tile tasks with up to `workers` at a time, each in its own process, stopping tiles that run over the
+    timeout and retrying failed and timed out tiles
+    :param tasks: list of (tile name, function, tuple of arguments) tuples, in the order they are started
+    :param workers: number of tiles run at the same time
+    :param timeout: seconds a tile may run before its process is terminated, None for no limit
+    :param retries: number of times a failed or timed out tile is run again
+    :return: list of run_tile result dictionaries (status 'timeout' for timed out tiles), in the same order as tasks
+    """
+    # (task index, task, attempt), popped from the end
+    pending = [(i, task, 1) for i, task in enumerate(tasks)]
+    pending.reverse()
+    # read end of the result pipe of each running tile: (process, task index, task, attempt, start time)
+    running = {}
+    # by task index, so tasks with the same tile name keep their own results
+    results = [None] * len(tasks)
+
+    def finish(i, task, attempt, result):
+        if result['status'] in ('failed', 'timeout') and attempt <= retries:
+            print("{}: {}, retrying (attempt {} of {})".format(task[0], result['status'], attempt + 1, retries + 1))
+            pending.append((i, task, attempt + 1))
+        else:
+            result['attempts'] = attempt
+            results[i] = result
+
+    while pending or running:
+        while pending and len(running) < workers:
+            i, task, attempt = pending.pop()
+            recv_conn, send_conn = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=send_tile_result, args=(task, send_conn))
+            process.start()
+            send_conn.close()
+            running[recv_conn] = (process, i, task, attempt, time.time())
+
+        wait_seconds = None
+        if timeout is not None:
+            wait_seconds = max(0, min(start + timeout for _, _, _, _, start in running.values()) - time.time())
+        # a result is ready, or a process ended without sending one (killed or crashed: end of file on its pipe)
+        for conn in wait(list(running), wait_seconds):
+            process, i, task, attempt, start = running.pop(conn)
+            try:
+                result = conn.recv()
+            except EOFError:
+                result = None
+            conn.close()
+            process.join()
+            if result is None:
+                error = "Worker process exited with code {}".format(process.exitcode)
+                print("{}: {}".format(task[0], error))
+                result = {'tile': task[0], 'status': 'failed', 'seconds': time.time() - start, 'result': None,
+                          'error': error, 'attempts': attempt}
+            finish(i, task, attempt, result)
+
+        if timeout is None:
+            continue
+        now = time.time()
+        for conn, (process, i, task, attempt, start) in list(running.items()):
+            if now - start > timeout and not conn.poll():
+                del running[conn]
+                process.terminate()
+                process.join()
+                conn.close()
+                error = "Stopped after {}".format(datetime.timedelta(seconds=timeout))
+                print("{}: {}".format(task[0], error))
+                finish(i, task, attempt, {'tile': task[0], 'status': 'timeout', 'seconds': now - start, 'result': None,
+                                       'error': error, 'attempts': attempt})
+    return results
+
+
+def run_tiles(tasks, workers=1, sizes=None, timeout=None, retries=0):
+    """
+    Run tile tasks, in a process pool if more than one worker, and print a timing summary
+    :param tasks: list of (tile name, function, tuple of arguments) tuples; the function returns None
+        for a skipped tile. Functions and arguments must be picklable (module level functions)
+    :param workers: number of worker processes
+    :param sizes: list of task sizes (any measure of work, e.g. polygon counts), to start the largest tiles first,
+        None to start tiles in the order of tasks
+    :param timeout: seconds a tile may run before it is stopped, None for no limit
+    :param retries: number of times a failed or timed out tile is run again
+    :return: list of run_tile result dictionaries, in the same order as tasks
+    """
+    start_time = time.time()
+    print("Processing {} tiles with {} workers".format(len(tasks), workers))
+    order = list(range(len(tasks)))
+    if sizes is not None:
+        order.sort(key=lambda i: sizes[i], reverse=True)
+    ordered_tasks = [tasks[i] for i in order]
+    if timeout is not None or retries:
+        ordered_results = run_supervised(ordered_tasks, workers, timeout, retries)
+    elif workers > 1:
+        with multiprocessing.Pool(workers) as pool:
+            ordered_results = pool.map(run_tile, ordered_tasks, chunksize=1)
+    else:
+        ordered_results = [run_tile(task) for task in ordered_tasks]
+    results = [None] * len(tasks)
+    for i, result in zip(order, ordered_results):
+        results[i] = result
+    print_summary(results)
+    print("Total processing time for {} tiles: {}".format(len(tasks), time_elapsed(start_time)))
+    return results
+
+
+def print_summary(results):
+    """
+    Print the time per tile (slowest first), the status counts and the errors of failed and timed out tiles
+    :param results: list of run_tile result dictionaries
+    :return:
+    """
+    print("---- Tile timing ----")
+    for result in sorted(results, key=lambda r: r['seconds'], reverse=True):
+        print("{:<24} {:<8} {:<16} attempts: {}".format(result['tile'], result['status'],
+                                                        str(datetime.timedelta(seconds=result['seconds'])),
+                                                        result['attempts']))
+    for status in ('done', 'skipped', 'failed', 'timeout'):
+        print("{} {}".format(sum(result['status'] == status for result in results), status))
+    for result in results:
+        if result['status'] in ('failed', 'timeout'):
+            print("---- {} {} ----\n{}".format(result['tile'], result['status'], result['error']))